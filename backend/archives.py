@@ -0,0 +1,244 @@
+"""
+Monthly archives of old time entries
+Finished entries that started more than CHRONA_ARCHIVE_AFTER_DAYS ago are packed
+into entry_archives/{user_id}_{YYYY-MM} documents per user and UTC month, as
+parallel arrays instead of one document per entry. A month that outgrows one
+document continues in parts {user_id}_{YYYY-MM}_{n}. Archived entries are
+read-only and no longer count towards their task's entry_count; the list and
+stats read paths merge them with the live entries.
+"""
+
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+import layout
+import rollups
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLLECTION = 'entry_archives'
+
+# Entries younger than this are never archived
+ARCHIVE_AFTER = timedelta(days=int(os.environ.get("CHRONA_ARCHIVE_AFTER_DAYS", "90")))
+
+# Entries moved per transaction, Firestore allows at most 500 writes
+COMPACTION_BATCH_SIZE = 400
+
+# Estimated size at which an archive part is full, below Firestore's 1 MiB
+# document limit to leave room for field names and index entries
+ARCHIVE_PART_BYTES = 900 * 1024
+
+# Estimated bytes per archived entry besides its ID and notes: five numbers of
+# 8 bytes plus the array element overhead
+_ENTRY_OVERHEAD = 64
+
+def archive_cutoff(now: Optional[datetime] = None) -> datetime:
+    """Start time before which finished entries may be archived"""
+    return (now or datetime.now(timezone.utc)) - ARCHIVE_AFTER
+
+def _utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def month_key(value: datetime) -> str:
+    """UTC month of a timestamp, e.g. 2024-05"""
+    return _utc(value).strftime("%Y-%m")
+
+def archive_id(user_id: str, month: str, part: int = 0) -> str:
+    return f"{user_id}_{month}" if part == 0 else f"{user_id}_{month}_{part}"
+
+def _entry_size(entry: Dict[str, Any]) -> int:
+    """Estimated bytes an entry adds to an archive document"""
+    return _ENTRY_OVERHEAD + len(entry["id"].encode()) + len((entry.get("notes") or "").encode())
+
+def split_parts(entries: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Split entries, oldest first, into runs that each fit one archive part"""
+    parts: List[List[Dict[str, Any]]] = [[]]
+    size = 0
+    for entry in entries:
+        # Each part also lists its distinct task IDs
+        entry_size = _entry_size(entry) + len((entry.get("task_id") or "").encode())
+        if parts[-1] and size + entry_size > ARCHIVE_PART_BYTES:
+            parts.append([])
+            size = 0
+        parts[-1].append(entry)
+        size += entry_size
+    return parts
+
+def months_in_range(start: datetime, end: datetime) -> List[str]:
+    """UTC months overlapping [start, end)"""
+    start, last = _utc(start), _utc(end) - timedelta(microseconds=1)
+    year, month = start.year, start.month
+    months = []
+    while (year, month) <= (last.year, last.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+def range_may_be_archived(start: datetime) -> bool:
+    """Whether a range starting at start can contain archived entries"""
+    return _utc(start) < archive_cutoff()
+
+def merge_entries(archive: Optional[Dict[str, Any]], entries: Iterable[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Entries of an archive document plus (id, entry) pairs, replacing ones with the same ID, oldest first"""
+    archived = {entry["id"]: entry for entry in unpack(archive)} if archive else {}
+    for entry_id, entry in entries:
+        archived[entry_id] = {**entry, "id": entry_id}
+    return sorted(archived.values(), key=lambda entry: _utc(entry["start_time"]))
+
+def pack(ordered: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Archive document fields for entries, oldest first"""
+    task_ids = sorted({entry.get("task_id") for entry in ordered if entry.get("task_id")})
+    task_index = {task_id: i for i, task_id in enumerate(task_ids)}
+    return {
+        "task_ids": task_ids,
+        "ids": [entry["id"] for entry in ordered],
+        "task_index": [task_index.get(entry.get("task_id"), -1) for entry in ordered],
+        "starts": [_utc(entry["start_time"]).timestamp() for entry in ordered],
+        "ends": [_utc(entry["end_time"]).timestamp() if entry.get("end_time") else None for entry in ordered],
+        "durations": [entry.get("duration") for entry in ordered],
+        "notes": [entry.get("notes") or "" for entry in ordered],
+        "created": [_utc(entry["created_at"]).timestamp() if entry.get("created_at") else None for entry in ordered]
+    }
+
+def unpack(archive: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Time entry dicts of an archive document, oldest first"""
+    task_ids = archive.get("task_ids", [])
+    entries = []
+    for i, entry_id in enumerate(archive.get("ids", [])):
+        index = archive["task_index"][i]
+        end = archive["ends"][i]
+        created = archive["created"][i]
+        entries.append({
+            "id": entry_id,
+            "task_id": task_ids[index] if index >= 0 else None,
+            "user_id": archive.get("user_id"),
+            "start_time": datetime.fromtimestamp(archive["starts"][i], tz=timezone.utc),
+            "end_time": datetime.fromtimestamp(end, tz=timezone.utc) if end is not None else None,
+            "duration": archive["durations"][i],
+            "notes": archive["notes"][i],
+            "created_at": datetime.fromtimestamp(created, tz=timezone.utc) if created is not None else None
+        })
+    return entries
+
+def get_archived_entries(db, start: datetime, end: datetime, user_id: str = None) -> List[Dict[str, Any]]:
+    """Archived entries starting in [start, end), optionally filtered by user_id"""
+    if not range_may_be_archived(start):
+        return []
+
+    months = months_in_range(start, end)
+    if not months:
+        return []
+    if user_id:
+        refs = [db.collection(ARCHIVE_COLLECTION).document(archive_id(user_id, month)) for month in months]
+        docs = [doc for doc in db.get_all(refs) if doc.exists] if refs else []
+        # Months split into parts list them on the first part
+        extra = [
+            db.collection(ARCHIVE_COLLECTION).document(archive_id(user_id, doc.get("month"), part))
+            for doc in docs for part in range(1, doc.to_dict().get("parts", 1))
+        ]
+        if extra:
+            docs += [doc for doc in db.get_all(extra) if doc.exists]
+    else:
+        query = db.collection(ARCHIVE_COLLECTION).where('month', '>=', months[0]).where('month', '<=', months[-1])
+        docs = list(query.stream())
+
+    start, end = _utc(start), _utc(end)
+    return [
+        entry for doc in docs for entry in unpack(doc.to_dict())
+        if start <= entry["start_time"] < end
+    ]
+
+def iter_archived_entries_desc(db, user_id: str = None):
+    """Archived entries, newest first, reading one month at a time"""
+    query = db.collection(ARCHIVE_COLLECTION)
+    if user_id:
+        query = query.where('user_id', '==', user_id)
+    query = query.order_by('month', direction=firestore.Query.DESCENDING)
+    month, entries = None, []
+    for doc in query.stream():
+        data = doc.to_dict()
+        if data.get("month") != month:
+            yield from sorted(entries, key=lambda entry: entry["start_time"], reverse=True)
+            month, entries = data.get("month"), []
+        # The parts of a month can arrive in any order
+        entries.extend(unpack(data))
+    yield from sorted(entries, key=lambda entry: entry["start_time"], reverse=True)
+
+def _archive_ref(db, user_id: str, month: str, part: int = 0):
+    return db.collection(ARCHIVE_COLLECTION).document(archive_id(user_id, month, part))
+
+@firestore.transactional
+def _archive_in_transaction(transaction, db, entry_refs, user_id: str, month: str) -> int:
+    """Move entries into a month's last archive part, opening new parts as it
+    fills up, and skip entries changed or deleted meanwhile"""
+    first = _archive_ref(db, user_id, month).get(transaction=transaction)
+    parts = first.to_dict().get("parts", 1) if first.exists else 1
+    last = first if parts == 1 else _archive_ref(db, user_id, month, parts - 1).get(transaction=transaction)
+    snapshots = [doc for doc in db.get_all(entry_refs, transaction=transaction) if doc.exists]
+    moved = [doc for doc in snapshots if doc.to_dict().get("duration") is not None]
+    if not moved:
+        return 0
+
+    # Archived entries no longer block deleting their task
+    deltas: rollups.Deltas = {}
+    for doc in moved:
+        task_id = doc.to_dict().get("task_id")
+        if task_id:
+            rollups.add_fields(deltas, rollups.task_key(task_id, user_id), {"entry_count": -1})
+    task_docs = db.get_all([rollups.document_ref(db, key) for key in deltas], transaction=transaction)
+    tracked = {doc.id for doc in task_docs if doc.exists and doc.to_dict().get("usage_tracked")}
+    deltas = {key: values for key, values in deltas.items() if key[1] in tracked}
+
+    entries = merge_entries(last.to_dict() if last.exists else None, [(doc.id, doc.to_dict()) for doc in moved])
+    chunks = split_parts(entries)
+    total = parts + len(chunks) - 1
+    for i, chunk in enumerate(chunks):
+        part = parts - 1 + i
+        data = {**pack(chunk), "user_id": user_id, "month": month, "part": part}
+        if part == 0:
+            data["parts"] = total
+        transaction.set(_archive_ref(db, user_id, month, part), data)
+    if parts > 1 and total != parts:
+        transaction.update(first.reference, {"parts": total})
+    for doc in moved:
+        transaction.delete(doc.reference)
+    rollups.stage(transaction, db, deltas)
+    return len(moved)
+
+def compact(db, cutoff: Optional[datetime] = None) -> int:
+    """Archive finished entries that started before cutoff, returns the number moved"""
+    cutoff = cutoff or archive_cutoff()
+    moved = 0
+    last_doc = None
+    while True:
+        query = layout.all_entries(db).where('start_time', '<', cutoff).order_by('start_time')
+        query = query.select(['user_id', 'start_time', 'duration']).limit(COMPACTION_BATCH_SIZE)
+        if last_doc is not None:
+            query = query.start_after(last_doc)
+        docs = list(query.stream())
+        if not docs:
+            return moved
+        last_doc = docs[-1]
+
+        # Running entries and entries without an owner stay live
+        groups: Dict[Tuple[str, str], List[str]] = {}
+        for doc in docs:
+            entry = doc.to_dict()
+            if entry.get("user_id") and entry.get("duration") is not None and layout.in_layout(doc):
+                groups.setdefault((entry["user_id"], month_key(entry["start_time"])), []).append(doc.reference)
+
+        for (user_id, month), entry_refs in groups.items():
+            # One failing month must not stop the others, its entries stay live
+            try:
+                count = _archive_in_transaction(db.transaction(), db, entry_refs, user_id, month)
+            except Exception:
+                logger.exception("Archiving into %s failed", archive_id(user_id, month))
+                continue
+            moved += count
+            logger.info("Archived %d entries into %s", count, archive_id(user_id, month))
@@ -0,0 +1,99 @@
+"""
+Benchmark for response compression
+Builds time entry list payloads like GET /time-entries/ returns, from a few
+hundred bytes to several megabytes, and reports per installed encoding the
+bytes on the wire, the compression ratio and the CPU time to compress and
+decompress. Streamed responses are measured too, flushing every 16 KiB chunk the
+way CompressionMiddleware does:
+
+    python bench_compression.py --sizes 512,4096,65536,1048576
+"""
+
+import argparse
+import gzip
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import compression
+
+STREAM_CHUNK = 16 * 1024
+
+def synthetic_payload(target_size: int, seed: int = 0) -> bytes:
+    """JSON list of time entries, about target_size bytes long"""
+    rng = random.Random(seed)
+    task_ids = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(20)) for _ in range(8)]
+    now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    entries = []
+    size = 2
+    while size < target_size:
+        start = now - timedelta(seconds=rng.uniform(0, 90 * 86400))
+        duration = round(min(rng.lognormvariate(3.4, 1.0), 8 * 60), 3)
+        entry = {
+            "id": "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(20)),
+            "task_id": rng.choice(task_ids),
+            "user_id": "loadtest-user-0",
+            "start_time": start.isoformat(),
+            "end_time": (start + timedelta(minutes=duration)).isoformat(),
+            "duration": duration,
+            "notes": rng.choice(["", "", "review", "standup", "bugfix in sync endpoint"]),
+            "created_at": start.isoformat()
+        }
+        entries.append(entry)
+        size += len(json.dumps(entry)) + 1
+    return json.dumps(entries).encode()
+
+def decompressor(name: str):
+    if name == "gzip":
+        return gzip.decompress
+    if name == "br":
+        return compression.brotli.decompress
+    return lambda data: compression.zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+def compress_whole(name: str, payload: bytes) -> bytes:
+    encoder = compression.ENCODERS[name]()
+    return encoder.compress(payload) + encoder.finish()
+
+def compress_streamed(name: str, payload: bytes) -> bytes:
+    encoder = compression.ENCODERS[name]()
+    parts = []
+    for i in range(0, len(payload), STREAM_CHUNK):
+        parts.append(encoder.compress(payload[i:i + STREAM_CHUNK]) + encoder.flush())
+    parts.append(encoder.finish())
+    return b"".join(parts)
+
+def timed(fn, repeat: int):
+    """Best wall time of repeat runs, and the last result"""
+    best = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - begin)
+    return best, result
+
+def run_benchmark(sizes, repeat: int):
+    """Print wire size and CPU cost per payload size and encoding"""
+    print(f"Encodings: {', '.join(compression.ENCODERS)} (threshold {compression.MINIMUM_SIZE} bytes)")
+    print(f"{'payload':>9} {'encoding':>8} {'wire':>9} {'ratio':>6} {'compress':>10} {'decompress':>10} {'MB/s':>7} {'streamed':>9}")
+    for size in sizes:
+        payload = synthetic_payload(size)
+        print(f"{len(payload):>9} {'identity':>8} {len(payload):>9} {1.0:>6.2f}")
+        for name in compression.ENCODERS:
+            compress_time, compressed = timed(lambda: compress_whole(name, payload), repeat)
+            decompress_time, restored = timed(lambda: decompressor(name)(compressed), repeat)
+            assert restored == payload
+            streamed = compress_streamed(name, payload)
+            assert decompressor(name)(streamed) == payload
+            throughput = len(payload) / compress_time / 1e6
+            print(f"{'':>9} {name:>8} {len(compressed):>9} {len(payload) / len(compressed):>6.2f} "
+                  f"{compress_time * 1e6:>8.0f}us {decompress_time * 1e6:>8.0f}us {throughput:>7.1f} {len(streamed):>9}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark response compression")
+    parser.add_argument("--sizes", default="512,1024,4096,16384,65536,262144,1048576,4194304",
+                        help="comma-separated payload sizes in bytes")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    run_benchmark([int(size) for size in args.sizes.split(",")], args.repeat)
@@ -0,0 +1,79 @@
+"""
+Benchmark for the /stats/heatmap computation
+Generates a year of synthetic minute-granularity entries and times the NumPy
+interval splitting against a plain Python loop that walks every hour:
+
+    python bench_heatmap.py --tz Europe/Berlin
+"""
+
+import argparse
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+import heatmap
+import timezones
+
+def synthetic_entries(bounds, seed=0):
+    """Work sessions on minute boundaries, 1-180 minutes long, with short gaps"""
+    rng = np.random.default_rng(seed)
+    span_minutes = int((bounds[-1] - bounds[0]) // 60)
+    # Roughly one session start every 20 minutes across the year
+    count = span_minutes // 20
+    starts = bounds[0] + 60 * np.sort(rng.integers(0, span_minutes, count)).astype(np.float64)
+    lengths = 60 * rng.integers(1, 181, count).astype(np.float64)
+    return starts, starts + lengths
+
+def python_heatmap(tz_name, bounds, starts, ends):
+    """Reference implementation, one hour slice at a time"""
+    zone = timezones.get_zone(tz_name)
+    matrix = np.zeros((7, 24))
+    for start, end in zip(starts, ends):
+        start = max(start, bounds[0])
+        end = min(end, bounds[-1])
+        while start < end:
+            i = np.searchsorted(bounds, start, side="right") - 1
+            stop = min(end, bounds[i + 1])
+            local = datetime.fromtimestamp(start, tz=zone)
+            matrix[local.weekday(), local.hour] += stop - start
+            start = stop
+    return matrix
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - begin)
+    return best, result
+
+def run_benchmark(tz_name, year, repeat, reference):
+    """Print heatmap timings for a year of synthetic data"""
+    days = (date(year + 1, 1, 1) - date(year, 1, 1)).days
+
+    table_time, (bounds, labels) = timed(lambda: timezones.hour_boundaries(tz_name, date(year, 1, 1), days), 1)
+    starts, ends = synthetic_entries(bounds)
+    print(f"{len(starts)} entries, {len(bounds) - 1} hour bins ({tz_name}, {year})")
+    print(f"  hour table (first build): {table_time * 1000:9.2f} ms")
+
+    cached_time, _ = timed(lambda: timezones.hour_boundaries(tz_name, date(year, 1, 1), days), repeat)
+    print(f"  hour table (cached):      {cached_time * 1000:9.2f} ms")
+
+    numpy_time, matrix = timed(lambda: heatmap.weekday_hour_heatmap(bounds, labels, starts, ends), repeat)
+    print(f"  numpy heatmap:            {numpy_time * 1000:9.2f} ms")
+
+    if reference:
+        python_time, expected = timed(lambda: python_heatmap(tz_name, bounds, starts, ends), 1)
+        print(f"  python loop:              {python_time * 1000:9.2f} ms")
+        print(f"  max difference:           {np.abs(matrix - expected).max():9.6f} s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the weekday/hour heatmap")
+    parser.add_argument("--tz", default="UTC")
+    parser.add_argument("--year", type=int, default=2024)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-reference", action="store_true", help="skip the slow Python loop")
+    args = parser.parse_args()
+
+    run_benchmark(args.tz, args.year, args.repeat, not args.no_reference)
@@ -0,0 +1,76 @@
+"""
+Benchmark for the /token login endpoint
+Reports login latency percentiles against a running API, e.g. run it once
+with CHRONA_LOGIN_MODE=firebase and once with the default local mode:
+
+    python bench_login.py --url http://localhost:8000 --email a@b.com --password secret
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+# One HTTP session per worker thread, requests.Session is not thread-safe
+_local = threading.local()
+
+def get_session():
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+def login_once(url, email, password):
+    """Time a single login request in milliseconds"""
+    session = get_session()
+    start = time.perf_counter()
+    response = session.post(
+        f"{url}/token",
+        data={'username': email, 'password': password},
+        headers={'Content-Type': 'application/x-www-form-urlencoded'},
+        timeout=30
+    )
+    elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, response.status_code
+
+def run_benchmark(url, email, password, requests_count, concurrency, warmup):
+    """Run the login benchmark and print latency percentiles"""
+    # Warm up caches and connections so the steady state is measured
+    for _ in range(warmup):
+        login_once(url, email, password)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: login_once(url, email, password), range(requests_count)))
+
+    latencies = [elapsed for elapsed, status_code in results if status_code == 200]
+    failures = len(results) - len(latencies)
+
+    if not latencies:
+        print(f"All {failures} login requests failed")
+        return
+
+    print(f"Login requests: {len(results)} (failed: {failures}, concurrency: {concurrency})")
+    print(f"  mean: {statistics.mean(latencies):8.1f} ms")
+    print(f"  p50:  {percentile(latencies, 50):8.1f} ms")
+    print(f"  p95:  {percentile(latencies, 95):8.1f} ms")
+    print(f"  p99:  {percentile(latencies, 99):8.1f} ms")
+    print(f"  max:  {max(latencies):8.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /token login latency")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5)
+    args = parser.parse_args()
+
+    run_benchmark(args.url.rstrip("/"), args.email, args.password, args.requests, args.concurrency, args.warmup)
@@ -0,0 +1,91 @@
+"""
+Benchmark for MessagePack against JSON response bodies
+Builds time entry lists like GET /time-entries/ returns and compares, per list
+length, the body size (plain and gzipped) and the time to encode on the server
+and decode on the client. Decoding JSON includes parsing the ISO timestamps,
+which MessagePack bodies carry as native timestamps:
+
+    python bench_serialization.py --counts 10,100,1000,10000
+"""
+
+import argparse
+import gzip
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import serialization
+
+TIME_FIELDS = ("start_time", "end_time", "created_at")
+
+def synthetic_entries(count: int, seed: int = 0):
+    """Time entries as the API returns them, with datetime values"""
+    rng = random.Random(seed)
+    task_ids = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(20)) for _ in range(8)]
+    now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    entries = []
+    for _ in range(count):
+        start = now - timedelta(seconds=rng.uniform(0, 90 * 86400))
+        duration = round(min(rng.lognormvariate(3.4, 1.0), 8 * 60), 3)
+        entries.append({
+            "id": "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(20)),
+            "task_id": rng.choice(task_ids),
+            "user_id": "loadtest-user-0",
+            "start_time": start,
+            "end_time": start + timedelta(minutes=duration),
+            "duration": duration,
+            "notes": rng.choice(["", "", "review", "standup", "bugfix in sync endpoint"]),
+            "created_at": start,
+            "task": None
+        })
+    return entries
+
+def json_encode(entries) -> bytes:
+    return json.dumps(entries, default=lambda value: value.isoformat()).encode()
+
+def json_decode(body: bytes):
+    entries = json.loads(body)
+    for entry in entries:
+        for field in TIME_FIELDS:
+            entry[field] = datetime.fromisoformat(entry[field])
+    return entries
+
+def timed(fn, repeat: int):
+    """Best wall time of repeat runs, and the last result"""
+    best = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - begin)
+    return best, result
+
+def run_benchmark(counts, repeat: int):
+    """Print body sizes and encode/decode times for JSON and MessagePack"""
+    print(f"{'entries':>8} {'format':>8} {'bytes':>9} {'gzipped':>9} {'encode':>10} {'decode':>10}")
+    for count in counts:
+        entries = synthetic_entries(count)
+        formats = (
+            ("json", json_encode, json_decode),
+            ("msgpack", serialization.packb, serialization.unpackb)
+        )
+        results = {}
+        for name, encode, decode in formats:
+            encode_time, body = timed(lambda: encode(entries), repeat)
+            decode_time, decoded = timed(lambda: decode(body), repeat)
+            assert decoded == entries
+            results[name] = (len(body), encode_time, decode_time)
+            print(f"{count:>8} {name:>8} {len(body):>9} {len(gzip.compress(body)):>9} "
+                  f"{encode_time * 1e3:>8.2f}ms {decode_time * 1e3:>8.2f}ms")
+        json_size, json_encode_time, json_decode_time = results["json"]
+        msgpack_size, msgpack_encode_time, msgpack_decode_time = results["msgpack"]
+        print(f"{'':>8} {'ratio':>8} {msgpack_size / json_size:>9.2f} {'':>9} "
+              f"{msgpack_encode_time / json_encode_time:>9.2f}x {msgpack_decode_time / json_decode_time:>9.2f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark MessagePack against JSON bodies")
+    parser.add_argument("--counts", default="10,100,1000,10000", help="comma-separated list lengths")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    run_benchmark([int(count) for count in args.counts.split(",")], args.repeat)
@@ -0,0 +1,342 @@
+"""
+Synthetic workload generator for the Chrona API
+Simulates a population of tracker and web users and replays their traffic
+against a running API or the ASGI app in-process:
+  - logins (password or Google) at the start of each user's day, and
+    POST /token/refresh whenever the access token expires or is rejected
+  - hotkey start/stop cycles as in ChronaApp.toggle_tracking: POST
+    /time-entries/ when a task is picked, PUT /time-entries/{id} when stopped
+  - task refreshes (GET /tasks/)
+  - dashboard polling of /stats/daily and /stats/weekly
+Activity follows a diurnal curve in each user's local time. Simulated time is
+compressed by --speed, and the schedule is reproducible for a given --seed.
+Users come from `reset_database.py seed`:
+
+    python bench_workload.py --url http://localhost:8000 --users 50 --hours 24 --speed 120
+    python bench_workload.py --app --users 20 --hours 2 --speed 60
+    python bench_workload.py --users 1000 --hours 24 --dry-run
+"""
+
+import argparse
+import asyncio
+import heapq
+import math
+import random
+import statistics
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+# Relative activity for each local hour of the day, peaking mid-morning and
+# mid-afternoon with a lunch dip and little activity at night
+DIURNAL = [
+    0.02, 0.01, 0.01, 0.01, 0.01, 0.03, 0.08, 0.25,
+    0.60, 0.90, 1.00, 0.95, 0.60, 0.80, 0.95, 1.00,
+    0.90, 0.70, 0.45, 0.30, 0.25, 0.20, 0.10, 0.05
+]
+
+# Dashboards are only left open while activity is at least this high
+DASHBOARD_ACTIVITY = 0.5
+
+# Access tokens are refreshed this many seconds before they expire
+REFRESH_MARGIN = 30
+
+# An event is (simulated seconds since start, user index, action, payload)
+Event = Tuple[float, int, str, dict]
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def activity(t: float, start_hour: float, tz_offset: float) -> float:
+    """Diurnal weight at simulated second t for a user tz_offset hours from UTC"""
+    hour = (start_hour + tz_offset + t / 3600) % 24
+    # Interpolate between hourly weights so rates change smoothly
+    low = int(hour)
+    frac = hour - low
+    return DIURNAL[low] * (1 - frac) + DIURNAL[(low + 1) % 24] * frac
+
+def next_arrival(rng: random.Random, t: float, end: float, peak_per_hour: float, weight) -> Optional[float]:
+    """Next event of a Poisson process with rate peak_per_hour * weight(t), by thinning"""
+    if peak_per_hour <= 0:
+        return None
+    peak_per_second = peak_per_hour / 3600
+    while True:
+        t += rng.expovariate(peak_per_second)
+        if t >= end:
+            return None
+        if rng.random() < weight(t):
+            return t
+
+def user_schedule(rng: random.Random, user: int, args) -> List[Event]:
+    """All events of one simulated user, in time order"""
+    end = args.hours * 3600
+    tz_offset = rng.uniform(-args.tz_spread, args.tz_spread)
+    weight = lambda t: activity(t, args.start_hour, tz_offset)
+    events: List[Event] = []
+
+    # Log in once per local day, shortly before the first activity of the day
+    day = 0
+    while day * 86400 < end:
+        first = next_arrival(rng, day * 86400, min(end, (day + 1) * 86400), args.sessions_per_hour, weight)
+        if first is not None:
+            kind = "google_login" if rng.random() < args.google_share else "login"
+            events.append((max(day * 86400, first - 30), user, kind, {}))
+        day += 1
+
+    # Toggle cycles: a session starts, runs for a log-normal time and stops,
+    # and the next one can only start after that
+    t = 0.0
+    while True:
+        start = next_arrival(rng, t, end, args.sessions_per_hour, weight)
+        if start is None:
+            break
+        length = min(rng.lognormvariate(math.log(args.session_minutes * 60), 0.8), 8 * 3600)
+        events.append((start, user, "start", {}))
+        # Entries store durations in minutes, like the tracker sends them
+        events.append((min(start + length, end), user, "stop", {"duration": round(length / 60, 2)}))
+        t = start + length
+
+    t = 0.0
+    while True:
+        t = next_arrival(rng, t, end, args.refreshes_per_hour, weight)
+        if t is None:
+            break
+        events.append((t, user, "refresh_tasks", {}))
+
+    # A share of users keep the dashboard open and poll it during busy hours
+    if rng.random() < args.dashboard_share:
+        t = rng.uniform(0, args.stats_interval)
+        while t < end:
+            if weight(t) >= DASHBOARD_ACTIVITY:
+                events.append((t, user, "stats", {}))
+            t += args.stats_interval
+
+    events.sort(key=lambda event: event[0])
+    return events
+
+def build_schedule(args) -> List[List[Event]]:
+    """Per-user event lists for the whole population"""
+    rng = random.Random(args.seed)
+    return [user_schedule(random.Random(rng.random()), user, args) for user in range(args.users)]
+
+class Recorder:
+    """Latency samples and status codes per endpoint"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.late = 0
+
+    async def request(self, client: httpx.AsyncClient, label: str, method: str, path: str, **kwargs):
+        begin = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            response = None
+            status = type(e).__name__
+        self.latencies[label].append((time.perf_counter() - begin) * 1000)
+        self.statuses[label][status] += 1
+        return response
+
+    def report(self, elapsed: float):
+        print(f"{'endpoint':32} {'count':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for label in sorted(self.latencies):
+            samples = self.latencies[label]
+            errors = sum(count for status, count in self.statuses[label].items() if not (isinstance(status, int) and status < 400))
+            print(
+                f"{label:32} {len(samples):7d} {errors:7d} {len(samples) / elapsed:8.2f} "
+                f"{percentile(samples, 50):9.1f} {percentile(samples, 90):9.1f} "
+                f"{percentile(samples, 99):9.1f} {max(samples):9.1f}"
+            )
+        total = sum(len(samples) for samples in self.latencies.values())
+        print(f"{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s), {self.late} events started over 1s late")
+        for label in sorted(self.statuses):
+            failures = {status: count for status, count in self.statuses[label].items() if status != 200}
+            if failures:
+                print(f"  {label}: {failures}")
+
+class SimulatedUser:
+    """Client-side state of one user: tokens, cached tasks, running entry"""
+
+    def __init__(self, index: int, args, google_tokens: List[str]):
+        self.email = f"{args.prefix}{index}@example.com"
+        self.password = args.password
+        self.google_token = google_tokens[index % len(google_tokens)] if google_tokens else None
+        self.headers: Dict[str, str] = {}
+        self.refresh_token: Optional[str] = None
+        self.expires_at = 0.0
+        self.tasks: List[dict] = []
+        self.entry_id: Optional[str] = None
+
+    async def login(self, client, recorder: Recorder, google: bool = False):
+        if google and self.google_token:
+            response = await recorder.request(client, "POST /auth/google", "POST", "/auth/google", json={"id_token": self.google_token})
+        else:
+            # Without pre-minted Google ID tokens Google logins fall back to passwords
+            response = await recorder.request(
+                client, "POST /token", "POST", "/token",
+                data={"username": self.email, "password": self.password}
+            )
+        self._store_tokens(response)
+
+    def _store_tokens(self, response):
+        if response is not None and response.status_code == 200:
+            data = response.json()
+            self.headers = {"Authorization": f"Bearer {data['access_token']}"}
+            self.refresh_token = data.get("refresh_token")
+            self.expires_at = data["expires_at"]
+        else:
+            self.headers = {}
+
+    async def refresh(self, client, recorder: Recorder):
+        """Renew the access token like the tracker does, logging in again if that fails"""
+        if self.refresh_token:
+            response = await recorder.request(
+                client, "POST /token/refresh", "POST", "/token/refresh",
+                json={"refresh_token": self.refresh_token}
+            )
+            self._store_tokens(response)
+        if not self.headers:
+            await self.login(client, recorder)
+
+    async def request(self, client, recorder: Recorder, label: str, method: str, path: str, **kwargs):
+        """Authenticated request, refreshing the access token when it expires or is rejected"""
+        # Tokens expire in real time, not simulated time
+        if self.headers and time.time() > self.expires_at - REFRESH_MARGIN:
+            await self.refresh(client, recorder)
+        response = await recorder.request(client, label, method, path, headers=self.headers, **kwargs)
+        if response is not None and response.status_code == 401:
+            await self.refresh(client, recorder)
+            response = await recorder.request(client, label, method, path, headers=self.headers, **kwargs)
+        return response
+
+    async def refresh_tasks(self, client, recorder: Recorder):
+        response = await self.request(client, recorder, "GET /tasks/", "GET", "/tasks/")
+        if response is not None and response.status_code == 200:
+            self.tasks = response.json()
+
+    async def run(self, client, recorder: Recorder, events: List[Event], rng: random.Random, started: float, speed: float):
+        for t, _, action, payload in events:
+            delay = started + t / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -1:
+                recorder.late += 1
+
+            if not self.headers and action not in ("login", "google_login"):
+                await self.login(client, recorder)
+
+            if action in ("login", "google_login"):
+                await self.login(client, recorder, google=action == "google_login")
+            elif action == "refresh_tasks":
+                await self.refresh_tasks(client, recorder)
+            elif action == "start":
+                if not self.tasks:
+                    await self.refresh_tasks(client, recorder)
+                if not self.tasks:
+                    continue
+                task = rng.choice(self.tasks)
+                response = await self.request(
+                    client, recorder, "POST /time-entries/", "POST", "/time-entries/",
+                    json={"task_id": task["id"], "start_time": datetime.now(timezone.utc).isoformat()}
+                )
+                if response is not None and response.status_code == 200:
+                    self.entry_id = response.json()["id"]
+            elif action == "stop":
+                if self.entry_id is None:
+                    continue
+                await self.request(
+                    client, recorder, "PUT /time-entries/{id}", "PUT", f"/time-entries/{self.entry_id}",
+                    json={"end_time": datetime.now(timezone.utc).isoformat(), "duration": payload["duration"]}
+                )
+                self.entry_id = None
+            elif action == "stats":
+                await asyncio.gather(
+                    self.request(client, recorder, "GET /stats/daily", "GET", "/stats/daily"),
+                    self.request(client, recorder, "GET /stats/weekly", "GET", "/stats/weekly")
+                )
+
+def describe(schedule: List[List[Event]], args):
+    """Print event counts and the busiest simulated minute"""
+    events = list(heapq.merge(*schedule, key=lambda event: event[0]))
+    counts = Counter(action for _, _, action, _ in events)
+    per_minute = Counter(int(t // 60) for t, _, _, _ in events)
+    print(f"{args.users} users, {args.hours}h simulated, {len(events)} events")
+    for action, count in sorted(counts.items()):
+        print(f"  {action:14} {count:8d}")
+    if per_minute:
+        minute, peak = per_minute.most_common(1)[0]
+        print(f"  busiest minute: {peak} events at +{minute}m, mean {statistics.mean(per_minute.values()):.1f}/active minute")
+        print(f"  replay takes {args.hours * 3600 / args.speed:.0f}s at --speed {args.speed:g}")
+
+def make_client(args) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    if args.app:
+        import main
+        transport = httpx.ASGITransport(app=main.app)
+        return httpx.AsyncClient(transport=transport, base_url="http://chrona", timeout=60)
+    return httpx.AsyncClient(base_url=args.url.rstrip("/"), limits=limits, timeout=60)
+
+async def replay(schedule: List[List[Event]], args):
+    """Replay the schedule and print per-endpoint throughput and latency"""
+    google_tokens = []
+    if args.google_tokens:
+        with open(args.google_tokens) as f:
+            google_tokens = [line.strip() for line in f if line.strip()]
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    async with make_client(args) as client:
+        if args.app:
+            # ASGITransport does not run lifespan events
+            import main
+            await main.app.router.startup()
+        try:
+            started = time.perf_counter()
+            users = [SimulatedUser(i, args, google_tokens) for i in range(args.users)]
+            await asyncio.gather(*(
+                user.run(client, recorder, events, random.Random(rng.random()), started, args.speed)
+                for user, events in zip(users, schedule)
+            ))
+            elapsed = time.perf_counter() - started
+        finally:
+            if args.app:
+                await main.app.router.shutdown()
+
+    recorder.report(elapsed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a synthetic Chrona workload")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://localhost:8000")
+    target.add_argument("--app", action="store_true", help="call the ASGI app in-process instead of a URL")
+    parser.add_argument("--dry-run", action="store_true", help="only print the generated schedule")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--hours", type=float, default=24, help="simulated duration")
+    parser.add_argument("--start-hour", type=float, default=8, help="UTC hour the simulation starts at")
+    parser.add_argument("--speed", type=float, default=60, help="simulated seconds per real second")
+    parser.add_argument("--tz-spread", type=float, default=3, help="user UTC offsets are drawn from +-this many hours")
+    parser.add_argument("--sessions-per-hour", type=float, default=2, help="start/stop cycles per user at peak")
+    parser.add_argument("--session-minutes", type=float, default=25, help="median session length")
+    parser.add_argument("--refreshes-per-hour", type=float, default=0.5, help="task refreshes per user at peak")
+    parser.add_argument("--dashboard-share", type=float, default=0.3, help="share of users with the dashboard open")
+    parser.add_argument("--stats-interval", type=float, default=60, help="dashboard polling interval in seconds")
+    parser.add_argument("--google-share", type=float, default=0.3, help="share of logins through Google")
+    parser.add_argument("--google-tokens", help="file with one Google ID token per line")
+    parser.add_argument("--prefix", default="loadtest", help="seeded user email prefix")
+    parser.add_argument("--password", default="loadtest")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    schedule = build_schedule(args)
+    describe(schedule, args)
+    if not args.dry_run:
+        asyncio.run(replay(schedule, args))
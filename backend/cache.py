@@ -0,0 +1,134 @@
+"""
+Small in-process caches shared by the API
+Every cache registers itself by name so its hit rate can be reported
+"""
+
+import asyncio
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# All caches created in this process, by name
+_caches: Dict[str, "TTLCache"] = {}
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a time-to-live"""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _caches[name] = self
+
+    def get(self, key, default=None):
+        """Return the cached value, or default if missing or expired"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entry when full"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove a key and return its value"""
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this cache"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats for every registered cache"""
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+class SingleFlightCache:
+    """Share one in-flight computation per key, then cache its result briefly
+
+    Keys are grouped by an owner (e.g. a user ID); invalidate(owner) makes every
+    cached or in-flight result for that owner stale, so writes are visible to
+    the next call.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 10.0):
+        self._results = TTLCache(name, maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[Any, "asyncio.Task"] = {}
+        # Current generation per owner. Generations are never reused, so an
+        # owner evicted from this bounded map just starts a fresh one and its
+        # older results are unreachable until they expire.
+        self._generations = TTLCache(f"{name}_generations", maxsize=maxsize, ttl=ttl)
+        self._next_generation = itertools.count()
+
+    def _generation(self, owner) -> int:
+        generation = self._generations.get(owner)
+        if generation is None:
+            generation = next(self._next_generation)
+            self._generations.set(owner, generation)
+        return generation
+
+    def _key(self, owner, key):
+        return (owner, self._generation(owner), key)
+
+    async def run(self, owner, key, compute):
+        """Return compute()'s result, sharing it with identical concurrent calls"""
+        full_key = self._key(owner, key)
+
+        cached = self._results.get(full_key)
+        if cached is not None:
+            return cached
+
+        task = self._inflight.get(full_key)
+        if task is None:
+            # The computation runs in its own task, so no single caller owns it
+            task = asyncio.ensure_future(compute())
+            self._inflight[full_key] = task
+            task.add_done_callback(lambda done: self._finish(full_key, done))
+        # shield so a cancelled caller, the first one included, does not cancel
+        # the shared call
+        return await asyncio.shield(task)
+
+    def _finish(self, full_key, task: "asyncio.Task"):
+        """Forget a finished computation and cache its result"""
+        if self._inflight.get(full_key) is task:
+            del self._inflight[full_key]
+        # exception() also marks failures retrieved when nobody awaits them
+        if not task.cancelled() and task.exception() is None:
+            self._results.set(full_key, task.result())
+
+    def invalidate(self, owner):
+        """Drop cached and in-flight results for an owner"""
+        self._generations.set(owner, next(self._next_generation))
@@ -0,0 +1,28 @@
+"""
+Script to pack old time entries into monthly archive documents
+Finished entries that started more than CHRONA_ARCHIVE_AFTER_DAYS (default 90)
+days ago are moved into entry_archives. Safe to run repeatedly, e.g. from a
+nightly cron job.
+"""
+
+from database import get_db
+import archives
+import traceback
+
+def compact_time_entries():
+    """Archive every finished entry older than the cutoff"""
+    try:
+        cutoff = archives.archive_cutoff()
+        print(f"Archiving entries that started before {cutoff.isoformat()}...")
+
+        # Get database instance
+        db = get_db()
+
+        moved = archives.compact(db, cutoff)
+        print(f"Compaction completed: {moved} entries archived")
+    except Exception as e:
+        print(f"Compaction failed: {e}")
+        print(traceback.format_exc())
+
+if __name__ == "__main__":
+    compact_time_entries()
@@ -0,0 +1,215 @@
+"""
+Response compression negotiated through Accept-Encoding
+CompressionMiddleware is a plain ASGI middleware. It picks zstd, br or gzip from
+the client's Accept-Encoding, honouring q-values, and only offers the encoders
+that are installed (brotli and zstandard are optional). Responses smaller than
+CHRONA_COMPRESSION_MIN_BYTES, or whose type does not compress, such as images,
+are sent as they are. Streamed responses are compressed chunk by chunk and
+flushed after every chunk, so clients still get data as soon as it is produced.
+"""
+
+import os
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Responses below this many bytes go out uncompressed, the framing costs more
+# than it saves
+MINIMUM_SIZE = int(os.environ.get("CHRONA_COMPRESSION_MIN_BYTES", "1024"))
+
+# Levels tuned for CPU per request rather than the smallest output
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/msgpack", "application/x-msgpack",
+                      "application/javascript", "application/xml", "image/svg+xml")
+
+class GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level: int = GZIP_LEVEL):
+        # wbits 31 writes the gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+class BrotliEncoder:
+    name = "br"
+
+    def __init__(self, quality: int = BROTLI_QUALITY):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+class ZstdEncoder:
+    name = "zstd"
+
+    def __init__(self, level: int = ZSTD_LEVEL):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+# Installed encoders in order of preference when the client has no preference
+ENCODERS = {}
+if zstandard is not None:
+    ENCODERS["zstd"] = ZstdEncoder
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+ENCODERS["gzip"] = GzipEncoder
+
+def parse_qvalues(header: str) -> Dict[str, float]:
+    """Lowercased value -> q-value from an Accept or Accept-Encoding header"""
+    weights = {}
+    for item in header.split(","):
+        value, _, params = item.strip().partition(";")
+        value = value.strip().lower()
+        if not value:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, number = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        weights[value] = q
+    return weights
+
+def negotiate(header: Optional[str]) -> Optional[str]:
+    """Installed encoding the client accepts most, None for identity"""
+    if not header:
+        return None
+    weights = parse_qvalues(header)
+    wildcard = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for name in ENCODERS:
+        q = weights.get(name, wildcard)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+def is_compressible(headers: List[Tuple[bytes, bytes]]) -> bool:
+    """Whether a response is worth compressing judging by its headers"""
+    if _header(headers, b"content-encoding") is not None:
+        return False
+    content_type = (_header(headers, b"content-type") or b"").decode("latin-1").lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) or content_type.endswith("+json")
+
+def _add_vary(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    vary = _header(headers, b"vary")
+    if vary is None:
+        return headers + [(b"vary", b"Accept-Encoding")]
+    if b"accept-encoding" in vary.lower():
+        return headers
+    return [(key, value + b", Accept-Encoding" if key.lower() == b"vary" else value) for key, value in headers]
+
+class CompressionMiddleware:
+    """Compress HTTP responses in the encoding negotiated with the client"""
+
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = _header(scope.get("headers", []), b"accept-encoding")
+        encoding = negotiate(accept.decode("latin-1") if accept else None)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponse(send, encoding, self.minimum_size).run(self.app, scope, receive)
+
+class _CompressedResponse:
+    """Holds back the response start until it knows whether to compress"""
+
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start = None
+        self.buffer = b""
+        self.encoder = None
+        self.passthrough = False
+
+    async def run(self, app, scope, receive):
+        await app(scope, receive, self.on_send)
+
+    async def on_send(self, message):
+        if message["type"] == "http.response.start":
+            headers = list(message.get("headers", []))
+            if message["status"] < 200 or message["status"] in (204, 304) or not is_compressible(headers):
+                self.passthrough = True
+                await self.send(message)
+                return
+            self.start = {**message, "headers": _add_vary(headers)}
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.encoder is None:
+            self.buffer += body
+            if len(self.buffer) < self.minimum_size:
+                if more_body:
+                    return
+                # Complete and small, send it as it is
+                await self.send(self.start)
+                await self.send({"type": "http.response.body", "body": self.buffer})
+                return
+            await self._begin()
+            body, self.buffer = self.buffer, b""
+
+        if more_body:
+            data = self.encoder.compress(body) + self.encoder.flush()
+        else:
+            data = self.encoder.compress(body) + self.encoder.finish()
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    async def _begin(self):
+        """Send the response start with compression headers"""
+        self.encoder = ENCODERS[self.encoding]()
+        headers = [(key, value) for key, value in self.start["headers"] if key.lower() != b"content-length"]
+        headers.append((b"content-encoding", self.encoding.encode()))
+        await self.send({**self.start, "headers": headers})
@@ -2,17 +2,29 @@ import firebase_admin
 from firebase_admin import auth
 from firebase_admin import credentials
 from firebase_admin import firestore
-from google.cloud.firestore_v1.base_query import FieldFilter
-from datetime import datetime, timedelta
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
+from datetime import date, datetime, timedelta, timezone
 import models
 import schemas
 from typing import List, Dict, Any, Optional
 import os
-import traceback
+import logging
 import time
 import json
-import uuid
 import bcrypt
+import asyncio
+import itertools
+from urllib.parse import quote
+from cache import TTLCache, SingleFlightCache
+import timezones
+import heatmap
+import layout
+import rollups
+import archives
+import sync
+import numpy as np
+
+logger = logging.getLogger(__name__)
 
 # Initialize Firebase Admin SDK
 try:
@@ -21,34 +33,87 @@ try:
         cred = credentials.Certificate(cred_path)
         firebase_admin.initialize_app(cred)
 except Exception as e:
-    print(f"Error initializing Firebase Admin SDK: {e}")
+    logger.error("Error initializing Firebase Admin SDK: %s", e)
+
+# Login mode: "local" checks the bcrypt hash stored at registration in-process,
+# "firebase" keeps the old Firebase Auth lookup and custom token round trips
+LOGIN_MODE = os.environ.get("CHRONA_LOGIN_MODE", "local")
+
+# users_by_email pointer documents (including password_hash) used by login
+_login_record_cache = TTLCache("login_records", maxsize=4096, ttl=float(os.environ.get("CHRONA_LOGIN_CACHE_TTL", "300")))
+
+# users_by_uid lookups for Google sign-in
+_uid_user_cache = TTLCache("users_by_uid", maxsize=4096, ttl=float(os.environ.get("CHRONA_UID_CACHE_TTL", "300")))
+
+# Stats results, shared by identical concurrent requests and cached briefly.
+# Time entry writes invalidate the owning user's results.
+_stats_results = SingleFlightCache("stats", maxsize=2048, ttl=float(os.environ.get("CHRONA_STATS_CACHE_TTL", "30")))
+
+def invalidate_user_stats(user_id: Optional[str]):
+    """Make cached stats for a user stale after their entries change"""
+    _stats_results.invalidate(user_id)
+    # Unfiltered stats include every user's entries
+    _stats_results.invalidate(None)
+
+# User index helpers
+# users_by_email/{email} and users_by_uid/{uid} are unique-key pointer documents
+# kept in step with users/{id}, so lookups are point reads instead of queries
+def email_index_key(email: str) -> str:
+    """Normalize an email into a users_by_email document ID"""
+    return quote(email.strip().lower(), safe="@")
+
+def _email_index_ref(db, email: str):
+    return db.collection('users_by_email').document(email_index_key(email))
+
+def _uid_index_ref(db, firebase_uid: str):
+    return db.collection('users_by_uid').document(firebase_uid)
+
+@firestore.transactional
+def _create_user_in_transaction(transaction, db, user_data: Dict[str, Any], require_new_email: bool = True) -> str:
+    """Create users/{id} together with its pointer documents"""
+    email_ref = _email_index_ref(db, user_data["email"])
+    uid_ref = _uid_index_ref(db, user_data["firebase_uid"])
+    
+    # All reads must happen before any writes in a Firestore transaction
+    email_snapshot = email_ref.get(transaction=transaction)
+    uid_snapshot = uid_ref.get(transaction=transaction)
+    
+    if email_snapshot.exists and require_new_email:
+        raise ValueError("User with this email already exists")
+    if uid_snapshot.exists:
+        raise ValueError("User with this Firebase UID already exists")
+    
+    user_ref = db.collection('users').document()
+    pointer = models.UserIndex.to_dict(user_data, user_ref.id)
+    
+    transaction.set(user_ref, user_data)
+    transaction.set(uid_ref, pointer)
+    if not email_snapshot.exists:
+        transaction.set(email_ref, pointer)
+    
+    return user_ref.id
 
 # User CRUD operations
 async def create_user(db, user: schemas.UserCreate) -> models.User:
     """Create a new user"""
     try:
         # Check if user already exists
-        users_ref = db.collection('users')
-        query = users_ref.where(filter=FieldFilter("email", "==", user.email))
-        existing_users = query.get()
-        
-        if len(existing_users) > 0:
+        if _email_index_ref(db, user.email).get().exists:
             raise ValueError("User with this email already exists")
         
-        # Hash the password
-        hashed_password = bcrypt.hashpw(user.password.encode(), bcrypt.gensalt())
+        # Hash the password off the event loop, bcrypt is deliberately slow
+        hashed_password = await asyncio.to_thread(bcrypt.hashpw, user.password.encode(), bcrypt.gensalt())
         
         # Create Firebase Auth user
         try:
-            print(f"Attempting to create Firebase Auth user with email: {user.email}")
+            logger.debug("Creating Firebase Auth user")
             firebase_user = auth.create_user(
                 email=user.email,
                 password=user.password
             )
-            print(f"Firebase Auth user created with UID: {firebase_user.uid}")
+            logger.info("Firebase Auth user created", extra={"firebase_uid": firebase_user.uid})
         except Exception as e:
-            print(f"Error creating Firebase Auth user: {e}")
-            print(traceback.format_exc())
+            logger.exception("Error creating Firebase Auth user")
             raise ValueError(f"Failed to create Firebase Auth user: {str(e)}")
         
         # Create user in Firestore
@@ -56,35 +121,49 @@ async def create_user(db, user: schemas.UserCreate) -> models.User:
             "email": user.email,
             "name": user.name or "",
             "firebase_uid": firebase_user.uid,
+            "timezone": user.timezone,
             "created_at": datetime.now()
         }
         
-        # Add user to Firestore
-        print(f"Adding user to Firestore: {user_data}")
-        user_ref = users_ref.document()
-        user_ref.set(user_data)
+        # Add user and its index documents to Firestore atomically
+        user_data["password_hash"] = hashed_password.decode()
+        try:
+            user_id = _create_user_in_transaction(db.transaction(), db, user_data)
+        except ValueError:
+            # Lost a registration race for this email, undo the Auth user
+            auth.delete_user(firebase_user.uid)
+            raise
         
         # Return user data
-        user_data["id"] = user_ref.id
-        print(f"User created successfully with ID: {user_ref.id}")
-        return user_data
+        logger.info("User created", extra={"user_id": user_id})
+        return models.User.from_dict(user_data, user_id)
     except Exception as e:
-        print(f"Unexpected error in create_user: {e}")
-        print(traceback.format_exc())
+        logger.warning("create_user failed: %s", e)
         raise
 
+async def create_google_user(db, firebase_uid: str, email: str, name: str) -> Dict[str, Any]:
+    """Create a user for a first-time Google sign-in"""
+    user_data = {
+        "email": email,
+        "name": name,
+        "firebase_uid": firebase_uid,
+        "created_at": datetime.now()
+    }
+    
+    # An existing password account keeps its users_by_email pointer
+    user_id = _create_user_in_transaction(db.transaction(), db, user_data, require_new_email=False)
+    user = models.User.from_dict(user_data, user_id)
+    _uid_user_cache.set(firebase_uid, user)
+    return user
+
 async def get_user_by_email(db, email: str) -> Optional[Dict[str, Any]]:
     """Get user by email"""
-    users_ref = db.collection('users')
-    query = users_ref.where(filter=FieldFilter("email", "==", email))
-    users = query.get()
+    pointer_doc = _email_index_ref(db, email).get()
     
-    if len(users) == 0:
+    if not pointer_doc.exists:
         return None
     
-    user_doc = users[0]
-    user_data = models.User.from_dict(user_doc.to_dict(), user_doc.id)
-    return user_data
+    return models.UserIndex.from_dict(pointer_doc.to_dict())
 
 async def get_user_by_id(db, user_id: str) -> Optional[Dict[str, Any]]:
     """Get user by ID"""
@@ -97,8 +176,68 @@ async def get_user_by_id(db, user_id: str) -> Optional[Dict[str, Any]]:
     user_data = models.User.from_dict(user_doc.to_dict(), user_doc.id)
     return user_data
 
+# Refresh tokens that were exchanged, kept until they expire so a replayed one
+# is recognised. A TTL policy on expires_at should delete them afterwards.
+USED_REFRESH_TOKEN_COLLECTION = 'used_refresh_tokens'
+
+async def use_refresh_token(db, jti: str, user_id: str, expires_at: datetime) -> bool:
+    """Mark a refresh token as exchanged, False if it already was"""
+    try:
+        db.collection(USED_REFRESH_TOKEN_COLLECTION).document(jti).create({"user_id": user_id, "expires_at": expires_at})
+    except AlreadyExists:
+        return False
+    return True
+
+async def revoke_refresh_tokens(db, user_id: str):
+    """Invalidate every refresh token issued to a user until now"""
+    db.collection('users').document(user_id).update({"tokens_revoked_at": time.time()})
+
+async def _get_login_record(db, email: str) -> Optional[Dict[str, Any]]:
+    """Get the users_by_email pointer for login, cached for repeat logins"""
+    key = email_index_key(email)
+    record = _login_record_cache.get(key)
+    if record is not None:
+        return record
+    
+    pointer_doc = _email_index_ref(db, email).get()
+    if not pointer_doc.exists:
+        return None
+    
+    record = pointer_doc.to_dict()
+    _login_record_cache.set(key, record)
+    return record
+
 async def authenticate_user(db, email: str, password: str) -> Optional[Dict[str, Any]]:
     """Authenticate user"""
+    if LOGIN_MODE == "local":
+        record = await _get_login_record(db, email)
+        if not record:
+            return None
+        
+        password_hash = record.get("password_hash")
+        if not password_hash:
+            # Google sign-in and older accounts have no password to check
+            logger.info("Password login for an account without a password hash", extra={"user_id": record.get("user_id")})
+            return None
+        
+        # Verify the stored hash off the event loop
+        matches = await asyncio.to_thread(bcrypt.checkpw, password.encode(), password_hash.encode())
+        if not matches:
+            return None
+        
+        user = models.UserIndex.from_dict(record)
+        return {
+            "user_id": user["id"],
+            "email": user["email"],
+            "name": user["name"],
+            "firebase_uid": user["firebase_uid"],
+            "timezone": user.get("timezone")
+        }
+    
+    return await _authenticate_with_firebase(db, email)
+
+async def _authenticate_with_firebase(db, email: str) -> Optional[Dict[str, Any]]:
+    """Authenticate user through Firebase Auth"""
     try:
         # Get user from Firebase
         user = await get_user_by_email(db, email)
@@ -120,33 +259,59 @@ async def authenticate_user(db, email: str, password: str) -> Optional[Dict[str,
             "custom_token": custom_token.decode('utf-8')
         }
     except Exception as e:
-        print(f"Authentication error: {e}")
-        print(traceback.format_exc())
+        logger.exception("Authentication error")
         return None
 
 async def get_user_by_firebase_uid(db, firebase_uid: str) -> Optional[Dict[str, Any]]:
     """Get user by Firebase UID"""
-    users_ref = db.collection('users')
-    query = users_ref.where(filter=FieldFilter("firebase_uid", "==", firebase_uid))
-    users = query.get()
+    user = _uid_user_cache.get(firebase_uid)
+    if user is not None:
+        return user
+    
+    pointer_doc = _uid_index_ref(db, firebase_uid).get()
     
-    if len(users) == 0:
+    if not pointer_doc.exists:
         return None
     
-    user_doc = users[0]
-    user_data = models.User.from_dict(user_doc.to_dict(), user_doc.id)
-    return user_data
+    user = models.UserIndex.from_dict(pointer_doc.to_dict())
+    _uid_user_cache.set(firebase_uid, user)
+    return user
+
+async def update_user_timezone(db, user_id: str, tz: str) -> Dict[str, Any]:
+    """Set a user's time zone preference on the user and its pointer documents"""
+    user_ref = db.collection('users').document(user_id)
+    user_doc = user_ref.get()
+    if not user_doc.exists:
+        raise ValueError(f"User with ID {user_id} not found")
+    user_data = user_doc.to_dict()
+    
+    batch = db.batch()
+    batch.update(user_ref, {"timezone": tz})
+    if user_data.get("email"):
+        batch.update(_email_index_ref(db, user_data["email"]), {"timezone": tz})
+    if user_data.get("firebase_uid"):
+        batch.update(_uid_index_ref(db, user_data["firebase_uid"]), {"timezone": tz})
+    batch.commit()
+    
+    # Drop cached copies of the pointer documents
+    if user_data.get("email"):
+        _login_record_cache.pop(email_index_key(user_data["email"]))
+    if user_data.get("firebase_uid"):
+        _uid_user_cache.pop(user_data["firebase_uid"])
+    
+    user_data["timezone"] = tz
+    return models.User.from_dict(user_data, user_id)
 
 # Task CRUD operations
-async def get_task(db: firestore.Client, id: str):
-    doc_ref = db.collection('tasks').document(id)
+async def get_task(db: firestore.Client, id: str, user_id: str = None):
+    doc_ref = layout.tasks_collection(db, user_id).document(id)
     doc = doc_ref.get()
     if doc.exists:
         return models.Task.from_dict(doc.to_dict(), doc.id)
     return None
 
-async def get_task_by_name(db: firestore.Client, name: str):
-    tasks_ref = db.collection('tasks')
+async def get_task_by_name(db: firestore.Client, name: str, user_id: str = None):
+    tasks_ref = layout.tasks_collection(db, user_id)
     query = tasks_ref.where('name', '==', name).limit(1)
     docs = query.stream()
     
@@ -156,10 +321,10 @@ async def get_task_by_name(db: firestore.Client, name: str):
 
 async def get_tasks(db: firestore.Client, skip: int = 0, limit: int = 100, user_id: str = None):
     """Get tasks, optionally filtered by user_id"""
-    tasks_ref = db.collection('tasks')
+    tasks_ref = layout.tasks_collection(db, user_id)
     
-    # If user_id is provided, filter tasks by user_id
-    if user_id:
+    # If user_id is provided, filter tasks by user_id unless they are already the user's own
+    if user_id and not layout.PER_USER:
         tasks_ref = tasks_ref.where('user_id', '==', user_id)
     
     # Apply limits
@@ -174,102 +339,281 @@ async def create_task(db: firestore.Client, task: schemas.TaskCreate):
     task_data = {
         "name": task.name,
         "description": task.description if task.description else "",
-        "created_at": datetime.now()
+        "user_id": task.user_id,
+        "created_at": datetime.now(),
+        "updated_at": firestore.SERVER_TIMESTAMP,
+        # Usage counters kept in step by the time entry write paths
+        "entry_count": 0,
+        "total_duration": 0,
+        "usage_tracked": True
     }
     
     # Add to Firestore
-    doc_ref = db.collection('tasks').document()
+    doc_ref = layout.tasks_collection(db, task.user_id).document()
     doc_ref.set(task_data)
     
     # Return the created task with ID
     return models.Task.from_dict(task_data, doc_ref.id)
 
-async def delete_task(db: firestore.Client, id: str):
+async def delete_task(db: firestore.Client, id: str, user_id: str = None):
     # First check if the task exists
-    task_ref = db.collection('tasks').document(id)
+    task_ref = layout.tasks_collection(db, user_id).document(id)
     task = task_ref.get()
     if not task.exists:
         raise ValueError(f"Task with ID {id} not found")
     
     # Check if there are any time entries associated with this task
-    time_entries_ref = db.collection('time_entries')
-    query = time_entries_ref.where('task_id', '==', id)
-    entries = list(query.stream())
+    task_data = task.to_dict()
+    if task_data.get("usage_tracked"):
+        has_entries = task_data.get("entry_count", 0) > 0
+    else:
+        # Counters not backfilled yet, an existence check is enough
+        query = layout.entries_collection(db, user_id).where('task_id', '==', id).limit(1)
+        has_entries = len(query.get()) > 0
     
-    if entries:
+    if has_entries:
         # If there are time entries, we might want to prevent deletion or delete the entries as well
         # For now, let's raise an error to prevent data loss
         raise ValueError(f"Cannot delete task with ID {id} because it has associated time entries. Delete these entries first.")
     
-    # Delete the task
-    task_ref.delete()
+    # Delete the task and leave a tombstone for /sync
+    batch = db.batch()
+    batch.delete(task_ref)
+    sync.stage_tombstone(batch, db, "task", id, task_data.get("user_id"))
+    batch.commit()
     return {"id": id}
 
 # TimeEntry CRUD operations
-async def get_time_entry(db: firestore.Client, id: str):
-    doc_ref = db.collection('time_entries').document(id)
+async def get_time_entry(db: firestore.Client, id: str, user_id: str = None):
+    doc_ref = layout.entries_collection(db, user_id).document(id)
     doc = doc_ref.get()
     if doc.exists:
         return models.TimeEntry.from_dict(doc.to_dict(), doc.id)
     return None
 
-async def get_time_entries(db: firestore.Client, skip: int = 0, limit: int = 100, user_id: str = None):
-    """Get time entries, optionally filtered by user_id"""
-    entries_ref = db.collection('time_entries')
+# Fields stored on time entry documents, "task" embeds the related task in list results
+TIME_ENTRY_FIELDS = ("task_id", "user_id", "start_time", "end_time", "duration", "notes", "created_at")
+TIME_ENTRY_LIST_FIELDS = ("id",) + TIME_ENTRY_FIELDS + ("task",)
+
+# Projections for the statistics queries, which never need notes
+STATS_FIELDS = ["task_id", "user_id", "start_time", "duration"]
+HEATMAP_FIELDS = ["user_id", "start_time", "end_time", "duration"]
+
+def _list_projection(fields) -> List[str]:
+    """Stored fields needed to answer a sparse fieldset"""
+    needed = set(fields) | {"start_time"}  # always needed to order and merge pages
+    if "task" in needed:
+        needed |= {"task_id", "user_id"}
+    return [field for field in TIME_ENTRY_FIELDS if field in needed]
+
+async def get_time_entries(db: firestore.Client, skip: int = 0, limit: int = 100, user_id: str = None,
+                           fields: Optional[List[str]] = None):
+    """Get time entries newest first, optionally filtered by user_id, including archived ones
+
+    With fields, only those fields (plus id) are read and returned.
+    """
+    entries_ref = layout.entries_collection(db, user_id) if user_id else layout.all_entries(db)
     
-    # If user_id is provided, filter entries by user_id
-    if user_id:
+    # If user_id is provided, filter entries by user_id unless they are already the user's own
+    if user_id and not layout.PER_USER:
         entries_ref = entries_ref.where('user_id', '==', user_id)
     
-    # Apply ordering and limits
-    query = entries_ref.order_by('start_time', direction=firestore.Query.DESCENDING)
-    query = query.limit(limit).offset(skip)
+    # Apply ordering and limits, the page is cut after merging with the archives
+    wanted = skip + limit
+    query = entries_ref.order_by('start_time', direction=firestore.Query.DESCENDING).limit(wanted)
+    if fields is not None:
+        query = query.select(_list_projection(fields))
+    entries = [models.TimeEntry.from_dict(doc.to_dict(), doc.id) for doc in query.stream() if layout.in_layout(doc)]
+    
+    # Archived entries are older than the archive cutoff, so they only matter
+    # when the live entries run out or reach back past it
+    if len(entries) < wanted or archives.range_may_be_archived(entries[-1]["start_time"]):
+        archived = itertools.islice(archives.iter_archived_entries_desc(db, user_id), wanted)
+        entries.extend(models.TimeEntry.from_dict(entry, entry["id"]) for entry in archived)
+        entries.sort(key=lambda entry: entry["start_time"], reverse=True)
+    entries = entries[skip:wanted]
     
-    entries = []
-    for doc in query.stream():
-        entry = models.TimeEntry.from_dict(doc.to_dict(), doc.id)
-        
+    for entry in entries:
         # Optionally fetch the related task
-        if entry.get("task_id"):
-            task_ref = db.collection('tasks').document(entry.get("task_id"))
+        if entry.get("task_id") and (fields is None or "task" in fields):
+            task_ref = layout.tasks_collection(db, entry.get("user_id")).document(entry.get("task_id"))
             task_doc = task_ref.get()
             if task_doc.exists:
                 entry["task"] = models.Task.from_dict(task_doc.to_dict(), task_doc.id)
-        
-        entries.append(entry)
     
+    if fields is not None:
+        entries = [{key: value for key, value in entry.items() if key == "id" or key in fields} for entry in entries]
     return entries
 
-async def create_time_entry(db: firestore.Client, time_entry: schemas.TimeEntryCreate):
+def _task_usage_delta(entry_count: int, duration: Optional[float]) -> Dict[str, Any]:
+    """Change to a task's usage counters, staged with the rollups"""
+    return {
+        "entry_count": entry_count,
+        "total_duration": duration or 0
+    }
+
+# Per-user pointer to the running entry, active_timers/{user_id}
+ACTIVE_TIMER_COLLECTION = 'active_timers'
+
+# What starting a timer does while another one runs: leave the running entry
+# open as before active timers existed, stop it where the new one starts, or
+# reject the new one
+TIMER_CONFLICT_POLICIES = ("allow", "stop", "reject")
+
+class ActiveTimerConflict(Exception):
+    """Raised when a timer is started while another entry is still running"""
+
+    def __init__(self, active_timer: Dict[str, Any]):
+        super().__init__(f"Time entry {active_timer.get('entry_id')} is still running")
+        self.active_timer = active_timer
+
+def _active_timer_ref(db, user_id: str):
+    return db.collection(ACTIVE_TIMER_COLLECTION).document(user_id)
+
+def _close_update(entry_data: Dict[str, Any], end_time: datetime) -> Dict[str, Any]:
+    """Fields that close an open entry at end_time, duration in minutes like the trackers send"""
+    end_time = max(end_time, entry_data["start_time"])
+    return {"end_time": end_time, "duration": (end_time - entry_data["start_time"]).total_seconds() / 60}
+
+def _close_deltas(entry_data: Dict[str, Any], update_data: Dict[str, Any]):
+    """Rollup and task counter changes of closing an open entry"""
+    deltas = rollups.entry_deltas([(entry_data, -1), ({**entry_data, **update_data}, 1)])
+    if entry_data.get("task_id"):
+        task_key = rollups.task_key(entry_data["task_id"], entry_data.get("user_id"))
+        rollups.add_fields(deltas, task_key, _task_usage_delta(0, update_data["duration"]))
+    return deltas
+
+def _new_entry_deltas(entry_data: Dict[str, Any]):
+    """Task counter and rollup changes of adding an entry"""
+    deltas = rollups.entry_deltas([(entry_data, 1)])
+    rollups.add_fields(deltas, rollups.task_key(entry_data["task_id"], entry_data["user_id"]), _task_usage_delta(1, entry_data["duration"]))
+    return deltas
+
+@firestore.transactional
+def _create_time_entry_in_transaction(transaction, db, doc_ref, entry_data: Dict[str, Any], on_conflict: str):
+    """Create a running entry and point the user's active timer at it,
+    leaving, stopping or rejecting the entry that was running"""
+    user_id = entry_data["user_id"]
+    timer_ref = _active_timer_ref(db, user_id)
+    timer = timer_ref.get(transaction=transaction)
+    
+    running_ref, running_data = None, None
+    deltas = _new_entry_deltas(entry_data)
+    if timer.exists:
+        running_ref = layout.entries_collection(db, user_id).document(timer.get("entry_id"))
+        running = running_ref.get(transaction=transaction)
+        if on_conflict != "allow" and running.exists and running.get("end_time") is None:
+            if on_conflict == "reject":
+                raise ActiveTimerConflict(timer.to_dict())
+            running_data = running.to_dict()
+            update_data = {**_close_update(running_data, entry_data["start_time"]), "updated_at": firestore.SERVER_TIMESTAMP}
+            close_deltas = _close_deltas(running_data, update_data)
+            if running_data.get("task_id"):
+                task_key = rollups.task_key(running_data["task_id"], user_id)
+                if not rollups.document_ref(db, task_key).get(transaction=transaction).exists:
+                    close_deltas.pop(task_key, None)
+            # Both entries may count towards the same rollups, write each document once
+            rollups.merge(deltas, close_deltas)
+    
+    if running_data is not None:
+        transaction.update(running_ref, update_data)
+    transaction.set(doc_ref, entry_data)
+    rollups.stage(transaction, db, deltas)
+    transaction.set(timer_ref, {
+        "user_id": user_id,
+        "entry_id": doc_ref.id,
+        "task_id": entry_data["task_id"],
+        "start_time": entry_data["start_time"]
+    })
+    return running_ref.id if running_data is not None else None
+
+@firestore.transactional
+def _clear_active_timer_in_transaction(transaction, db, user_id: str, entry_id: str):
+    """Remove the user's active timer if it still points at entry_id"""
+    timer_ref = _active_timer_ref(db, user_id)
+    timer = timer_ref.get(transaction=transaction)
+    if timer.exists and timer.get("entry_id") == entry_id:
+        transaction.delete(timer_ref)
+
+async def get_active_timer(db: firestore.Client, user_id: str) -> Optional[Dict[str, Any]]:
+    """The user's running entry pointer, one point read"""
+    timer = _active_timer_ref(db, user_id).get()
+    return timer.to_dict() if timer.exists else None
+
+async def create_time_entry(db: firestore.Client, time_entry: schemas.TimeEntryCreate, on_conflict: str = "allow"):
     # First verify the task exists
-    task_ref = db.collection('tasks').document(time_entry.task_id)
+    task_ref = layout.tasks_collection(db, time_entry.user_id).document(time_entry.task_id)
     task = task_ref.get()
     if not task.exists:
         raise ValueError(f"Task with ID {time_entry.task_id} does not exist")
+    if on_conflict not in TIMER_CONFLICT_POLICIES:
+        raise ValueError(f"on_conflict must be one of {', '.join(TIMER_CONFLICT_POLICIES)}")
     
     # Create the time entry
     entry_data = {
         "task_id": time_entry.task_id,
+        "user_id": time_entry.user_id,
         "start_time": time_entry.start_time,
         "end_time": time_entry.end_time,
         "duration": time_entry.duration,
         "notes": time_entry.notes if time_entry.notes else "",
-        "created_at": datetime.now()
+        "created_at": datetime.now(),
+        "updated_at": firestore.SERVER_TIMESTAMP
     }
     
-    # Add to Firestore
-    doc_ref = db.collection('time_entries').document()
-    doc_ref.set(entry_data)
+    doc_ref = layout.entries_collection(db, time_entry.user_id).document()
+    if time_entry.end_time is None and time_entry.user_id:
+        # A running timer, swap the active timer atomically
+        stopped_id = _create_time_entry_in_transaction(db.transaction(), db, doc_ref, entry_data, on_conflict)
+        if stopped_id:
+            logger.info("Stopped running time entry for a new timer", extra={"entry_id": stopped_id})
+    else:
+        # Add to Firestore and bump the task counters and rollups in one atomic batch
+        batch = db.batch()
+        batch.set(doc_ref, entry_data)
+        rollups.stage(batch, db, _new_entry_deltas(entry_data))
+        batch.commit()
+    invalidate_user_stats(time_entry.user_id)
     
     # Return the created entry with ID
     return models.TimeEntry.from_dict(entry_data, doc_ref.id)
 
-async def update_time_entry(db: firestore.Client, id: str, time_entry: schemas.TimeEntryUpdate):
-    # Get the time entry
-    entry_ref = db.collection('time_entries').document(id)
-    entry = entry_ref.get()
+@firestore.transactional
+def _update_time_entry_in_transaction(transaction, db, entry_ref, update_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Update an entry and move its duration change onto the task counters and rollups"""
+    entry = entry_ref.get(transaction=transaction)
     if not entry.exists:
-        raise ValueError(f"Time entry with ID {id} not found")
+        raise ValueError(f"Time entry with ID {entry_ref.id} not found")
+    entry_data = entry.to_dict()
+    updated_data = {**entry_data, **update_data}
+    
+    deltas = {}
+    task_exists = False
+    if updated_data.get("duration") != entry_data.get("duration"):
+        deltas = rollups.entry_deltas([(entry_data, -1), (updated_data, 1)])
+        if entry_data.get("task_id"):
+            delta = (updated_data.get("duration") or 0) - (entry_data.get("duration") or 0)
+            task_key = rollups.task_key(entry_data["task_id"], entry_data.get("user_id"))
+            rollups.add_fields(deltas, task_key, _task_usage_delta(0, delta))
+            task_exists = rollups.document_ref(db, task_key).get(transaction=transaction).exists
+    
+    # Stopping the running entry clears the user's active timer
+    timer_ref = None
+    if entry_data.get("end_time") is None and updated_data.get("end_time") is not None and entry_data.get("user_id"):
+        timer_ref = _active_timer_ref(db, entry_data["user_id"])
+        timer = timer_ref.get(transaction=transaction)
+        if not timer.exists or timer.get("entry_id") != entry_ref.id:
+            timer_ref = None
+    
+    transaction.update(entry_ref, update_data)
+    rollups.stage(transaction, db, deltas, skip_tasks=not task_exists)
+    if timer_ref is not None:
+        transaction.delete(timer_ref)
+    
+    return updated_data
+
+async def update_time_entry(db: firestore.Client, id: str, time_entry: schemas.TimeEntryUpdate, user_id: str = None):
+    entry_ref = layout.entries_collection(db, user_id).document(id)
     
     # Update only provided fields
     update_data = {}
@@ -283,138 +627,341 @@ async def update_time_entry(db: firestore.Client, id: str, time_entry: schemas.T
     if time_entry.notes is not None:
         update_data["notes"] = time_entry.notes
     
-    # Update in Firestore
-    entry_ref.update(update_data)
+    update_data["updated_at"] = firestore.SERVER_TIMESTAMP
     
-    # Get the updated document
-    updated_doc = entry_ref.get()
-    return models.TimeEntry.from_dict(updated_doc.to_dict(), updated_doc.id)
+    # Update in Firestore, the transaction returns the merged document
+    entry_data = _update_time_entry_in_transaction(db.transaction(), db, entry_ref, update_data)
+    invalidate_user_stats(entry_data.get("user_id"))
+    return models.TimeEntry.from_dict(entry_data, id)
 
-async def delete_time_entry(db: firestore.Client, id: str):
-    entry_ref = db.collection('time_entries').document(id)
-    entry = entry_ref.get()
+@firestore.transactional
+def _delete_time_entry_in_transaction(transaction, db, entry_ref):
+    """Delete an entry and take it off its task's counters and the rollups"""
+    entry = entry_ref.get(transaction=transaction)
     if not entry.exists:
-        raise ValueError(f"Time entry with ID {id} not found")
+        raise ValueError(f"Time entry with ID {entry_ref.id} not found")
+    entry_data = entry.to_dict()
+    
+    deltas = rollups.entry_deltas([(entry_data, -1)])
+    task_exists = False
+    if entry_data.get("task_id"):
+        task_key = rollups.task_key(entry_data["task_id"], entry_data.get("user_id"))
+        rollups.add_fields(deltas, task_key, _task_usage_delta(-1, -(entry_data.get("duration") or 0)))
+        task_exists = rollups.document_ref(db, task_key).get(transaction=transaction).exists
+    
+    timer_ref = None
+    if entry_data.get("end_time") is None and entry_data.get("user_id"):
+        timer_ref = _active_timer_ref(db, entry_data["user_id"])
+        timer = timer_ref.get(transaction=transaction)
+        if not timer.exists or timer.get("entry_id") != entry_ref.id:
+            timer_ref = None
+    
+    transaction.delete(entry_ref)
+    sync.stage_tombstone(transaction, db, "time_entry", entry_ref.id, entry_data.get("user_id"))
+    rollups.stage(transaction, db, deltas, skip_tasks=not task_exists)
+    if timer_ref is not None:
+        transaction.delete(timer_ref)
+    
+    return entry_data
+
+async def delete_time_entry(db: firestore.Client, id: str, user_id: str = None):
+    entry_ref = layout.entries_collection(db, user_id).document(id)
     
     # Delete from Firestore
-    entry_ref.delete()
+    entry_data = _delete_time_entry_in_transaction(db.transaction(), db, entry_ref)
+    invalidate_user_stats(entry_data.get("user_id"))
     return {"id": id}
 
+# Open entries without a heartbeat for this long are considered orphaned
+HEARTBEAT_TIMEOUT = timedelta(minutes=float(os.environ.get("CHRONA_HEARTBEAT_TIMEOUT_MINUTES", "15")))
+
+# Entries closed per write batch
+CLOSE_BATCH_SIZE = 100
+
+def _stale_entry_end(entry: Dict[str, Any], now: datetime) -> Optional[datetime]:
+    """When an orphaned open entry should be closed, None if it may still be running"""
+    last_seen = entry.get("last_seen")
+    # Without heartbeats there is no telling a long session from an orphaned
+    # one, so only the tracker or the user can close it
+    if last_seen is None:
+        return None
+    return last_seen if now - last_seen >= HEARTBEAT_TIMEOUT else None
+
+def _stage_close(batch, db, snapshot, end_time: datetime) -> Dict[str, Any]:
+    """Stage closing an open entry, guarded by its update time"""
+    entry_data = snapshot.to_dict()
+    update_data = {**_close_update(entry_data, end_time), "auto_closed": True, "updated_at": firestore.SERVER_TIMESTAMP}
+    
+    # Fails the batch if the tracker stopped or touched the entry since it was read
+    batch.update(snapshot.reference, update_data, option=db.write_option(last_update_time=snapshot.update_time))
+    rollups.stage(batch, db, _close_deltas(entry_data, update_data))
+    return {**entry_data, "id": snapshot.id}
+
+def _commit_close(db, closing) -> List[Dict[str, Any]]:
+    """Close (snapshot, end_time) pairs in one batch, returns the closed entries"""
+    batch = db.batch()
+    closed = [_stage_close(batch, db, snapshot, end_time) for snapshot, end_time in closing]
+    batch.commit()
+    return closed
+
+def close_stale_entries(db: firestore.Client) -> int:
+    """Close open entries whose tracker stopped sending heartbeats, returns how many were closed"""
+    now = datetime.now(timezone.utc)
+    closed_count = 0
+    owners = set()
+    
+    # Open entries have end_time == None; nothing younger than the heartbeat
+    # timeout can be stale yet
+    query = layout.all_entries(db).where('end_time', '==', None).where('start_time', '<', now - HEARTBEAT_TIMEOUT)
+    stale = []
+    for snapshot in query.stream():
+        if not layout.in_layout(snapshot):
+            continue
+        end_time = _stale_entry_end(snapshot.to_dict(), now)
+        if end_time is not None:
+            stale.append((snapshot, end_time))
+    
+    for i in range(0, len(stale), CLOSE_BATCH_SIZE):
+        chunk = stale[i:i + CLOSE_BATCH_SIZE]
+        try:
+            closed = _commit_close(db, chunk)
+        except FailedPrecondition:
+            # Some entry changed meanwhile, close the rest one by one and leave
+            # the changed ones for the next run
+            closed = []
+            for item in chunk:
+                try:
+                    closed.extend(_commit_close(db, [item]))
+                except FailedPrecondition:
+                    pass
+        closed_count += len(closed)
+        owners.update(entry.get("user_id") for entry in closed)
+    
+        for entry in closed:
+            if entry.get("user_id"):
+                _clear_active_timer_in_transaction(db.transaction(), db, entry["user_id"], entry["id"])
+    
+    for user_id in owners:
+        invalidate_user_stats(user_id)
+    return closed_count
+
+def rebuild_daily_rollups(db: firestore.Client, day: date) -> int:
+    """Recompute every user's daily rollup for a UTC day from its entries, returns documents written"""
+    start = datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc)
+    entries = _get_entries_in_range(db, start, start + timedelta(days=1), fields=STATS_FIELDS)
+    documents = rollups.entry_deltas((entry, 1) for entry in entries)
+    items = [(key, values) for key, values in documents.items() if key[0] == rollups.ROLLUP_COLLECTION]
+    
+    for i in range(0, len(items), 400):
+        batch = db.batch()
+        rollups.write_snapshot(batch, db, dict(items[i:i + 400]))
+        batch.commit()
+    return len(items)
+
+def nightly_maintenance(db: firestore.Client) -> Dict[str, int]:
+    """Rebuild yesterday's rollups and archive old entries"""
+    yesterday = datetime.now(timezone.utc).date() - timedelta(days=1)
+    return {
+        "rollups_rebuilt": rebuild_daily_rollups(db, yesterday),
+        "entries_archived": archives.compact(db)
+    }
+
 # Statistics functions
-async def get_daily_stats(db: firestore.Client, user_id: str = None):
+async def get_daily_stats(db: firestore.Client, user_id: str = None, tz: str = None):
     """Get daily stats, optionally filtered by user_id"""
-    # Get today's date
-    today = datetime.now().date()
-    today_start = datetime.combine(today, datetime.min.time())
-    today_end = datetime.combine(today, datetime.max.time())
-    
-    # Get all time entries for today
-    entries_ref = db.collection('time_entries')
-    query = entries_ref.where('start_time', '>=', today_start).where('start_time', '<=', today_end)
-    
-    # Filter by user_id if provided
+    key = ("daily", timezones.local_today(tz).isoformat(), tz)
+    return await _stats_results.run(user_id, key, lambda: asyncio.to_thread(_compute_daily_stats, db, user_id, tz))
+
+async def get_weekly_stats(db: firestore.Client, user_id: str = None, tz: str = None):
+    """Get weekly stats, optionally filtered by user_id"""
+    key = ("weekly", timezones.local_today(tz).isoformat(), tz)
+    return await _stats_results.run(user_id, key, lambda: asyncio.to_thread(_compute_weekly_stats, db, user_id, tz))
+
+def _get_entries_in_range(db: firestore.Client, start, end, user_id: str = None,
+                          fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Get live and archived entries starting in [start, end), optionally filtered by user_id
+
+    fields projects the live documents; user_id must be included when filtering.
+    """
+    entries_ref = layout.entries_collection(db, user_id) if user_id else layout.all_entries(db)
+    query = entries_ref.where('start_time', '>=', start).where('start_time', '<', end)
+    if fields is not None:
+        query = query.select(fields)
+    archived = archives.get_archived_entries(db, start, end, user_id)
+    
+    # Filter by user_id if provided, entries in the user's own collection need no filter
+    if user_id and layout.PER_USER:
+        return [doc.to_dict() for doc in query.stream()] + archived
     if user_id:
         # Need to use a different approach since Firestore doesn't allow multiple field filters
         # with different fields in the same query
-        entries = []
-        for doc in query.stream():
-            entry = doc.to_dict()
-            if entry.get('user_id') == user_id:
-                entries.append(entry)
-    else:
-        entries = [doc.to_dict() for doc in query.stream()]
-    
-    # Calculate total duration
-    total_duration = 0
+        return [entry for entry in (doc.to_dict() for doc in query.stream()) if entry.get('user_id') == user_id] + archived
+    return [doc.to_dict() for doc in query.stream() if layout.in_layout(doc)] + archived
+
+def _get_task_names(db: firestore.Client, task_owners: Dict[str, Optional[str]]) -> Dict[str, str]:
+    """Get task names for task IDs mapped to their owners in one batched read"""
+    refs = [layout.tasks_collection(db, user_id).document(task_id) for task_id, user_id in task_owners.items() if task_id]
+    names = {}
+    if refs:
+        for task_doc in db.get_all(refs):
+            if task_doc.exists:
+                names[task_doc.id] = task_doc.to_dict().get('name')
+    return names
+
+def _task_breakdown(db: firestore.Client, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sum entry durations per task"""
     task_durations = {}
-    
+    task_owners = {}
     for entry in entries:
-        if entry.get('duration'):
-            duration = entry.get('duration')
-            total_duration += duration
-            
-            task_id = entry.get('task_id')
-            if task_id in task_durations:
-                task_durations[task_id]["duration"] += duration
-            else:
-                # Get task name
-                task_ref = db.collection('tasks').document(task_id)
-                task_doc = task_ref.get()
-                task_name = task_doc.to_dict().get('name') if task_doc.exists else "Unknown"
-                
-                task_durations[task_id] = {
-                    "task_id": task_id,
-                    "task_name": task_name,
-                    "duration": duration
-                }
+        task_id = entry.get('task_id')
+        task_durations[task_id] = task_durations.get(task_id, 0) + entry['duration']
+        task_owners[task_id] = entry.get('user_id')
+    
+    task_names = _get_task_names(db, task_owners)
+    return [
+        {"task_id": task_id, "task_name": task_names.get(task_id, "Unknown"), "duration": duration}
+        for task_id, duration in task_durations.items()
+    ]
+
+def _compute_daily_stats(db: firestore.Client, user_id: str = None, tz: str = None):
+    # Get today's local date and its UTC boundaries
+    today = timezones.local_today(tz)
+    boundaries = timezones.day_boundaries(tz, today, 1)
+    
+    # Get all finished time entries for today
+    entries = _get_entries_in_range(
+        db, timezones.to_utc_datetime(boundaries[0]), timezones.to_utc_datetime(boundaries[1]), user_id,
+        fields=STATS_FIELDS
+    )
+    entries = [entry for entry in entries if entry.get('duration')]
     
     return {
         "date": today.isoformat(),
-        "total_duration": total_duration,
-        "tasks": list(task_durations.values())
+        "timezone": tz or timezones.DEFAULT_TIMEZONE,
+        "total_duration": sum(entry['duration'] for entry in entries),
+        "tasks": _task_breakdown(db, entries)
     }
 
-async def get_weekly_stats(db: firestore.Client, user_id: str = None):
-    """Get weekly stats, optionally filtered by user_id"""
-    # Get the start and end of the current week
-    today = datetime.now().date()
+def _compute_weekly_stats(db: firestore.Client, user_id: str = None, tz: str = None):
+    # Get the start and end of the current local week
+    today = timezones.local_today(tz)
     week_start = today - timedelta(days=today.weekday())
     week_end = week_start + timedelta(days=6)
+    boundaries = timezones.day_boundaries(tz, week_start, 7)
     
-    week_start_dt = datetime.combine(week_start, datetime.min.time())
-    week_end_dt = datetime.combine(week_end, datetime.max.time())
-    
-    # Get all time entries for the week
-    entries_ref = db.collection('time_entries')
-    query = entries_ref.where('start_time', '>=', week_start_dt).where('start_time', '<=', week_end_dt)
-    
-    # Filter by user_id if provided
-    if user_id:
-        # Need to use a different approach since Firestore doesn't allow multiple field filters
-        # with different fields in the same query
-        entries = []
-        for doc in query.stream():
-            entry = doc.to_dict()
-            if entry.get('user_id') == user_id:
-                entries.append(entry)
-    else:
-        entries = [doc.to_dict() for doc in query.stream()]
-    
-    # Calculate statistics
-    total_duration = 0
-    daily_breakdown = {(week_start + timedelta(days=i)).isoformat(): 0 for i in range(7)}
-    task_breakdown = {}
+    # Get all finished time entries for the week
+    entries = _get_entries_in_range(
+        db, timezones.to_utc_datetime(boundaries[0]), timezones.to_utc_datetime(boundaries[-1]), user_id,
+        fields=STATS_FIELDS
+    )
+    entries = [entry for entry in entries if entry.get('duration')]
     
-    for entry in entries:
-        if entry.get('duration'):
-            duration = entry.get('duration')
-            total_duration += duration
-            
-            # Daily breakdown
-            entry_date = entry.get('start_time').date().isoformat()
-            if entry_date in daily_breakdown:
-                daily_breakdown[entry_date] += duration
-            
-            # Task breakdown
-            task_id = entry.get('task_id')
-            if task_id in task_breakdown:
-                task_breakdown[task_id]["duration"] += duration
-            else:
-                # Get task name
-                task_ref = db.collection('tasks').document(task_id)
-                task_doc = task_ref.get()
-                task_name = task_doc.to_dict().get('name') if task_doc.exists else "Unknown"
-                
-                task_breakdown[task_id] = {
-                    "task_id": task_id,
-                    "task_name": task_name,
-                    "duration": duration
-                }
+    # Daily breakdown by the local day each entry starts in
+    starts = np.array([entry['start_time'].timestamp() for entry in entries], dtype=np.float64)
+    durations = np.array([entry['duration'] for entry in entries], dtype=np.float64)
+    daily_totals = timezones.bucket_durations(boundaries, starts, durations)
     
     return {
         "week_start": week_start.isoformat(),
         "week_end": week_end.isoformat(),
-        "total_duration": total_duration,
-        "daily_breakdown": [{"date": date, "duration": duration} for date, duration in daily_breakdown.items()],
-        "task_breakdown": list(task_breakdown.values())
-    } 
\ No newline at end of file
+        "timezone": tz or timezones.DEFAULT_TIMEZONE,
+        "total_duration": float(durations.sum()),
+        "daily_breakdown": [
+            {"date": (week_start + timedelta(days=i)).isoformat(), "duration": float(daily_totals[i])}
+            for i in range(7)
+        ],
+        "task_breakdown": _task_breakdown(db, entries)
+    }
+
+# Longest entry looked for before the start of a heatmap range
+HEATMAP_LOOKBACK = timedelta(days=1)
+
+def _entry_intervals(entries: List[Dict[str, Any]]):
+    """Start and end epoch seconds of finished entries"""
+    starts = []
+    ends = []
+    for entry in entries:
+        start = entry.get('start_time')
+        if start is None:
+            continue
+        if entry.get('end_time') is not None:
+            end = entry['end_time'].timestamp()
+        elif entry.get('duration'):
+            # Durations are in minutes
+            end = start.timestamp() + entry['duration'] * 60
+        else:
+            # Still running
+            continue
+        starts.append(start.timestamp())
+        ends.append(end)
+    return np.array(starts, dtype=np.float64), np.array(ends, dtype=np.float64)
+
+async def get_heatmap(db: firestore.Client, user_id: str, start: date, end: date, tz: str = None):
+    """Get tracked seconds per weekday and local hour for the days start..end inclusive"""
+    days = (end - start).days + 1
+    bounds, labels = timezones.hour_boundaries(tz, start, days)
+    
+    # Entries that started shortly before the range can still run into it
+    entries = _get_entries_in_range(
+        db,
+        timezones.to_utc_datetime(bounds[0]) - HEATMAP_LOOKBACK,
+        timezones.to_utc_datetime(bounds[-1]),
+        user_id,
+        fields=HEATMAP_FIELDS
+    )
+    starts, ends = _entry_intervals(entries)
+    matrix = heatmap.weekday_hour_heatmap(bounds, labels, starts, ends)
+    
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "timezone": tz or timezones.DEFAULT_TIMEZONE,
+        "total_duration": float(matrix.sum()),
+        "weekdays": heatmap.WEEKDAYS,
+        "matrix": matrix.round(3).tolist()
+    }
+
+# Longest range a duration distribution is merged over
+DISTRIBUTION_MAX_DAYS = 366
+
+async def get_task_distribution(db: firestore.Client, task: Dict[str, Any], user_id: str,
+                                start: date = None, end: date = None):
+    """Session length percentiles for a task, all time or over the UTC days start..end"""
+    if start is None:
+        # All-time sketch kept on the task document itself
+        summary = rollups.summarize([task.get("duration_sketch")], task.get("total_duration") or 0)
+    else:
+        task_rollups = [
+            day.get("tasks", {}).get(task["id"], {})
+            for day in rollups.get_rollups(db, user_id, start, end)
+        ]
+        summary = rollups.summarize(
+            (day.get("sketch") for day in task_rollups),
+            sum(day.get("total_duration", 0) for day in task_rollups)
+        )
+    
+    summary.update({
+        "task_id": task["id"],
+        "task_name": task.get("name"),
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None
+    })
+    return summary
+
+async def get_user_distribution(db: firestore.Client, user_id: str, start: date = None, end: date = None):
+    """Session length percentiles across all of a user's tasks"""
+    if start is None:
+        doc = db.collection(rollups.USER_STATS_COLLECTION).document(user_id).get()
+        days = [doc.to_dict()] if doc.exists else []
+    else:
+        days = rollups.get_rollups(db, user_id, start, end)
+    
+    summary = rollups.summarize(
+        (day.get("sketch") for day in days),
+        sum(day.get("total_duration", 0) for day in days)
+    )
+    summary.update({
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None
+    })
+    return summary
@@ -3,10 +3,14 @@ import json
 import firebase_admin
 from firebase_admin import auth, credentials, firestore
 from fastapi import Depends
+import logging
+from instrumented_db import InstrumentedClient
 
 # Hardcoded path to credentials
 CREDENTIALS_PATH = os.path.join(os.path.dirname(__file__), "firebase-credentials.json")
 
+logger = logging.getLogger(__name__)
+
 # Global database instance
 _db = None
 _app = None
@@ -27,17 +31,16 @@ def get_db():
         if not firebase_admin._apps:
             cred = credentials.Certificate(CREDENTIALS_PATH)
             _app = firebase_admin.initialize_app(cred)
-            print("Firebase Admin SDK initialized successfully")
+            logger.info("Firebase Admin SDK initialized successfully")
         else:
             _app = firebase_admin.get_app()
-            print("Using existing Firebase Admin SDK app")
+            logger.info("Using existing Firebase Admin SDK app")
         
-        # Initialize Firestore client using the same app
-        _db = firestore.client()
-        print(f"Successfully connected to Firebase project")
+        # Initialize Firestore client using the same app, wrapped so that
+        # reads, writes and queries show up in /metrics
+        _db = InstrumentedClient(firestore.client())
+        logger.info("Successfully connected to Firebase project")
         return _db
     except Exception as e:
-        print(f"Error initializing Firebase: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Error initializing Firebase")
         raise 
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""
+Cached verification of Google / Firebase ID tokens for /auth/google
+Verified tokens are remembered by hash until their exp, and the Google signing
+certificates are kept warm by a background refresh task
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Optional
+
+import firebase_admin
+import requests
+from firebase_admin import auth as firebase_auth
+from google.auth import jwt as google_jwt
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Public certificates used to sign Firebase ID tokens
+CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+
+# Refresh the certificates this long before Google says they expire
+CERTS_REFRESH_MARGIN = 300
+CERTS_MIN_REFRESH_INTERVAL = 60
+
+# Verified token claims, keyed by sha256 of the raw token
+_verified_tokens = TTLCache("google_id_tokens", maxsize=int(os.environ.get("CHRONA_ID_TOKEN_CACHE_SIZE", "10000")))
+
+_certs: Dict[str, str] = {}
+_certs_expire_at = 0.0
+_refresh_task: Optional[asyncio.Task] = None
+
+def _token_key(id_token: str) -> str:
+    return hashlib.sha256(id_token.encode()).hexdigest()
+
+def _fetch_certs() -> float:
+    """Download the signing certificates, returns seconds until they expire"""
+    global _certs, _certs_expire_at
+
+    response = requests.get(CERTS_URL, timeout=10)
+    response.raise_for_status()
+
+    max_age = 3600
+    match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+    if match:
+        max_age = int(match.group(1))
+
+    _certs = response.json()
+    _certs_expire_at = time.time() + max_age
+    return max_age
+
+async def _refresh_certs_forever():
+    """Keep the signing certificates fresh ahead of their expiry"""
+    while True:
+        try:
+            max_age = await asyncio.to_thread(_fetch_certs)
+            delay = max(CERTS_MIN_REFRESH_INTERVAL, max_age - CERTS_REFRESH_MARGIN)
+        except Exception as e:
+            logger.warning("Error refreshing Google signing certificates: %s", e)
+            delay = CERTS_MIN_REFRESH_INTERVAL
+        await asyncio.sleep(delay)
+
+def start_cert_refresh():
+    """Start the background certificate refresh task"""
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_refresh_certs_forever())
+
+async def stop_cert_refresh():
+    """Stop the background certificate refresh task"""
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None
+
+def _verify_locally(id_token: str) -> Dict[str, Any]:
+    """Verify a Firebase ID token against the cached certificates
+
+    Performs the same claim checks as firebase_admin.auth.verify_id_token.
+    """
+    project_id = firebase_admin.get_app().project_id
+    claims = google_jwt.decode(id_token, certs=_certs, audience=project_id)
+
+    if claims.get("iss") != f"https://securetoken.google.com/{project_id}":
+        raise ValueError("ID token has incorrect issuer")
+    subject = claims.get("sub")
+    if not subject or len(subject) > 128:
+        raise ValueError("ID token has invalid subject")
+    if claims.get("auth_time", 0) > time.time() + 60:
+        raise ValueError("ID token has future auth_time")
+
+    claims["uid"] = subject
+    return claims
+
+def _verify(id_token: str) -> Dict[str, Any]:
+    """Verify an ID token, preferring the cached certificates"""
+    if _certs and time.time() < _certs_expire_at:
+        try:
+            return _verify_locally(id_token)
+        except Exception:
+            # Unknown key ID after a rotation or a real failure, let the
+            # Admin SDK give the authoritative answer
+            pass
+    return firebase_auth.verify_id_token(id_token)
+
+async def verify_id_token(id_token: str) -> Dict[str, Any]:
+    """Verify a Google ID token, reusing earlier results until the token expires"""
+    key = _token_key(id_token)
+    claims = _verified_tokens.get(key)
+    if claims is not None:
+        return claims
+
+    claims = await asyncio.to_thread(_verify, id_token)
+
+    ttl = claims.get("exp", 0) - time.time()
+    if ttl > 0:
+        _verified_tokens.set(key, claims, ttl=ttl)
+    return claims
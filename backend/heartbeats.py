@@ -0,0 +1,136 @@
+"""
+Coalesced timer heartbeats for POST /timer/heartbeat
+A heartbeat only records the time an open entry was last seen in memory. A
+background task writes the latest time of every entry heard from since the
+previous flush to its last_seen field, once per CHRONA_HEARTBEAT_FLUSH_SECONDS,
+in write batches shared by all users. Trackers can therefore send heartbeats as
+often as they like for at most one write per entry and interval.
+
+The owner cache below is per instance and is not told when another instance
+stops or deletes an entry, so every flush reads the entries first and only
+updates those still open, guarded by their update time.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from google.api_core.exceptions import FailedPrecondition, NotFound
+
+from cache import TTLCache
+import layout
+
+logger = logging.getLogger(__name__)
+
+# Seconds between writes of buffered heartbeats, keep well below the stale
+# entry timeout (CHRONA_HEARTBEAT_TIMEOUT_MINUTES)
+FLUSH_SECONDS = float(os.environ.get("CHRONA_HEARTBEAT_FLUSH_SECONDS", "60"))
+
+# Entry updates per write batch (Firestore allows 500 writes)
+FLUSH_BATCH_SIZE = 400
+
+# Owner of entries that already passed the ownership check, so repeated
+# heartbeats for a running timer need no read ("" for entries without an owner)
+entry_owners = TTLCache("heartbeat_entry_owners", maxsize=10000, ttl=3600)
+
+_lock = threading.Lock()
+# (entry ID, user ID) -> latest heartbeat not yet written
+_pending: Dict[Tuple[str, Optional[str]], datetime] = {}
+_flush_task: Optional[asyncio.Task] = None
+
+def record(entry_id: str, user_id: Optional[str], seen_at: Optional[datetime] = None) -> datetime:
+    """Buffer a heartbeat, returns the time recorded"""
+    seen_at = seen_at or datetime.now(timezone.utc)
+    key = (entry_id, user_id)
+    with _lock:
+        if key not in _pending or _pending[key] < seen_at:
+            _pending[key] = seen_at
+    return seen_at
+
+def _requeue(items):
+    """Put back heartbeats that could not be written, unless newer ones arrived"""
+    with _lock:
+        for key, seen_at in items:
+            if key not in _pending or _pending[key] < seen_at:
+                _pending[key] = seen_at
+
+def _write(db, items) -> int:
+    """Write one batch of last_seen updates, returns how many entries were updated"""
+    refs = {
+        item: layout.entries_collection(db, item[0][1]).document(item[0][0])
+        for item in items
+    }
+    snapshots = {snapshot.reference.path: snapshot for snapshot in db.get_all(list(refs.values()))}
+
+    batch = db.batch()
+    written = 0
+    for ((entry_id, user_id), seen_at), ref in refs.items():
+        snapshot = snapshots.get(ref.path)
+        if snapshot is None or not snapshot.exists or (snapshot.to_dict() or {}).get("end_time") is not None:
+            # Deleted or stopped, possibly on another instance
+            entry_owners.pop(entry_id)
+            continue
+        # Fails if the entry changed since the read, e.g. was just stopped
+        batch.update(ref, {"last_seen": seen_at}, option=db.write_option(last_update_time=snapshot.update_time))
+        written += 1
+    if written:
+        batch.commit()
+    return written
+
+def flush(db) -> int:
+    """Write all buffered heartbeats, returns how many entries were updated"""
+    global _pending
+    with _lock:
+        items, _pending = list(_pending.items()), {}
+
+    written = 0
+    for i in range(0, len(items), FLUSH_BATCH_SIZE):
+        chunk = items[i:i + FLUSH_BATCH_SIZE]
+        try:
+            written += _write(db, chunk)
+        except (FailedPrecondition, NotFound):
+            # An entry changed since it was read, write the rest one by one
+            for item in chunk:
+                try:
+                    written += _write(db, [item])
+                except (FailedPrecondition, NotFound):
+                    entry_owners.pop(item[0][0])
+        except Exception:
+            _requeue(items[i:])
+            raise
+    return written
+
+async def _flush_forever(db):
+    """Write buffered heartbeats every FLUSH_SECONDS"""
+    while True:
+        await asyncio.sleep(FLUSH_SECONDS)
+        try:
+            written = await asyncio.to_thread(flush, db)
+            if written:
+                logger.debug("Flushed heartbeats", extra={"entries": written})
+        except Exception:
+            logger.exception("Heartbeat flush failed")
+
+def start_flush(db):
+    """Start the background heartbeat flush task"""
+    global _flush_task
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_forever(db))
+
+async def stop_flush(db):
+    """Stop the flush task and write what is still buffered"""
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    try:
+        await asyncio.to_thread(flush, db)
+    except Exception:
+        logger.exception("Final heartbeat flush failed")
@@ -0,0 +1,43 @@
+"""
+Hour-of-day by weekday heatmap of tracked time
+Entries are split across local hour boundaries with array operations only, so a
+year of minute-level entries is handled in milliseconds
+"""
+
+import numpy as np
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+def weekday_hour_heatmap(bounds: np.ndarray, labels: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Seconds tracked in each (weekday, hour) cell
+
+    bounds/labels are hour bins from timezones.hour_boundaries, starts/ends are
+    entry intervals in UTC epoch seconds. Intervals are clipped to the bins.
+    """
+    bins = len(bounds) - 1
+    starts = np.clip(starts, bounds[0], bounds[-1])
+    ends = np.clip(ends, bounds[0], bounds[-1])
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+
+    per_bin = np.zeros(bins)
+    if len(starts):
+        first = np.minimum(np.searchsorted(bounds, starts, side="right") - 1, bins - 1)
+        last = np.minimum(np.searchsorted(bounds, ends, side="left") - 1, bins - 1)
+
+        # Entries inside a single bin
+        single = first == last
+        np.add.at(per_bin, first[single], ends[single] - starts[single])
+
+        # Entries spanning bins: partial first and last bins...
+        multi = ~single
+        np.add.at(per_bin, first[multi], bounds[first[multi] + 1] - starts[multi])
+        np.add.at(per_bin, last[multi], ends[multi] - bounds[last[multi]])
+
+        # ...and every bin in between fully covered, via a difference array
+        coverage = np.zeros(bins + 1, dtype=np.int64)
+        np.add.at(coverage, first[multi] + 1, 1)
+        np.add.at(coverage, last[multi], -1)
+        per_bin += np.cumsum(coverage[:-1]) * np.diff(bounds)
+
+    return np.bincount(labels, weights=per_bin, minlength=7 * 24).reshape(7, 24)
@@ -0,0 +1,99 @@
+"""
+Idempotency keys for write requests
+A client may send an Idempotency-Key header on POST, PUT, PATCH and DELETE. The
+first request with a key reserves idempotency_keys/{hash of user and key}, runs,
+and stores its response there. A retry with the same key costs one point read
+and gets the stored response back instead of running again. Keys expire after
+CHRONA_IDEMPOTENCY_TTL_HOURS; expires_at is meant for a Firestore TTL policy,
+expired records are also ignored on lookup.
+"""
+
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+
+IDEMPOTENCY_COLLECTION = 'idempotency_keys'
+
+# Methods whose requests are deduplicated
+METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+# How long a stored response is replayed
+TTL = timedelta(hours=float(os.environ.get("CHRONA_IDEMPOTENCY_TTL_HOURS", "24")))
+
+# A reservation without a response after this long belongs to a request that
+# died, a retry may take it over
+PENDING_TIMEOUT = timedelta(seconds=60)
+
+MAX_KEY_LENGTH = 255
+
+# Larger responses are not stored, Firestore documents are limited to 1 MiB
+MAX_STORED_BODY = 512 * 1024
+
+def record_id(user_id: str, key: str) -> str:
+    return hashlib.sha256(f"{user_id}\n{key}".encode()).hexdigest()
+
+def fingerprint(method: str, path: str, query: str, body: bytes) -> str:
+    """Identifies the request a key was first used for"""
+    # The query string changes behaviour, e.g. ?on_conflict=stop
+    digest = hashlib.sha256(f"{method} {path}?{query}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+def _ref(db, doc_id: str):
+    return db.collection(IDEMPOTENCY_COLLECTION).document(doc_id)
+
+def lookup(db, doc_id: str):
+    """Read the record for a key, None if there is none"""
+    snapshot = _ref(db, doc_id).get()
+    return snapshot if snapshot.exists else None
+
+def is_expired(snapshot) -> bool:
+    # The TTL policy deletes expired records lazily
+    return snapshot.get("expires_at") <= datetime.now(timezone.utc)
+
+def is_abandoned(snapshot) -> bool:
+    """Whether a record is a reservation whose request never finished"""
+    return snapshot.get("status_code") is None and snapshot.get("reserved_at") <= datetime.now(timezone.utc) - PENDING_TIMEOUT
+
+def reserve(db, doc_id: str, request_fingerprint: str, replacing=None) -> bool:
+    """Claim a key for a request, False if another request claimed it first.
+    replacing is the expired or abandoned record found by lookup"""
+    now = datetime.now(timezone.utc)
+    record = {
+        "fingerprint": request_fingerprint,
+        "reserved_at": now,
+        "expires_at": now + TTL,
+        "status_code": None,
+        "media_type": None,
+        "body": None
+    }
+    ref = _ref(db, doc_id)
+    try:
+        if replacing is None:
+            ref.create(record)
+        else:
+            # Take over an abandoned or expired record unless someone else did
+            ref.update(record, option=db.write_option(last_update_time=replacing.update_time))
+        return True
+    except (AlreadyExists, FailedPrecondition, NotFound):
+        return False
+
+def save(db, doc_id: str, status_code: int, media_type: Optional[str], body: bytes):
+    """Store the response of a reserved key"""
+    _ref(db, doc_id).update({
+        "status_code": status_code,
+        "media_type": media_type,
+        "body": body,
+        "expires_at": datetime.now(timezone.utc) + TTL
+    })
+
+def release(db, doc_id: str):
+    """Drop a reservation so the request can be retried"""
+    _ref(db, doc_id).delete()
+
+def stored_response(snapshot) -> Dict[str, Any]:
+    data = snapshot.to_dict()
+    return {"status_code": data["status_code"], "media_type": data.get("media_type"), "content": data.get("body") or b""}
@@ -0,0 +1,227 @@
+"""
+Instrumented wrapper around the Firestore client returned by database.get_db
+Counts document reads, writes and queries so /metrics can attribute Firestore
+cost to API routes, and reports slow operations to slow_ops. Anything not
+wrapped here is passed straight through.
+"""
+
+import time
+from typing import Any, Dict
+
+import metrics
+import slow_ops
+
+def _unwrap(obj):
+    """Return the underlying Firestore object for a wrapper"""
+    return getattr(obj, "_wrapped", obj)
+
+class _Wrapper:
+    """Delegate attribute access to the wrapped Firestore object"""
+
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._wrapped!r})"
+
+def _direction(kwargs) -> str:
+    direction = kwargs.get("direction", "ASCENDING")
+    return "desc" if str(direction).upper() == "DESCENDING" else "asc"
+
+def _collection_path(collection) -> str:
+    parent = collection.parent
+    path = collection.id if parent is None else f"{parent.path}/{collection.id}"
+    return slow_ops.collection_path(path)
+
+class InstrumentedQuery(_Wrapper):
+    """Query or collection reference
+
+    Keeps the shape of the query (filters, ordering, limits) so slow
+    operations can be grouped by a normalized fingerprint.
+    """
+
+    def __init__(self, wrapped, shape: Dict[str, Any]):
+        super().__init__(wrapped)
+        self._shape = shape
+
+    def _wrap(self, query, **changes):
+        shape = dict(self._shape)
+        for key, value in changes.items():
+            if isinstance(shape.get(key), list):
+                shape[key] = shape[key] + value
+            else:
+                shape[key] = value
+        return InstrumentedQuery(query, shape)
+
+    def where(self, *args, **kwargs):
+        field_filter = kwargs.get("filter")
+        if field_filter is not None and hasattr(field_filter, "field_path"):
+            condition = (field_filter.field_path, field_filter.op_string)
+        elif len(args) >= 2:
+            condition = (args[0], args[1])
+        else:
+            condition = (str(field_filter or kwargs.get("field_path")), kwargs.get("op_string", "?"))
+        return self._wrap(self._wrapped.where(*args, **kwargs), filters=[condition])
+
+    def order_by(self, field_path, *args, **kwargs):
+        return self._wrap(self._wrapped.order_by(field_path, *args, **kwargs), order=[(field_path, _direction(kwargs))])
+
+    def limit(self, *args, **kwargs):
+        return self._wrap(self._wrapped.limit(*args, **kwargs), limit=True)
+
+    def limit_to_last(self, *args, **kwargs):
+        return self._wrap(self._wrapped.limit_to_last(*args, **kwargs), limit=True)
+
+    def offset(self, *args, **kwargs):
+        return self._wrap(self._wrapped.offset(*args, **kwargs), offset=True)
+
+    def select(self, field_paths, *args, **kwargs):
+        return self._wrap(self._wrapped.select(field_paths, *args, **kwargs), select=list(field_paths))
+
+    def start_at(self, *args, **kwargs):
+        return self._wrap(self._wrapped.start_at(*args, **kwargs))
+
+    def start_after(self, *args, **kwargs):
+        return self._wrap(self._wrapped.start_after(*args, **kwargs))
+
+    def end_at(self, *args, **kwargs):
+        return self._wrap(self._wrapped.end_at(*args, **kwargs))
+
+    def end_before(self, *args, **kwargs):
+        return self._wrap(self._wrapped.end_before(*args, **kwargs))
+
+    def get(self, *args, **kwargs):
+        if "transaction" in kwargs:
+            kwargs["transaction"] = _unwrap(kwargs["transaction"])
+        metrics.record_firestore_op("query")
+        start = time.perf_counter()
+        results = self._wrapped.get(*args, **kwargs)
+        slow_ops.record("query", self._shape, time.perf_counter() - start, len(results))
+        metrics.record_firestore_op("read", max(1, len(results)))
+        return results
+
+    def stream(self, *args, **kwargs):
+        if "transaction" in kwargs:
+            kwargs["transaction"] = _unwrap(kwargs["transaction"])
+        metrics.record_firestore_op("query")
+        count = 0
+        elapsed = 0.0
+        iterator = iter(self._wrapped.stream(*args, **kwargs))
+        while True:
+            # Time only the fetches, not the caller's work between documents
+            start = time.perf_counter()
+            try:
+                snapshot = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                break
+            elapsed += time.perf_counter() - start
+            count += 1
+            metrics.record_firestore_op("read")
+            yield snapshot
+        slow_ops.record("query", self._shape, elapsed, count)
+        # An empty result set is still billed as one read
+        if count == 0:
+            metrics.record_firestore_op("read")
+
+class InstrumentedCollection(InstrumentedQuery):
+    """Collection reference"""
+
+    def __init__(self, wrapped):
+        super().__init__(wrapped, {"collection": _collection_path(wrapped), "filters": [], "order": []})
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs))
+
+    def add(self, *args, **kwargs):
+        metrics.record_firestore_op("write")
+        return self._wrapped.add(*args, **kwargs)
+
+class InstrumentedDocument(_Wrapper):
+    """Document reference"""
+
+    def _timed(self, operation, method, *args, **kwargs):
+        start = time.perf_counter()
+        result = method(*args, **kwargs)
+        shape = {"collection": slow_ops.collection_path(self._wrapped.path)}
+        slow_ops.record(operation, shape, time.perf_counter() - start, 1)
+        return result
+
+    def collection(self, *args, **kwargs):
+        return InstrumentedCollection(self._wrapped.collection(*args, **kwargs))
+
+    def get(self, *args, **kwargs):
+        if "transaction" in kwargs:
+            kwargs["transaction"] = _unwrap(kwargs["transaction"])
+        metrics.record_firestore_op("read")
+        return self._timed("get", self._wrapped.get, *args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        metrics.record_firestore_op("write")
+        return self._timed("set", self._wrapped.set, *args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        metrics.record_firestore_op("write")
+        return self._timed("create", self._wrapped.create, *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        metrics.record_firestore_op("write")
+        return self._timed("update", self._wrapped.update, *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        metrics.record_firestore_op("write")
+        return self._timed("delete", self._wrapped.delete, *args, **kwargs)
+
+class InstrumentedWriteBatch(_Wrapper):
+    """Write batch or transaction, counts writes when they are staged"""
+
+    def set(self, reference, *args, **kwargs):
+        metrics.record_firestore_op("write")
+        return self._wrapped.set(_unwrap(reference), *args, **kwargs)
+
+    def create(self, reference, *args, **kwargs):
+        metrics.record_firestore_op("write")
+        return self._wrapped.create(_unwrap(reference), *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        metrics.record_firestore_op("write")
+        return self._wrapped.update(_unwrap(reference), *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        metrics.record_firestore_op("write")
+        return self._wrapped.delete(_unwrap(reference), *args, **kwargs)
+
+class InstrumentedClient(_Wrapper):
+    """Firestore client"""
+
+    def collection(self, *args, **kwargs):
+        return InstrumentedCollection(self._wrapped.collection(*args, **kwargs))
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs))
+
+    def collection_group(self, collection_id, *args, **kwargs):
+        shape = {"collection": f"**/{collection_id}", "filters": [], "order": []}
+        return InstrumentedQuery(self._wrapped.collection_group(collection_id, *args, **kwargs), shape)
+
+    def batch(self):
+        return InstrumentedWriteBatch(self._wrapped.batch())
+
+    def transaction(self, *args, **kwargs):
+        return InstrumentedWriteBatch(self._wrapped.transaction(*args, **kwargs))
+
+    def bulk_writer(self, *args, **kwargs):
+        return InstrumentedWriteBatch(self._wrapped.bulk_writer(*args, **kwargs))
+
+    def recursive_delete(self, reference, *args, **kwargs):
+        return self._wrapped.recursive_delete(_unwrap(reference), *args, **kwargs)
+
+    def get_all(self, references, *args, **kwargs):
+        references = [_unwrap(reference) for reference in references]
+        if "transaction" in kwargs:
+            kwargs["transaction"] = _unwrap(kwargs["transaction"])
+        metrics.record_firestore_op("read", len(references))
+        return self._wrapped.get_all(references, *args, **kwargs)
@@ -0,0 +1,62 @@
+"""
+Where tasks and time entries live in Firestore
+CHRONA_DATA_LAYOUT selects one of:
+  - "global" (default): top-level tasks and time_entries collections shared by
+    every user and filtered by user_id
+  - "user": users/{user_id}/tasks and users/{user_id}/time_entries, so a user's
+    queries stay within their own documents and need no composite indexes
+Switch to "user" after copying existing data with migrate_data_layout.py.
+"""
+
+import os
+
+DATA_LAYOUT = os.environ.get("CHRONA_DATA_LAYOUT", "global")
+if DATA_LAYOUT not in ("global", "user"):
+    raise ValueError(f"CHRONA_DATA_LAYOUT must be 'global' or 'user', not {DATA_LAYOUT!r}")
+
+PER_USER = DATA_LAYOUT == "user"
+
+def global_tasks(db):
+    return db.collection('tasks')
+
+def global_entries(db):
+    return db.collection('time_entries')
+
+def user_tasks(db, user_id: str):
+    return db.collection('users').document(user_id).collection('tasks')
+
+def user_entries(db, user_id: str):
+    return db.collection('users').document(user_id).collection('time_entries')
+
+def tasks_collection(db, user_id: str = None):
+    """A user's tasks; documents without an owner stay in the global collection"""
+    if PER_USER and user_id:
+        return user_tasks(db, user_id)
+    return global_tasks(db)
+
+def entries_collection(db, user_id: str = None):
+    """A user's time entries; documents without an owner stay in the global collection"""
+    if PER_USER and user_id:
+        return user_entries(db, user_id)
+    return global_entries(db)
+
+def all_tasks(db):
+    """Query over every user's tasks, filter the results with in_layout()"""
+    if PER_USER:
+        return db.collection_group('tasks')
+    return global_tasks(db)
+
+def all_entries(db):
+    """Query over every user's time entries, filter the results with in_layout()"""
+    if PER_USER:
+        return db.collection_group('time_entries')
+    return global_entries(db)
+
+def in_layout(doc) -> bool:
+    """Whether a document from all_tasks() or all_entries() is stored in the
+    current layout. Collection group queries also match the top-level
+    collections, which keep their copies of owned documents until
+    migrate_data_layout.py --delete-source removes them."""
+    if not PER_USER or doc.reference.parent.parent is not None:
+        return True
+    return not doc.to_dict().get("user_id")
@@ -0,0 +1,122 @@
+"""
+Structured JSON logging for the API
+Records are handed to a QueueHandler on the request path and written to stdout
+by a QueueListener thread, so handlers never block on I/O.
+
+Environment variables:
+    CHRONA_LOG_LEVEL               root level, default INFO
+    CHRONA_LOG_LEVELS              per-module levels, e.g. "crud=DEBUG,main=WARNING"
+    CHRONA_LOG_DEBUG_SAMPLE_RATE   fraction of DEBUG records kept, default 1.0
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+# Request ID of the request being handled, set by the request middleware
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# LogRecord attributes that are not user supplied "extra" fields
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id", "sample_rate"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+
+        # Extra fields passed with logger.info(..., extra={...})
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+class RequestContextFilter(logging.Filter):
+    """Attach the current request ID and drop sampled-out records"""
+
+    def __init__(self, debug_sample_rate: float = 1.0):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record):
+        # Per-call rate from extra={"sample_rate": ...}, else the DEBUG default
+        default_rate = self.debug_sample_rate if record.levelno <= logging.DEBUG else 1.0
+        rate = getattr(record, "sample_rate", default_rate)
+        if rate < 1.0 and random.random() >= rate:
+            return False
+
+        record.request_id = request_id_var.get()
+        return True
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread"""
+
+    def prepare(self, record):
+        # Resolve the message now since its args may change after we return,
+        # traceback rendering and JSON encoding happen on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def _parse_levels(spec: str):
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def setup_logging():
+    """Install the queue-backed JSON logging configuration once per process"""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    queue_handler = _NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter(float(os.environ.get("CHRONA_LOG_DEBUG_SAMPLE_RATE", "1.0"))))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(os.environ.get("CHRONA_LOG_LEVEL", "INFO").upper())
+
+    for name, level in _parse_levels(os.environ.get("CHRONA_LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,11 +1,18 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Request, Body
+from fastapi.responses import PlainTextResponse, JSONResponse, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from typing import List, Optional, Dict, Any
-import models, schemas, crud
+import models, schemas, compression, crud, google_tokens, heartbeats, idempotency, metrics, profiling, scheduler, serialization, slow_ops, sync, timezones
+import threading
+import hmac
+from logging_config import setup_logging, request_id_var
+import asyncio
 from database import get_db
-from datetime import datetime, timedelta
-import traceback
+from datetime import date, datetime, timedelta, timezone
+import logging
+import uuid
 from jose import JWTError, jwt
 from firebase_admin import auth as firebase_auth
 from pydantic import BaseModel
@@ -16,14 +23,134 @@ import os
 # JWT configuration
 SECRET_KEY = "PLACEHOLDER_SECRET_KEY_REPLACE_IN_PRODUCTION"  # In production, load from env var like: os.environ.get("SECRET_KEY")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 1 week
+# Access tokens carry the user claims and are short-lived, refresh tokens renew them
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+
+# Admin endpoints and per-request profiling require this token in X-Admin-Token,
+# they are disabled when it is not set
+ADMIN_TOKEN = os.environ.get("CHRONA_ADMIN_TOKEN")
+
+# Maintenance jobs: closing orphaned open entries, and nightly rollup rebuild
+# plus archiving at CHRONA_MAINTENANCE_HOUR_UTC. Set CHRONA_SCHEDULER=0 to disable.
+SCHEDULER_ENABLED = os.environ.get("CHRONA_SCHEDULER", "1") != "0"
+STALE_CHECK_INTERVAL = timedelta(minutes=float(os.environ.get("CHRONA_STALE_CHECK_MINUTES", "10")))
+MAINTENANCE_TIME = datetime.min.time().replace(hour=int(os.environ.get("CHRONA_MAINTENANCE_HOUR_UTC", "3")))
+
+# Structured logging, written off the request path
+setup_logging()
+logger = logging.getLogger(__name__)
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 app = FastAPI(title="Chrona Time Tracker API")
 
-# Configure CORS
+def is_admin_request(request: Request) -> bool:
+    """Check the X-Admin-Token header against CHRONA_ADMIN_TOKEN"""
+    token = request.headers.get("X-Admin-Token")
+    return bool(ADMIN_TOKEN and token and hmac.compare_digest(token, ADMIN_TOKEN))
+
+async def require_admin(request: Request):
+    """Dependency for admin-only endpoints"""
+    if not is_admin_request(request):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+
+@app.middleware("http")
+async def replay_idempotent_writes(request: Request, call_next):
+    """Answer retried writes carrying an Idempotency-Key with the stored response"""
+    key = request.headers.get("Idempotency-Key")
+    if key is None or request.method not in idempotency.METHODS:
+        return await call_next(request)
+    if not key or len(key) > idempotency.MAX_KEY_LENGTH:
+        return JSONResponse(status_code=400, content={"detail": f"Idempotency-Key must be 1 to {idempotency.MAX_KEY_LENGTH} characters"})
+    
+    # Keys are scoped to the user, anonymous requests run as usual
+    user = await get_optional_user(request)
+    if user is None:
+        return await call_next(request)
+    
+    db = get_db()
+    doc_id = idempotency.record_id(user["id"], key)
+    request_fingerprint = idempotency.fingerprint(request.method, request.url.path, request.url.query, await request.body())
+    record = idempotency.lookup(db, doc_id)
+    if record is not None and not idempotency.is_expired(record):
+        if record.get("fingerprint") != request_fingerprint:
+            return JSONResponse(status_code=422, content={"detail": "Idempotency-Key was already used for a different request"})
+        if record.get("status_code") is not None:
+            stored = idempotency.stored_response(record)
+            return Response(headers={"Idempotent-Replayed": "true"}, **stored)
+        if not idempotency.is_abandoned(record):
+            return JSONResponse(status_code=409, content={"detail": "A request with this Idempotency-Key is still in progress"})
+    if not idempotency.reserve(db, doc_id, request_fingerprint, replacing=record):
+        return JSONResponse(status_code=409, content={"detail": "A request with this Idempotency-Key is still in progress"})
+    
+    try:
+        response = await call_next(request)
+    except Exception:
+        idempotency.release(db, doc_id)
+        raise
+    
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    if response.status_code >= 500 or len(body) > idempotency.MAX_STORED_BODY:
+        # Let the client retry failures, and don't store what doesn't fit
+        idempotency.release(db, doc_id)
+    else:
+        idempotency.save(db, doc_id, response.status_code, response.headers.get("content-type"), body)
+    return Response(content=body, status_code=response.status_code, headers=dict(response.headers))
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Sample the event loop while handling requests that ask to be profiled"""
+    wants_profile = request.headers.get("X-Profile") == "1" and is_admin_request(request)
+    if not wants_profile and not profiling.claim_pending():
+        return await call_next(request)
+    
+    request_id = request_id_var.get()
+    profiler = profiling.SamplingProfiler(threading.get_ident())
+    profiler.start()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+        profiling.profiles.set(request_id, profiler.result(request_id, request.method, request.url.path))
+    response.headers["X-Profile-Id"] = request_id
+    return response
+
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    """Tag logs for this request with an ID, reusing the client's X-Request-ID"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        request_id_var.reset(token)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Record latency and Firestore operations per route"""
+    ops = metrics.start_request()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep label cardinality bounded
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        metrics.finish_request(route_path, request.method, status_code, time.perf_counter() - start, ops)
+
+# Wraps every middleware above, idempotent replays store and serve
+# uncompressed bodies
+app.add_middleware(compression.CompressionMiddleware)
+
+# Configure CORS, added last so it is outermost and replayed or rejected
+# responses from the middleware above get CORS headers too
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allows all origins in development
@@ -33,68 +160,140 @@ app.add_middleware(
 )
 
 # Helper functions for auth
-def create_access_token(data: dict):
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_db)):
-    """Verify JWT token and return current user"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
+def issue_tokens(user: Dict[str, Any]) -> Dict[str, Any]:
+    """Create the access/refresh token pair returned by the login endpoints"""
+    access_token = create_access_token(data={
+        "sub": user["id"],
+        "email": user.get("email"),
+        "name": user.get("name"),
+        "tz": user.get("timezone"),
+        "type": "access"
+    })
+    # Each refresh token is single use, jti identifies it and iat is compared
+    # against the user's last revocation
+    refresh_token = create_access_token(
+        data={"sub": user["id"], "type": "refresh", "jti": uuid.uuid4().hex, "iat": time.time()},
+        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     )
     
+    # Calculate expiration time
+    expires_at = int(time.time()) + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "user_id": user["id"],
+        "expires_at": expires_at,
+        "refresh_token": refresh_token
+    }
+
+def user_from_token(token: str) -> Optional[Dict[str, Any]]:
+    """Get the user claims from an access token without touching Firestore"""
     try:
-        # Decode JWT token
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-        
-        # Get user from database
-        user = await crud.get_user_by_id(db, user_id)
-        if user is None:
-            raise credentials_exception
-        
-        return user
     except JWTError:
-        raise credentials_exception
+        return None
+    
+    user_id: str = payload.get("sub")
+    # Tokens issued before refresh tokens existed carry no type claim
+    if user_id is None or payload.get("type", "access") != "access":
+        return None
+    
+    return {
+        "id": user_id,
+        "email": payload.get("email"),
+        "name": payload.get("name"),
+        "timezone": payload.get("tz")
+    }
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    """Verify JWT token and return the user claims it carries"""
+    user = user_from_token(token)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
 
 # Optional user authentication - allows API access without auth
-async def get_optional_user(request: Request, db=Depends(get_db)):
+async def get_optional_user(request: Request):
     """Get the current user if authenticated, otherwise None"""
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
         return None
     
     token = auth_header.replace("Bearer ", "")
-    try:
-        # Decode JWT token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            return None
-        
-        # Get user from database
-        user = await crud.get_user_by_id(db, user_id)
-        return user
-    except JWTError:
-        return None
+    return user_from_token(token)
 
 @app.on_event("startup")
 async def startup():
     # Initialize Firebase connection
     get_db()
+    # Keep Google signing keys warm for /auth/google
+    google_tokens.start_cert_refresh()
+    # Sample event-loop lag for /metrics
+    app.state.loop_lag_task = asyncio.create_task(metrics.monitor_event_loop_lag())
+    # Write buffered timer heartbeats in the background
+    heartbeats.start_flush(get_db())
+    # Maintenance jobs, run by whichever instance holds the scheduler lease
+    app.state.scheduler = None
+    if SCHEDULER_ENABLED:
+        app.state.scheduler = scheduler.Scheduler(get_db())
+        app.state.scheduler.every("close_stale_entries", STALE_CHECK_INTERVAL, crud.close_stale_entries)
+        app.state.scheduler.daily("nightly_maintenance", MAINTENANCE_TIME, crud.nightly_maintenance)
+        app.state.scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await google_tokens.stop_cert_refresh()
+    app.state.loop_lag_task.cancel()
+    await heartbeats.stop_flush(get_db())
+    if app.state.scheduler is not None:
+        await app.state.scheduler.stop()
 
 @app.get("/")
 async def root():
     return {"message": "Chrona Time Tracker API is running"}
 
+@app.post("/admin/profiling", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def profile_next_requests(requests: int = Body(..., embed=True)):
+    """Profile the next N requests to any endpoint"""
+    profiling.profile_next(requests)
+    return {"profiling_next": requests}
+
+@app.get("/admin/profiles/{request_id}", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def read_profile(request_id: str, format: str = "speedscope"):
+    """Get a request profile as speedscope JSON or collapsed stacks"""
+    profile = profiling.profiles.get(request_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        return PlainTextResponse(profiling.to_collapsed(profile))
+    return profiling.to_speedscope(profile)
+
+@app.get("/admin/slow-ops", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def read_slow_ops(fingerprint_id: Optional[str] = None):
+    """Recent Firestore operations over the latency or document-count threshold"""
+    return {
+        "thresholds": {"elapsed_ms": slow_ops.SLOW_OP_MS, "docs": slow_ops.SLOW_OP_DOCS},
+        "operations": slow_ops.recent(fingerprint_id)
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics():
+    """Prometheus text exposition of the API metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Auth endpoints
 @app.post("/register", response_model=schemas.User)
 async def register(user: schemas.UserCreate, db=Depends(get_db)):
@@ -108,8 +307,7 @@ async def register(user: schemas.UserCreate, db=Depends(get_db)):
             detail=str(e)
         )
     except Exception as e:
-        print(f"Registration error: {e}")
-        print(traceback.format_exc())
+        logger.exception("Registration error")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred during registration"
@@ -127,87 +325,119 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db=Depends(get
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Create access token
-    access_token = create_access_token(data={"sub": user["user_id"]})
+    # Create access and refresh tokens
+    return issue_tokens({"id": user["user_id"], "email": user["email"], "name": user["name"], "timezone": user.get("timezone")})
+
+@app.post("/token/refresh", response_model=schemas.TokenData)
+async def refresh_token(refresh_token: str = Body(..., embed=True), db=Depends(get_db)):
+    """Exchange a refresh token for a new access and refresh token"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    
+    try:
+        payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
     
-    # Calculate expiration time
-    expires_at = int(time.time()) + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    user_id = payload.get("sub")
+    if user_id is None or payload.get("type") != "refresh" or not payload.get("jti"):
+        raise credentials_exception
     
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user_id": user["user_id"],
-        "expires_at": expires_at
-    }
+    # Reload the user so renewed claims pick up changes and deleted users are rejected
+    user = await crud.get_user_by_id(db, user_id)
+    if user is None:
+        raise credentials_exception
+    if payload.get("iat", 0) <= (user.get("tokens_revoked_at") or 0):
+        raise credentials_exception
+    
+    # A refresh token that was already exchanged has leaked, revoke them all
+    expires_at = datetime.fromtimestamp(payload["exp"], timezone.utc)
+    if not await crud.use_refresh_token(db, payload["jti"], user_id, expires_at):
+        logger.warning("Refresh token reused, revoking the user's refresh tokens", extra={"user_id": user_id})
+        await crud.revoke_refresh_tokens(db, user_id)
+        raise credentials_exception
+    
+    return issue_tokens(user)
+
+@app.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_tokens(current_user: Dict[str, Any] = Depends(get_current_user), db=Depends(get_db)):
+    """Sign out everywhere: invalidate every refresh token issued to the current user"""
+    await crud.revoke_refresh_tokens(db, current_user["id"])
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 @app.post("/auth/google", response_model=schemas.TokenData)
 async def login_with_google(id_token: str = Body(..., embed=True), db=Depends(get_db)):
     """Login with Google ID token"""
     try:
-        # Verify the ID token with Firebase
-        decoded_token = firebase_auth.verify_id_token(id_token)
+        # Verify the ID token, repeat sign-ins with the same token hit the cache
+        decoded_token = await google_tokens.verify_id_token(id_token)
         uid = decoded_token['uid']
         email = decoded_token.get('email', '')
         name = decoded_token.get('name', '')
         
-        print(f"Google login - UID: {uid}, Email: {email}")
+        logger.debug("Google login", extra={"firebase_uid": uid})
         
         # Check if user exists in Firestore
         user = await crud.get_user_by_firebase_uid(db, uid)
         
         if not user:
             # Create a new user if they don't exist
-            print(f"Creating new user for Google login: {email}")
-            user_data = {
-                "email": email,
-                "name": name,
-                "firebase_uid": uid,
-                "created_at": datetime.now()
-            }
-            
-            # Add user to Firestore
-            user_ref = db.collection('users').document()
-            user_ref.set(user_data)
-            
-            # Set the ID
-            user_id = user_ref.id
-        else:
-            user_id = user["id"]
-        
-        # Create access token
-        access_token = create_access_token(data={"sub": user_id})
+            logger.info("Creating new user for Google login", extra={"firebase_uid": uid})
+            user = await crud.create_google_user(db, uid, email, name)
         
-        # Calculate expiration time
-        expires_at = int(time.time()) + ACCESS_TOKEN_EXPIRE_MINUTES * 60
-        
-        return {
-            "access_token": access_token,
-            "token_type": "bearer",
-            "user_id": user_id,
-            "expires_at": expires_at
-        }
+        # Create access and refresh tokens
+        return issue_tokens(user)
     except Exception as e:
-        print(f"Google login error: {e}")
-        print(traceback.format_exc())
+        logger.warning("Google login error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Invalid ID token: {str(e)}"
         )
 
 @app.get("/users/me", response_model=schemas.User)
-async def read_users_me(current_user: Dict[str, Any] = Depends(get_current_user)):
+async def read_users_me(current_user: Dict[str, Any] = Depends(get_current_user), db=Depends(get_db)):
     """Get the current authenticated user"""
-    return current_user
+    # The only endpoint that needs the full user document
+    user = await crud.get_user_by_id(db, current_user["id"])
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+@app.put("/users/me/timezone", response_model=schemas.User)
+async def update_users_me_timezone(
+    timezone: str = Body(..., embed=True),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db=Depends(get_db)
+):
+    """Set the IANA time zone used for the current user's statistics"""
+    try:
+        timezones.get_zone(timezone)
+        user = await crud.update_user_timezone(db, current_user["id"], timezone)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Access tokens pick up the new preference on their next refresh
+    return user
+
+def resolve_stats_timezone(tz: Optional[str], current_user: Dict[str, Any]) -> Optional[str]:
+    """Pick the stats time zone: ?tz=, then the user's preference, then UTC"""
+    tz = tz or current_user.get("timezone")
+    try:
+        timezones.get_zone(tz)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return tz
 
 @app.post("/time-entries/", response_model=schemas.TimeEntry)
 async def create_time_entry(
     time_entry: schemas.TimeEntryCreate, 
+    on_conflict: str = "allow",
     current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
     db=Depends(get_db)
 ):
     try:
-        print(f"Received time entry request: {time_entry.dict()}")
-        
         # Add user_id if authenticated
         if current_user:
             time_entry.user_id = current_user["id"]
@@ -218,8 +448,7 @@ async def create_time_entry(
             )
         
         # Validate task exists
-        task_check = await crud.get_task(db, id=time_entry.task_id)
-        print(f"Task check result: {task_check}")
+        task_check = await crud.get_task(db, id=time_entry.task_id, user_id=time_entry.user_id)
         if not task_check:
             raise HTTPException(
                 status_code=404, 
@@ -227,39 +456,65 @@ async def create_time_entry(
             )
         
         # Create time entry
-        result = await crud.create_time_entry(db=db, time_entry=time_entry)
+        # on_conflict=stop or reject decides what happens to a timer that is still running
+        result = await crud.create_time_entry(db=db, time_entry=time_entry, on_conflict=on_conflict)
         return result
     except ValueError as e:
-        print(f"ValueError in time entry creation: {e}")
+        logger.info("Rejected time entry: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
+    except crud.ActiveTimerConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "active_timer": jsonable_encoder(e.active_timer)})
     except Exception as e:
-        error_msg = f"Error in time entry creation endpoint: {e}"
-        error_trace = traceback.format_exc()
-        print(error_msg)
-        print(error_trace)
-        # Return more details about the error
-        detail = f"Failed to create time entry: {str(e)}\n{error_trace}"
+        logger.exception("Error in time entry creation endpoint")
+        # The traceback is in the log under this request's ID
+        detail = f"Failed to create time entry: {str(e)} (request {request_id_var.get()})"
         raise HTTPException(status_code=500, detail=detail)
 
+def negotiated(request: Request, content: Any, model=None):
+    """MessagePack for clients that ask for it, otherwise content for FastAPI's JSON handling"""
+    if not serialization.wants_msgpack(request.headers.get("accept")):
+        return content
+    if model is not None:
+        content = serialization.dump(model, content)
+    return serialization.MsgPackResponse(content)
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Parse a comma-separated sparse fieldset for the time entry list"""
+    if fields is None:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in crud.TIME_ENTRY_LIST_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(crud.TIME_ENTRY_LIST_FIELDS)}"
+        )
+    return requested
+
 @app.get("/time-entries/", response_model=List[schemas.TimeEntry])
 async def read_time_entries(
+    request: Request,
     skip: int = 0, 
     limit: int = 100, 
+    fields: Optional[str] = None,
     current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
     db=Depends(get_db)
 ):
+    field_list = parse_fields(fields)
     try:
-        print("Fetching time entries...")
         # Get user-specific entries if authenticated
         user_id = current_user["id"] if current_user else None
-        time_entries = await crud.get_time_entries(db, skip=skip, limit=limit, user_id=user_id)
-        print(f"Retrieved {len(time_entries)} time entries")
-        return time_entries
+        time_entries = await crud.get_time_entries(db, skip=skip, limit=limit, user_id=user_id, fields=field_list)
+        logger.debug("Retrieved time entries", extra={"count": len(time_entries), "sample_rate": 0.01})
+        if field_list is not None:
+            # Sparse entries would not validate against the full response model
+            if serialization.wants_msgpack(request.headers.get("accept")):
+                return serialization.MsgPackResponse(time_entries)
+            return JSONResponse(content=jsonable_encoder(time_entries))
+        return negotiated(request, time_entries, List[schemas.TimeEntry])
     except Exception as e:
-        error_trace = traceback.format_exc()
-        print(f"Error fetching time entries: {e}")
-        print(error_trace)
-        detail = f"Failed to fetch time entries: {str(e)}\n{error_trace}"
+        logger.exception("Error fetching time entries")
+        detail = f"Failed to fetch time entries: {str(e)} (request {request_id_var.get()})"
         raise HTTPException(status_code=500, detail=detail)
 
 @app.get("/time-entries/{id}", response_model=schemas.TimeEntry)
@@ -268,7 +523,7 @@ async def read_time_entry(
     current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
     db=Depends(get_db)
 ):
-    db_time_entry = await crud.get_time_entry(db, id=id)
+    db_time_entry = await crud.get_time_entry(db, id=id, user_id=current_user["id"] if current_user else None)
     if db_time_entry is None:
         raise HTTPException(status_code=404, detail="Time entry not found")
     
@@ -289,7 +544,7 @@ async def update_time_entry(
         # Get user_id if authenticated
         user_id = current_user["id"] if current_user else None
         
-        db_time_entry = await crud.get_time_entry(db, id=id)
+        db_time_entry = await crud.get_time_entry(db, id=id, user_id=user_id)
         if db_time_entry is None:
             raise HTTPException(status_code=404, detail="Time entry not found")
         
@@ -298,12 +553,14 @@ async def update_time_entry(
             raise HTTPException(status_code=403, detail="Not authorized to update this time entry")
         
         result = await crud.update_time_entry(db=db, id=id, time_entry=time_entry, user_id=user_id)
+        if result.get("end_time") is not None:
+            # Stopped, the next heartbeat checks the entry again
+            heartbeats.entry_owners.pop(id)
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"Error updating time entry: {e}")
-        print(traceback.format_exc())
+        logger.exception("Error updating time entry")
         raise HTTPException(status_code=500, detail=f"Failed to update time entry: {str(e)}")
 
 @app.delete("/time-entries/{id}")
@@ -315,7 +572,7 @@ async def delete_time_entry(
     # Get user_id if authenticated
     user_id = current_user["id"] if current_user else None
     
-    db_time_entry = await crud.get_time_entry(db, id=id)
+    db_time_entry = await crud.get_time_entry(db, id=id, user_id=user_id)
     if db_time_entry is None:
         raise HTTPException(status_code=404, detail="Time entry not found")
     
@@ -324,16 +581,54 @@ async def delete_time_entry(
         raise HTTPException(status_code=403, detail="Not authorized to delete this time entry")
     
     await crud.delete_time_entry(db=db, id=id, user_id=user_id)
+    heartbeats.entry_owners.pop(id)
     return {"message": "Time entry deleted successfully"}
 
+@app.get("/timer/current", response_model=Optional[schemas.ActiveTimer])
+async def read_current_timer(
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db=Depends(get_db)
+):
+    """The user's running entry, null when no timer runs"""
+    return await crud.get_active_timer(db, current_user["id"])
+
+@app.post("/timer/heartbeat")
+async def timer_heartbeat(
+    entry_id: str = Body(..., embed=True),
+    current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
+    db=Depends(get_db)
+):
+    """Mark a running entry as alive; written to last_seen at most once per flush interval"""
+    # Get user_id if authenticated
+    user_id = current_user["id"] if current_user else None
+    
+    owner = heartbeats.entry_owners.get(entry_id)
+    if owner is None:
+        # First heartbeat for this entry on this instance
+        db_time_entry = await crud.get_time_entry(db, id=entry_id, user_id=user_id)
+        if db_time_entry is None:
+            raise HTTPException(status_code=404, detail="Time entry not found")
+        if db_time_entry.get("end_time") is not None:
+            raise HTTPException(status_code=409, detail="Time entry is not running")
+        owner = db_time_entry.get("user_id") or ""
+        heartbeats.entry_owners.set(entry_id, owner)
+    
+    # Check if user has access to this entry
+    if user_id and owner and owner != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to update this time entry")
+    
+    last_seen = heartbeats.record(entry_id, owner or None)
+    return {"entry_id": entry_id, "last_seen": last_seen}
+
 @app.get("/tasks/", response_model=List[schemas.Task])
 async def read_tasks(
+    request: Request,
     current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
     db=Depends(get_db)
 ):
     # Get user-specific tasks if authenticated
     user_id = current_user["id"] if current_user else None
-    return await crud.get_tasks(db, user_id=user_id)
+    return negotiated(request, await crud.get_tasks(db, user_id=user_id), List[schemas.Task])
 
 @app.post("/tasks/", response_model=schemas.Task)
 async def create_task(
@@ -358,7 +653,7 @@ async def read_task(
     current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
     db=Depends(get_db)
 ):
-    db_task = await crud.get_task(db, id=id)
+    db_task = await crud.get_task(db, id=id, user_id=current_user["id"] if current_user else None)
     if db_task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
@@ -383,12 +678,12 @@ async def delete_task(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"Error deleting task: {e}")
-        print(traceback.format_exc())
+        logger.exception("Error deleting task")
         raise HTTPException(status_code=500, detail=f"Failed to delete task: {str(e)}")
 
 @app.get("/stats/daily")
 async def get_daily_stats(
+    tz: Optional[str] = None,
     current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
     db=Depends(get_db)
 ):
@@ -400,10 +695,11 @@ async def get_daily_stats(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Authentication required to access statistics"
         )
-    return await crud.get_daily_stats(db, user_id=user_id)
+    return await crud.get_daily_stats(db, user_id=user_id, tz=resolve_stats_timezone(tz, current_user))
 
 @app.get("/stats/weekly")
 async def get_weekly_stats(
+    tz: Optional[str] = None,
     current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
     db=Depends(get_db)
 ):
@@ -415,7 +711,113 @@ async def get_weekly_stats(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Authentication required to access statistics"
         )
-    return await crud.get_weekly_stats(db, user_id=user_id)
+    return await crud.get_weekly_stats(db, user_id=user_id, tz=resolve_stats_timezone(tz, current_user))
+
+# Longest range the heatmap endpoint accepts
+HEATMAP_MAX_DAYS = 366
+
+@app.get("/stats/heatmap")
+async def get_heatmap(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    tz: Optional[str] = None,
+    current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
+    db=Depends(get_db)
+):
+    """Tracked seconds per weekday and hour of day, defaulting to the last 4 weeks"""
+    user_id = current_user["id"] if current_user else None
+    if not user_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required to access statistics"
+        )
+    
+    tz = resolve_stats_timezone(tz, current_user)
+    end = end or timezones.local_today(tz)
+    start = start or end - timedelta(days=27)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days >= HEATMAP_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {HEATMAP_MAX_DAYS} days")
+    
+    return await crud.get_heatmap(db, user_id, start, end, tz)
+
+def resolve_distribution_range(start: Optional[date], end: Optional[date]):
+    """Validate an optional UTC day range, both bounds or neither"""
+    if start is None and end is None:
+        return None, None
+    if start is None or end is None:
+        raise HTTPException(status_code=400, detail="start and end must be given together")
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days >= crud.DISTRIBUTION_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {crud.DISTRIBUTION_MAX_DAYS} days")
+    return start, end
+
+@app.get("/stats/distribution")
+async def get_duration_distribution(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
+    db=Depends(get_db)
+):
+    """Session length percentiles across all tasks, all time or over UTC days start..end"""
+    user_id = current_user["id"] if current_user else None
+    if not user_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required to access statistics"
+        )
+    
+    start, end = resolve_distribution_range(start, end)
+    return await crud.get_user_distribution(db, user_id, start, end)
+
+@app.get("/stats/tasks/{id}/distribution")
+async def get_task_distribution(
+    id: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
+    db=Depends(get_db)
+):
+    """Session length percentiles for one task, all time or over UTC days start..end"""
+    user_id = current_user["id"] if current_user else None
+    if not user_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required to access statistics"
+        )
+    
+    start, end = resolve_distribution_range(start, end)
+    db_task = await crud.get_task(db, id=id, user_id=user_id)
+    if db_task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if db_task.get("user_id") and db_task["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this task")
+    
+    return await crud.get_task_distribution(db, db_task, user_id, start, end)
+
+@app.get("/sync")
+async def sync_changes(
+    request: Request,
+    since: Optional[str] = None,
+    limit: int = 500,
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db=Depends(get_db)
+):
+    """Tasks and time entries created, updated or deleted since a cursor, oldest first"""
+    if limit < 1 or limit > sync.MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {sync.MAX_LIMIT}")
+    try:
+        cursor = sync.decode_cursor(since) if since else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        return negotiated(request, sync.get_changes(db, current_user["id"], since=cursor, limit=limit))
+    except sync.CursorExpired as e:
+        # The client has to start over with a full sync
+        raise HTTPException(status_code=410, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,173 @@
+"""
+In-process metrics with a Prometheus text exposition for GET /metrics
+Tracks per-route request counts and latency, Firestore operations per route,
+event-loop lag and cache hit rates
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from cache import get_cache_stats
+
+# Default latency buckets in seconds, same as the Prometheus client libraries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+# How often the event-loop lag probe wakes up
+LOOP_LAG_INTERVAL = 0.5
+
+_lock = threading.Lock()
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, label_values: Tuple[str, ...], amount: float = 1):
+        with _lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value:g}")
+        return lines
+
+class Gauge:
+    """Single value that can go up and down"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.value:g}"]
+
+class Histogram:
+    """Cumulative histogram with labels"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...], buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [bucket counts..., sum, count]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, label_values: Tuple[str, ...], value: float):
+        with _lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, series):
+                bucket_labels = _format_labels(self.labels + ("le",), label_values + (f"{bound:g}",))
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            inf_labels = _format_labels(self.labels + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{inf_labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {series[-2]:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+# Metric definitions
+http_requests = Counter(
+    "chrona_http_requests_total", "HTTP requests by route, method and status",
+    ("route", "method", "status")
+)
+http_latency = Histogram(
+    "chrona_http_request_duration_seconds", "HTTP request latency by route, method and status",
+    ("route", "method", "status")
+)
+firestore_operations = Counter(
+    "chrona_firestore_operations_total", "Firestore reads, writes and queries by route",
+    ("route", "operation")
+)
+loop_lag = Gauge("chrona_event_loop_lag_seconds", "Most recent event-loop scheduling delay")
+loop_lag_histogram = Histogram("chrona_event_loop_lag_seconds_distribution", "Event-loop scheduling delay", ())
+
+# Firestore operation counts for the request being handled, set by the
+# request middleware and filled in by the instrumented database client
+_request_ops: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar("request_ops", default=None)
+
+# Route label for operations that happen outside any request
+BACKGROUND_ROUTE = "background"
+
+def start_request() -> Dict[str, int]:
+    """Begin collecting Firestore operations for the current request"""
+    ops: Dict[str, int] = {}
+    _request_ops.set(ops)
+    return ops
+
+def record_firestore_op(operation: str, count: int = 1):
+    """Count a Firestore read, write or query"""
+    ops = _request_ops.get()
+    if ops is None:
+        firestore_operations.inc((BACKGROUND_ROUTE, operation), count)
+    else:
+        ops[operation] = ops.get(operation, 0) + count
+
+def finish_request(route: str, method: str, status_code: int, elapsed: float, ops: Dict[str, int]):
+    """Record a completed request and the Firestore operations it made"""
+    labels = (route, method, str(status_code))
+    http_requests.inc(labels)
+    http_latency.observe(labels, elapsed)
+    for operation, count in ops.items():
+        firestore_operations.inc((route, operation), count)
+
+async def monitor_event_loop_lag():
+    """Measure how late the event loop wakes a sleeping task"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, time.perf_counter() - start - LOOP_LAG_INTERVAL)
+        loop_lag.set(lag)
+        loop_lag_histogram.observe((), lag)
+
+def render() -> str:
+    """Render all metrics in the Prometheus text format"""
+    lines = []
+    for metric in (http_requests, http_latency, firestore_operations, loop_lag, loop_lag_histogram):
+        lines.extend(metric.render())
+
+    cache_stats = get_cache_stats()
+    for name, help_text, key in (
+        ("chrona_cache_hits_total", "Cache hits by cache", "hits"),
+        ("chrona_cache_misses_total", "Cache misses by cache", "misses"),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for cache_name, stats in sorted(cache_stats.items()):
+            lines.append(f"{name}{_format_labels(('cache',), (cache_name,))} {stats[key]}")
+    lines.append("# HELP chrona_cache_hit_ratio Cache hit ratio by cache")
+    lines.append("# TYPE chrona_cache_hit_ratio gauge")
+    for cache_name, stats in sorted(cache_stats.items()):
+        lines.append(f"chrona_cache_hit_ratio{_format_labels(('cache',), (cache_name,))} {stats['hit_rate']:g}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,54 @@
+"""
+Script to create active_timers documents for entries that were already running
+Entries started before active timers existed are invisible to GET /timer/current
+and to the conflict check when starting a timer. For every user with open
+entries this points the active timer at the latest one. Users whose active timer
+already exists are skipped, so the script is safe to run while the API is live.
+"""
+
+from google.api_core.exceptions import AlreadyExists
+
+from database import get_db
+import crud
+import layout
+import traceback
+
+def migrate_active_timers():
+    """Point each user's active timer at their latest open entry"""
+    try:
+        print("Starting active timer backfill...")
+
+        # Get database instance
+        db = get_db()
+
+        latest = {}
+        for entry in layout.all_entries(db).where('end_time', '==', None).stream():
+            if not layout.in_layout(entry):
+                continue
+            data = entry.to_dict()
+            user_id = data.get("user_id")
+            if not user_id:
+                continue
+            if user_id not in latest or latest[user_id][1]["start_time"] < data["start_time"]:
+                latest[user_id] = (entry.id, data)
+
+        created_count = 0
+        for user_id, (entry_id, data) in latest.items():
+            try:
+                db.collection(crud.ACTIVE_TIMER_COLLECTION).document(user_id).create({
+                    "user_id": user_id,
+                    "entry_id": entry_id,
+                    "task_id": data.get("task_id"),
+                    "start_time": data["start_time"]
+                })
+                created_count += 1
+            except AlreadyExists:
+                pass
+
+        print(f"Active timer backfill completed: {created_count} of {len(latest)} users updated")
+    except Exception as e:
+        print(f"Active timer backfill failed: {e}")
+        print(traceback.format_exc())
+
+if __name__ == "__main__":
+    migrate_active_timers()
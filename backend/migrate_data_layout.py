@@ -0,0 +1,157 @@
+"""
+Script to move tasks and time entries into the per-user data layout
+Copies the top-level tasks and time_entries collections into
+users/{user_id}/tasks and users/{user_id}/time_entries, keeping document IDs,
+then checks every copy. Pages are copied in parallel write batches while the API
+keeps serving: a document is only written when it is missing from the
+destination or older there, so running it again after switching to
+CHRONA_DATA_LAYOUT=user picks up writes that reached the old collections in
+between without overwriting newer ones. Copies deleted through the API in the
+meantime left a /sync tombstone; they count as deleted and are never copied
+back.
+
+    python migrate_data_layout.py                  # copy, then verify
+    python migrate_data_layout.py --verify-only
+    python migrate_data_layout.py --delete-source  # once switched and verified
+
+Documents without a user_id stay in the top-level collections.
+"""
+
+import argparse
+import threading
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from database import get_db
+import layout
+import sync
+
+# Documents per page, one write batch each (Firestore allows 500 writes)
+PAGE_SIZE = 400
+
+COLLECTIONS = {
+    'tasks': layout.user_tasks,
+    'time_entries': layout.user_entries
+}
+
+# Tombstone type of each collection's documents
+TOMBSTONE_TYPES = {
+    'tasks': 'task',
+    'time_entries': 'time_entry'
+}
+
+# Values per 'in' filter, Firestore allows 30
+IN_LIMIT = 30
+
+def deleted_ids(db, name: str, ids) -> set:
+    """IDs among ids that have a tombstone, i.e. were deleted through the API"""
+    found = set()
+    for i in range(0, len(ids), IN_LIMIT):
+        query = db.collection(sync.TOMBSTONE_COLLECTION).where('type', '==', TOMBSTONE_TYPES[name])
+        for doc in query.where('id', 'in', ids[i:i + IN_LIMIT]).stream():
+            found.add(doc.to_dict()["id"])
+    return found
+
+def compare(source, destination, deleted: bool) -> str:
+    """Classify a destination copy: missing, deleted, stale, newer or equal"""
+    if not destination.exists:
+        return "deleted" if deleted else "missing"
+    if destination.to_dict() == source.to_dict():
+        return "equal"
+    if destination.update_time > source.update_time:
+        return "newer"
+    return "stale"
+
+def process_page(db, name: str, docs, mode: str, counts: Counter, lock: threading.Lock):
+    """Copy, verify or delete the sources of one page of documents"""
+    owned = [doc for doc in docs if doc.to_dict().get("user_id")]
+    destinations = [COLLECTIONS[name](db, doc.to_dict()["user_id"]).document(doc.id) for doc in owned]
+    snapshots = {snapshot.reference.path: snapshot for snapshot in db.get_all(destinations)} if destinations else {}
+    absent = [source.id for source, destination in zip(owned, destinations) if not snapshots[destination.path].exists]
+    deleted = deleted_ids(db, name, absent)
+
+    page_counts = Counter(unowned=len(docs) - len(owned))
+    batch = db.batch()
+    writes = 0
+    for source, destination in zip(owned, destinations):
+        state = compare(source, snapshots[destination.path], source.id in deleted)
+        page_counts[state] += 1
+        if mode == "copy" and state in ("missing", "stale"):
+            batch.set(destination, source.to_dict())
+            writes += 1
+        elif mode == "delete" and state in ("equal", "newer", "deleted"):
+            batch.delete(source.reference)
+            writes += 1
+        elif mode == "verify" and state in ("missing", "stale"):
+            print(f"{name}/{source.id}: {state} in {destination.path}")
+    if writes:
+        batch.commit()
+    page_counts["written"] = writes
+
+    with lock:
+        counts.update(page_counts)
+
+def process_collection(db, name: str, mode: str, workers: int) -> Counter:
+    """Page through a top-level collection, handing each page to a worker"""
+    counts = Counter()
+    lock = threading.Lock()
+    last_doc = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        while True:
+            query = db.collection(name).order_by(FieldPath.document_id()).limit(PAGE_SIZE)
+            if last_doc is not None:
+                query = query.start_after(last_doc)
+            docs = list(query.stream())
+            if not docs:
+                break
+            last_doc = docs[-1]
+            futures.append(executor.submit(process_page, db, name, docs, mode, counts, lock))
+            # Keep a bounded number of pages in memory
+            if len(futures) >= workers * 2:
+                futures.pop(0).result()
+        for future in futures:
+            future.result()
+
+    print(f"{name} ({mode}): {dict(counts)}")
+    return counts
+
+def migrate_data_layout(mode: str, workers: int):
+    """Run one migration pass over tasks and time entries"""
+    try:
+        print(f"Starting data layout migration ({mode})...")
+
+        # Get database instance
+        db = get_db()
+
+        passes = ["copy", "verify"] if mode == "copy" else [mode]
+        for current in passes:
+            problems = 0
+            for name in COLLECTIONS:
+                counts = process_collection(db, name, current, workers)
+                if current == "verify":
+                    problems += counts["missing"] + counts["stale"]
+            if current == "verify":
+                if problems:
+                    print(f"Verification failed: {problems} documents missing or stale, run the copy again")
+                    return
+                print("Verification passed")
+
+        print("Data layout migration completed")
+    except Exception as e:
+        print(f"Data layout migration failed: {e}")
+        print(traceback.format_exc())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move tasks and time entries under users/{user_id}")
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--verify-only", action="store_true", help="only compare source and destination")
+    action.add_argument("--delete-source", action="store_true", help="delete top-level documents that were copied")
+    parser.add_argument("--workers", type=int, default=8, help="pages processed in parallel")
+    args = parser.parse_args()
+
+    mode = "verify" if args.verify_only else "delete" if args.delete_source else "copy"
+    migrate_data_layout(mode, args.workers)
@@ -0,0 +1,61 @@
+"""
+Script to rebuild the daily rollups and duration sketches from raw time entries
+Run this once for entries written before the rollups existed, ideally while no
+trackers are writing entries. Archived entries are included and existing rollup
+documents are overwritten.
+"""
+
+from database import get_db
+import archives
+import layout
+import rollups
+import traceback
+
+# Firestore allows at most 500 writes per batch
+BATCH_SIZE = 400
+
+def migrate_duration_rollups():
+    """Recompute every rollup document from the finished live and archived entries"""
+    try:
+        print("Starting duration rollup rebuild...")
+
+        # Get database instance
+        db = get_db()
+
+        query = layout.all_entries(db).select(['task_id', 'user_id', 'start_time', 'duration'])
+        entry_count = 0
+        changes = []
+        for entry in query.stream():
+            if not layout.in_layout(entry):
+                continue
+            changes.append((entry.to_dict(), 1))
+            entry_count += 1
+        for archive in db.collection(archives.ARCHIVE_COLLECTION).stream():
+            for entry in archives.unpack(archive.to_dict()):
+                changes.append((entry, 1))
+                entry_count += 1
+        documents = rollups.entry_deltas(changes)
+        print(f"Read {entry_count} entries")
+
+        # Sketches are only written onto tasks that still exist
+        task_refs = [rollups.document_ref(db, doc_key) for doc_key in documents if doc_key[0] == rollups.TASK_COLLECTION]
+        existing_tasks = {doc.id for doc in db.get_all(task_refs) if doc.exists} if task_refs else set()
+        documents = {
+            doc_key: values for doc_key, values in documents.items()
+            if doc_key[0] != rollups.TASK_COLLECTION or doc_key[1] in existing_tasks
+        }
+
+        items = list(documents.items())
+        for i in range(0, len(items), BATCH_SIZE):
+            batch = db.batch()
+            rollups.write_snapshot(batch, db, dict(items[i:i + BATCH_SIZE]))
+            batch.commit()
+            print(f"Wrote {min(i + BATCH_SIZE, len(items))}/{len(items)} documents")
+
+        print(f"Duration rollup rebuild completed: {len(items)} documents written")
+    except Exception as e:
+        print(f"Duration rollup rebuild failed: {e}")
+        print(traceback.format_exc())
+
+if __name__ == "__main__":
+    migrate_duration_rollups()
@@ -0,0 +1,57 @@
+"""
+Script to backfill updated_at on tasks and time entries for GET /sync
+Documents written before delta sync existed have no updated_at and are missing
+from /sync results. This stamps them with the current server time, so clients
+pick them up on their next sync. Documents that already have updated_at are
+skipped, so the script is safe to run while the API is live.
+"""
+
+from firebase_admin import firestore
+
+from database import get_db
+import layout
+import traceback
+
+# Documents per write batch (Firestore allows 500 writes)
+BATCH_SIZE = 400
+
+def backfill(db, name: str, query) -> int:
+    """Stamp every document of a query that has no updated_at"""
+    updated_count = 0
+    batch = db.batch()
+    pending = 0
+    for doc in query.stream():
+        if not layout.in_layout(doc) or doc.to_dict().get("updated_at") is not None:
+            continue
+        batch.update(doc.reference, {"updated_at": firestore.SERVER_TIMESTAMP})
+        pending += 1
+        if pending == BATCH_SIZE:
+            batch.commit()
+            updated_count += pending
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+        updated_count += pending
+
+    print(f"{name}: {updated_count} documents stamped")
+    return updated_count
+
+def migrate_sync_timestamps():
+    """Backfill updated_at on every task and time entry"""
+    try:
+        print("Starting updated_at backfill...")
+
+        # Get database instance
+        db = get_db()
+
+        total = backfill(db, "tasks", layout.all_tasks(db))
+        total += backfill(db, "time_entries", layout.all_entries(db))
+
+        print(f"updated_at backfill completed: {total} documents updated")
+    except Exception as e:
+        print(f"updated_at backfill failed: {e}")
+        print(traceback.format_exc())
+
+if __name__ == "__main__":
+    migrate_sync_timestamps()
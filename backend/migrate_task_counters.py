@@ -0,0 +1,48 @@
+"""
+Script to backfill the entry_count and total_duration counters on tasks
+Run this once for tasks created before the counters existed, ideally while no
+trackers are writing entries. Tasks that are already tracked are skipped.
+"""
+
+from database import get_db
+import layout
+import traceback
+
+def migrate_task_counters():
+    """Count the time entries of every untracked task"""
+    try:
+        print("Starting task counter backfill...")
+
+        # Get database instance
+        db = get_db()
+
+        migrated_count = 0
+        # Every user's tasks, wherever CHRONA_DATA_LAYOUT keeps them
+        for task in layout.all_tasks(db).stream():
+            task_data = task.to_dict()
+            if task_data.get("usage_tracked") or not layout.in_layout(task):
+                continue
+            user_id = task_data.get("user_id")
+
+            entry_count = 0
+            total_duration = 0
+            query = layout.entries_collection(db, user_id).where('task_id', '==', task.id).select(['duration'])
+            for entry in query.stream():
+                entry_count += 1
+                total_duration += entry.to_dict().get("duration") or 0
+
+            layout.tasks_collection(db, user_id).document(task.id).update({
+                "entry_count": entry_count,
+                "total_duration": total_duration,
+                "usage_tracked": True
+            })
+            migrated_count += 1
+            print(f"Task {task.id}: {entry_count} entries, {total_duration:.0f} minutes tracked")
+
+        print(f"Task counter backfill completed: {migrated_count} tasks updated")
+    except Exception as e:
+        print(f"Task counter backfill failed: {e}")
+        print(traceback.format_exc())
+
+if __name__ == "__main__":
+    migrate_task_counters()
@@ -0,0 +1,63 @@
+"""
+Script to backfill the users_by_email and users_by_uid pointer documents
+Run this once for databases created before the user index existed
+"""
+
+from database import get_db
+import models
+import crud
+import traceback
+
+# Firestore allows at most 500 writes per batch, each user needs two
+BATCH_SIZE = 250
+
+def migrate_user_index():
+    """Write pointer documents for every existing user"""
+    try:
+        print("Starting user index backfill...")
+
+        # Get database instance
+        db = get_db()
+
+        batch = db.batch()
+        pending = 0
+        migrated_count = 0
+        skipped_count = 0
+
+        for doc in db.collection('users').stream():
+            user = doc.to_dict()
+
+            if not user.get("email") and not user.get("firebase_uid"):
+                print(f"Skipping user {doc.id}: no email or firebase_uid")
+                skipped_count += 1
+                continue
+
+            pointer = models.UserIndex.to_dict(user, doc.id)
+
+            if user.get("email"):
+                email_ref = db.collection('users_by_email').document(crud.email_index_key(user["email"]))
+                batch.set(email_ref, pointer)
+
+            if user.get("firebase_uid"):
+                uid_ref = db.collection('users_by_uid').document(user["firebase_uid"])
+                batch.set(uid_ref, pointer)
+
+            pending += 1
+            migrated_count += 1
+
+            if pending >= BATCH_SIZE:
+                batch.commit()
+                print(f"Indexed {migrated_count} users...")
+                batch = db.batch()
+                pending = 0
+
+        if pending:
+            batch.commit()
+
+        print(f"User index backfill completed: {migrated_count} indexed, {skipped_count} skipped")
+    except Exception as e:
+        print(f"User index backfill failed: {e}")
+        print(traceback.format_exc())
+
+if __name__ == "__main__":
+    migrate_user_index()
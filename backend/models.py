@@ -15,7 +15,9 @@ class User:
             "email": data.get("email"),
             "name": data.get("name"),
             "firebase_uid": data.get("firebase_uid"),
-            "created_at": data.get("created_at")
+            "timezone": data.get("timezone"),
+            "created_at": data.get("created_at"),
+            "tokens_revoked_at": data.get("tokens_revoked_at")
         }
     
     @staticmethod
@@ -25,9 +27,31 @@ class User:
             "email": user.get("email"),
             "name": user.get("name", ""),
             "firebase_uid": user.get("firebase_uid", ""),
+            "timezone": user.get("timezone"),
             "created_at": user.get("created_at", datetime.now())
         }
 
+class UserIndex:
+    """Unique-key pointer document for users_by_email and users_by_uid"""
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert pointer document to User model"""
+        return User.from_dict(data, data.get("user_id"))
+
+    @staticmethod
+    def to_dict(user: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+        """Build pointer document for a user
+
+        The pointer carries a copy of the user fields so a lookup by email
+        or firebase_uid is answered by a single document get.
+        """
+        pointer = User.to_dict(user)
+        pointer["user_id"] = user_id
+        if user.get("password_hash"):
+            pointer["password_hash"] = user["password_hash"]
+        return pointer
+
 class Task:
     """Task model for Firestore"""
     
@@ -39,7 +63,10 @@ class Task:
             "name": data.get("name"),
             "description": data.get("description"),
             "user_id": data.get("user_id"),
-            "created_at": data.get("created_at")
+            "created_at": data.get("created_at"),
+            "entry_count": data.get("entry_count", 0),
+            "total_duration": data.get("total_duration", 0),
+            "duration_sketch": data.get("duration_sketch", {})
         }
     
     @staticmethod
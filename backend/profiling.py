@@ -0,0 +1,159 @@
+"""
+Opt-in sampling profiler for individual API requests
+A background thread samples the stack of the event-loop thread, and of the worker
+threads running asyncio.to_thread and sync endpoint work, while a profiled
+request is in flight. Profiles are kept by request ID in collapsed-stack form
+and can be exported for speedscope. Requests that are not profiled pay only
+for a header lookup.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from cache import TTLCache
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = float(os.environ.get("CHRONA_PROFILE_INTERVAL", "0.002"))
+
+# Frames from these files are sampler/middleware plumbing, not request work
+_SKIP_FILES = (os.path.abspath(__file__),)
+
+# Worker threads sampled besides the event loop: the loop's default executor
+# (asyncio.to_thread) and the threads FastAPI runs sync endpoints in
+WORKER_THREAD_PREFIXES = ("asyncio_", "AnyIO worker thread")
+
+# Where an idle executor thread waits for work
+_IDLE_WORKER_FILE = os.path.join("concurrent", "futures", "thread.py")
+
+# Finished profiles, by request ID
+profiles = TTLCache("profiles", maxsize=int(os.environ.get("CHRONA_PROFILE_KEEP", "50")), ttl=3600)
+
+# Number of upcoming requests to profile, set by the admin endpoint
+_pending_requests = 0
+_pending_lock = threading.Lock()
+
+def profile_next(count: int):
+    """Profile the next count requests regardless of headers"""
+    global _pending_requests
+    with _pending_lock:
+        _pending_requests = max(0, count)
+
+def claim_pending() -> bool:
+    """Take one slot from the admin profile-next counter"""
+    global _pending_requests
+    if not _pending_requests:
+        return False
+    with _pending_lock:
+        if _pending_requests <= 0:
+            return False
+        _pending_requests -= 1
+        return True
+
+class SamplingProfiler:
+    """Sample the stack of one thread and the busy worker threads at a fixed interval"""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.started_at = 0.0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="chrona-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            frame = frames.get(self.thread_id)
+            if frame is not None:
+                self.stacks[self._collapse(frame)] += 1
+            for thread in threading.enumerate():
+                if not thread.name.startswith(WORKER_THREAD_PREFIXES):
+                    continue
+                frame = frames.get(thread.ident)
+                if frame is not None and not self._idle(frame):
+                    # Worker stacks are rooted at the thread so they stay apart
+                    self.stacks[f"{thread.name};{self._collapse(frame)}"] += 1
+
+    @staticmethod
+    def _idle(frame) -> bool:
+        """Whether a worker thread is waiting for work rather than running it"""
+        code = frame.f_code
+        if code.co_filename.endswith(_IDLE_WORKER_FILE):
+            return code.co_name == "_worker"
+        # anyio workers block on their queue, in queue.py or threading.py
+        return os.path.basename(code.co_filename) in ("queue.py", "threading.py")
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename not in _SKIP_FILES:
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        names.reverse()
+        return ";".join(names)
+
+    def result(self, request_id: str, method: str, path: str) -> Dict[str, Any]:
+        return {
+            "request_id": request_id,
+            "method": method,
+            "path": path,
+            "elapsed": self.elapsed,
+            "interval": self.interval,
+            "samples": sum(self.stacks.values()),
+            "stacks": dict(self.stacks)
+        }
+
+def to_collapsed(profile: Dict[str, Any]) -> str:
+    """Render a profile in the collapsed-stack format used by flamegraph.pl"""
+    return "\n".join(f"{stack} {count}" for stack, count in sorted(profile["stacks"].items())) + "\n"
+
+def to_speedscope(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Render a profile as a speedscope sampled profile"""
+    frames = []
+    frame_index = {}
+    samples = []
+    weights = []
+
+    for stack, count in profile["stacks"].items():
+        indexes = []
+        for name in stack.split(";") if stack else []:
+            if name not in frame_index:
+                frame_index[name] = len(frames)
+                frames.append({"name": name})
+            indexes.append(frame_index[name])
+        samples.append(indexes)
+        weights.append(count * profile["interval"])
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": f"{profile['method']} {profile['path']} ({profile['request_id']})",
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights
+        }],
+        "name": profile["request_id"],
+        "exporter": "chrona"
+    }
@@ -1,67 +1,244 @@
 """
-Script to reset the Firestore database
-This will delete all documents in the tasks, time_entries, and users collections
+Script to purge and reseed the Firestore database
+Purging pages through every collection (and any subcollections) and deletes
+with a Firestore BulkWriter; seeding writes synthetic users, tasks and entries
+for load tests, together with their index, counter and rollup documents:
+
+    python reset_database.py purge
+    python reset_database.py purge --collections tasks time_entries --keep-auth
+    python reset_database.py seed --users 100 --tasks 5 --entries 200
+
+Seeded users log in locally with --password (default "loadtest") and have no
+Firebase Auth account.
 """
 
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
-from database import get_db
+import argparse
+import random
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import bcrypt
+from firebase_admin import auth
+from google.cloud.firestore_v1.bulk_writer import BulkWriterMode, BulkWriterOptions
+
+from database import get_db
+import crud
+import layout
+import models
+import rollups
+
+# Every collection the API writes to
+COLLECTIONS = [
+    'tasks', 'time_entries', 'users', 'users_by_email', 'users_by_uid',
+    'daily_rollups', 'user_stats', 'entry_archives', 'scheduler_leases',
+    'active_timers', 'idempotency_keys', 'tombstones'
+]
+
+# Give up on a document after this many failed write attempts
+MAX_ATTEMPTS = 5
+
+class Progress:
+    """Count BulkWriter results and print a line every `every` documents"""
+
+    def __init__(self, label: str, every: int = 1000):
+        self.label = label
+        self.every = every
+        self.written = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
 
-def reset_database():
-    """Reset all data in the database"""
+    def on_write(self, reference, result, bulk_writer):
+        with self._lock:
+            self.written += 1
+            if self.written % self.every == 0:
+                print(f"{self.label}: {self.written} documents ({self.rate():.0f}/s)")
+
+    def on_error(self, error, bulk_writer) -> bool:
+        """Retry transient failures, report the rest"""
+        if error.attempts < MAX_ATTEMPTS:
+            return True
+        with self._lock:
+            self.failed += 1
+        print(f"{self.label}: giving up on {error.operation} after {error.attempts} attempts: {error.message}")
+        return False
+
+    def rate(self) -> float:
+        return self.written / max(time.perf_counter() - self.started, 1e-9)
+
+    def done(self):
+        print(f"{self.label}: {self.written} documents in {time.perf_counter() - self.started:.1f}s "
+              f"({self.rate():.0f}/s), {self.failed} failed")
+
+def bulk_writer(db, progress: Progress, ops_per_second: int):
+    """BulkWriter with parallel writes ramping up to ops_per_second"""
+    options = BulkWriterOptions(
+        initial_ops_per_second=min(500, ops_per_second),
+        max_ops_per_second=ops_per_second,
+        mode=BulkWriterMode.parallel
+    )
+    writer = db.bulk_writer(options=options)
+    writer.on_write_result(progress.on_write)
+    writer.on_write_error(progress.on_error)
+    return writer
+
+def purge_collection(db, name: str, ops_per_second: int) -> int:
+    """Delete every document in a collection, including subcollections"""
+    progress = Progress(f"Deleting {name}")
+    # recursive_delete pages through the collection and closes the writer
+    deleted = db.recursive_delete(db.collection(name), bulk_writer=bulk_writer(db, progress, ops_per_second))
+    progress.done()
+    return deleted
+
+def purge_auth_users() -> int:
+    """Delete all Firebase Auth users, 1000 per request"""
+    deleted = 0
+    uids = []
+    for user in auth.list_users().iterate_all():
+        uids.append(user.uid)
+        if len(uids) == 1000:
+            auth.delete_users(uids)
+            deleted += len(uids)
+            uids = []
+    if uids:
+        auth.delete_users(uids)
+        deleted += len(uids)
+    return deleted
+
+def purge(collections, ops_per_second: int, parallel: int, keep_auth: bool):
+    """Delete all data in the database"""
     try:
-        print("Starting database reset...")
-        
+        print("Starting database purge...")
+
         # Get database instance
         db = get_db()
-        
-        # Collections to reset
-        collections = ['tasks', 'time_entries', 'users']
-        
-        for collection_name in collections:
-            # Delete all documents in collection
-            print(f"Deleting all documents in {collection_name} collection...")
-            
-            # Get all documents
-            docs = db.collection(collection_name).limit(500).stream()
-            
-            # Delete each document
-            deleted_count = 0
-            for doc in docs:
-                doc.reference.delete()
-                deleted_count += 1
-            
-            print(f"Deleted {deleted_count} documents from {collection_name}")
-        
-        # Delete all Firebase Auth users
-        try:
-            print("Deleting all Firebase Auth users...")
-            
-            # Get all users
-            page = auth.list_users()
-            users_to_delete = []
-            
-            # Collect user UIDs
-            for user in page.iterate_all():
-                users_to_delete.append(user.uid)
-            
-            if users_to_delete:
-                # Delete users in batches (max 1000 at a time)
-                for i in range(0, len(users_to_delete), 1000):
-                    batch = users_to_delete[i:i+1000]
-                    auth.delete_users(batch)
-                print(f"Deleted {len(users_to_delete)} Firebase Auth users")
-            else:
-                print("No Firebase Auth users to delete")
-        except Exception as e:
-            print(f"Error deleting Firebase Auth users: {e}")
-            print(traceback.format_exc())
-        
-        print("Database reset completed successfully")
+
+        # Each collection gets its own BulkWriter, `parallel` of them at a time
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            deleted = sum(executor.map(lambda name: purge_collection(db, name, ops_per_second), collections))
+        print(f"Deleted {deleted} documents from {len(collections)} collections")
+
+        if not keep_auth:
+            try:
+                print("Deleting all Firebase Auth users...")
+                print(f"Deleted {purge_auth_users()} Firebase Auth users")
+            except Exception as e:
+                print(f"Error deleting Firebase Auth users: {e}")
+                print(traceback.format_exc())
+
+        print("Database purge completed successfully")
+    except Exception as e:
+        print(f"Database purge failed: {e}")
+        print(traceback.format_exc())
+
+def synthetic_entries(rng: random.Random, task_id: str, user_id: str, count: int, days: int, now: datetime):
+    """Finished sessions spread over the last `days` days, log-normal lengths in minutes up to 8 hours"""
+    entries = []
+    for _ in range(count):
+        start = now - timedelta(seconds=rng.uniform(0, days * 86400))
+        duration = round(min(rng.lognormvariate(3.4, 1.0), 8 * 60), 3)
+        entries.append({
+            "task_id": task_id,
+            "user_id": user_id,
+            "start_time": start,
+            "end_time": start + timedelta(minutes=duration),
+            "duration": duration,
+            "notes": "",
+            "created_at": start,
+            "updated_at": start
+        })
+    return entries
+
+def seed(users: int, tasks: int, entries: int, days: int, prefix: str, password: str,
+         ops_per_second: int, random_seed: int):
+    """Write synthetic users with tasks and time entries"""
+    try:
+        print(f"Seeding {users} users x {tasks} tasks x {entries} entries...")
+
+        # Get database instance
+        db = get_db()
+        rng = random.Random(random_seed)
+        now = datetime.now(timezone.utc)
+
+        # One hash shared by every seeded user, bcrypt is deliberately slow
+        password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+
+        progress = Progress("Seeding")
+        writer = bulk_writer(db, progress, ops_per_second)
+        for i in range(users):
+            user_ref = db.collection('users').document()
+            user_data = {
+                "email": f"{prefix}{i}@example.com",
+                "name": f"Load Test {i}",
+                "firebase_uid": f"{prefix}-{i}",
+                "timezone": "UTC",
+                "created_at": now,
+                "password_hash": password_hash
+            }
+            pointer = models.UserIndex.to_dict(user_data, user_ref.id)
+            writer.set(user_ref, user_data)
+            writer.set(db.collection('users_by_email').document(crud.email_index_key(user_data["email"])), pointer)
+            writer.set(db.collection('users_by_uid').document(user_data["firebase_uid"]), pointer)
+
+            user_entries = []
+            user_tasks = []
+            for t in range(tasks):
+                task_ref = layout.tasks_collection(db, user_ref.id).document()
+                task_entries = synthetic_entries(rng, task_ref.id, user_ref.id, entries, days, now)
+                for entry in task_entries:
+                    writer.set(layout.entries_collection(db, user_ref.id).document(), entry)
+                user_entries.extend(task_entries)
+                user_tasks.append((task_ref, {
+                    "name": f"Task {t}",
+                    "description": "",
+                    "user_id": user_ref.id,
+                    "created_at": now,
+                    "updated_at": now,
+                    "entry_count": len(task_entries),
+                    "total_duration": sum(entry["duration"] for entry in task_entries),
+                    "usage_tracked": True
+                }))
+
+            # Tasks carry their duration sketch, the rest goes to the daily rollups and user_stats
+            documents = rollups.entry_deltas((entry, 1) for entry in user_entries)
+            for task_ref, task_data in user_tasks:
+                task_rollup = documents.pop(rollups.task_key(task_ref.id, user_ref.id), {})
+                task_data["duration_sketch"] = task_rollup.get('duration_sketch', {})
+                writer.set(task_ref, task_data)
+            rollups.write_snapshot(writer, db, documents)
+
+        writer.close()
+        progress.done()
+        print("Database seed completed successfully")
     except Exception as e:
-        print(f"Database reset failed: {e}")
+        print(f"Database seed failed: {e}")
         print(traceback.format_exc())
 
 if __name__ == "__main__":
-    reset_database() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Purge or reseed the Firestore database")
+    parser.add_argument("--ops-per-second", type=int, default=2000, help="BulkWriter rate limit per writer")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    purge_parser = commands.add_parser("purge", help="delete all documents and Firebase Auth users")
+    purge_parser.add_argument("--collections", nargs="+", default=COLLECTIONS)
+    purge_parser.add_argument("--parallel", type=int, default=4, help="collections purged at once")
+    purge_parser.add_argument("--keep-auth", action="store_true", help="keep Firebase Auth users")
+
+    seed_parser = commands.add_parser("seed", help="write synthetic users, tasks and entries")
+    seed_parser.add_argument("--users", type=int, default=10)
+    seed_parser.add_argument("--tasks", type=int, default=5, help="tasks per user")
+    seed_parser.add_argument("--entries", type=int, default=100, help="entries per task")
+    seed_parser.add_argument("--days", type=int, default=90, help="spread entries over this many days")
+    seed_parser.add_argument("--prefix", default="loadtest", help="email and UID prefix")
+    seed_parser.add_argument("--password", default="loadtest")
+    seed_parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    if args.command == "purge":
+        purge(args.collections, args.ops_per_second, args.parallel, args.keep_auth)
+    else:
+        seed(args.users, args.tasks, args.entries, args.days, args.prefix, args.password,
+             args.ops_per_second, args.seed)
@@ -0,0 +1,158 @@
+"""
+Daily rollups of finished time entries
+Every entry with a duration is counted in:
+  - daily_rollups/{user_id}_{YYYY-MM-DD}: per-user totals and duration sketch for
+    the UTC day the entry starts in, with the same per task under "tasks"
+  - user_stats/{user_id}: all-time per-user totals and duration sketch
+  - duration_sketch on the task document: all-time duration sketch of the task
+Writes are staged as Increment transforms next to the entry write, so keeping
+the rollups current never needs an extra read.
+"""
+
+from datetime import date, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+import layout
+import sketches
+
+ROLLUP_COLLECTION = 'daily_rollups'
+USER_STATS_COLLECTION = 'user_stats'
+TASK_COLLECTION = 'tasks'
+
+# (collection, document ID) -> nested dict of numeric deltas. Task keys also
+# carry the owner, (TASK_COLLECTION, task ID, user ID), to find the document
+Deltas = Dict[Tuple[str, ...], Dict[str, Any]]
+
+def rollup_id(user_id: str, day: date) -> str:
+    return f"{user_id}_{day.isoformat()}"
+
+def task_key(task_id: str, user_id: Optional[str]) -> Tuple[str, ...]:
+    return (TASK_COLLECTION, task_id, user_id)
+
+def document_ref(db, doc_key: Tuple[str, ...]):
+    """Document a rollup key refers to"""
+    if doc_key[0] == TASK_COLLECTION:
+        return layout.tasks_collection(db, doc_key[2]).document(doc_key[1])
+    return db.collection(doc_key[0]).document(doc_key[1])
+
+def entry_day(entry: Dict[str, Any]) -> date:
+    """UTC day an entry starts in"""
+    start = entry['start_time']
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    return start.astimezone(timezone.utc).date()
+
+def _add(target: Dict[str, Any], path: Tuple[str, ...], amount: float):
+    for key in path[:-1]:
+        target = target.setdefault(key, {})
+    target[path[-1]] = target.get(path[-1], 0) + amount
+
+def add_fields(deltas: Deltas, doc_key: Tuple[str, ...], fields: Dict[str, float]):
+    """Add plain field deltas, e.g. task usage counters, to a document"""
+    doc = deltas.setdefault(doc_key, {})
+    for name, amount in fields.items():
+        _add(doc, (name,), amount)
+
+def merge(deltas: Deltas, other: Deltas):
+    """Add the deltas in other to deltas"""
+    for doc_key, values in other.items():
+        _merge_values(deltas.setdefault(doc_key, {}), values)
+
+def _merge_values(target: Dict[str, Any], values: Dict[str, Any]):
+    for key, value in values.items():
+        if isinstance(value, dict):
+            _merge_values(target.setdefault(key, {}), value)
+        else:
+            target[key] = target.get(key, 0) + value
+
+def entry_deltas(changes: Iterable[Tuple[Dict[str, Any], int]]) -> Deltas:
+    """Rollup changes for entries added (sign 1) or removed (sign -1)"""
+    deltas: Deltas = {}
+    for entry, sign in changes:
+        duration = entry.get('duration')
+        if not duration or entry.get('start_time') is None:
+            # Still running, nothing to roll up yet
+            continue
+        bucket = sketches.bucket_key(duration)
+        task_id = entry.get('task_id')
+        user_id = entry.get('user_id')
+
+        if task_id:
+            _add(deltas.setdefault(task_key(task_id, user_id), {}), ('duration_sketch', bucket), sign)
+
+        if user_id:
+            for doc_key in ((ROLLUP_COLLECTION, rollup_id(user_id, entry_day(entry))), (USER_STATS_COLLECTION, user_id)):
+                doc = deltas.setdefault(doc_key, {})
+                _add(doc, ('count',), sign)
+                _add(doc, ('total_duration',), sign * duration)
+                _add(doc, ('sketch', bucket), sign)
+                if task_id and doc_key[0] == ROLLUP_COLLECTION:
+                    _add(doc, ('tasks', task_id, 'count'), sign)
+                    _add(doc, ('tasks', task_id, 'total_duration'), sign * duration)
+                    _add(doc, ('tasks', task_id, 'sketch', bucket), sign)
+    return deltas
+
+def _to_transforms(values: Dict[str, Any]) -> Dict[str, Any]:
+    """Nested Increment transforms, dropping deltas that cancel out"""
+    transforms = {}
+    for key, value in values.items():
+        if isinstance(value, dict):
+            nested = _to_transforms(value)
+            if nested:
+                transforms[key] = nested
+        elif value:
+            transforms[key] = firestore.Increment(value)
+    return transforms
+
+def _static_fields(doc_key: Tuple[str, ...]) -> Dict[str, Any]:
+    collection, doc_id = doc_key[:2]
+    if collection == ROLLUP_COLLECTION:
+        user_id, day = doc_id.rsplit('_', 1)
+        return {"user_id": user_id, "date": day}
+    if collection == USER_STATS_COLLECTION:
+        return {"user_id": doc_id}
+    return {}
+
+def stage(writer, db, deltas: Deltas, skip_tasks: bool = False):
+    """Stage rollup deltas on a write batch or transaction"""
+    for doc_key, values in deltas.items():
+        if skip_tasks and doc_key[0] == TASK_COLLECTION:
+            continue
+        transforms = _to_transforms(values)
+        if not transforms:
+            continue
+        transforms.update(_static_fields(doc_key))
+        if doc_key[0] == TASK_COLLECTION:
+            # Counter changes are task changes for /sync
+            transforms["updated_at"] = firestore.SERVER_TIMESTAMP
+        writer.set(document_ref(db, doc_key), transforms, merge=True)
+
+def write_snapshot(writer, db, documents: Deltas):
+    """Overwrite rollups with absolute values, e.g. rebuilt from raw entries"""
+    for doc_key, values in documents.items():
+        ref = document_ref(db, doc_key)
+        if doc_key[0] == TASK_COLLECTION:
+            writer.update(ref, {"duration_sketch": values.get('duration_sketch', {})})
+        else:
+            writer.set(ref, {**values, **_static_fields(doc_key)})
+
+def days_in_range(start: date, end: date) -> List[date]:
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+def get_rollups(db, user_id: str, start: date, end: date) -> List[Dict[str, Any]]:
+    """Daily rollups for the UTC days start..end inclusive, in one batched read"""
+    refs = [db.collection(ROLLUP_COLLECTION).document(rollup_id(user_id, day)) for day in days_in_range(start, end)]
+    return [doc.to_dict() for doc in db.get_all(refs) if doc.exists]
+
+def summarize(sketch_maps: Iterable[Optional[Dict[str, float]]], total_duration: float = 0.0) -> Dict[str, Any]:
+    """Merge duration sketches and report count, mean and p50/p90/p99"""
+    sketch = sketches.DurationSketch()
+    for buckets in sketch_maps:
+        if buckets:
+            sketch.merge_buckets(buckets)
+    summary = sketch.summary()
+    summary["total_duration"] = total_duration
+    summary["mean"] = total_duration / summary["count"] if summary["count"] else None
+    return summary
@@ -0,0 +1,140 @@
+"""
+In-process scheduler for maintenance jobs
+Every API instance runs a Scheduler, but only the holder of a lease document in
+scheduler_leases runs jobs, so a job never runs on two instances at once. The
+lease expires unless renewed, so another instance takes over within one lease
+period if the leader dies. Job run times are stored on the lease document, which
+keeps daily jobs to one run per day across leader changes.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, time, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+LEASE_COLLECTION = 'scheduler_leases'
+
+# Seconds a lease stays valid without renewal
+LEASE_SECONDS = float(os.environ.get("CHRONA_SCHEDULER_LEASE_SECONDS", "60"))
+
+# Seconds between checks for due jobs, also how often the lease is renewed
+TICK_SECONDS = LEASE_SECONDS / 3
+
+class Job:
+    """A function of the database run every interval, or daily at a UTC time"""
+
+    def __init__(self, name: str, func: Callable, interval: Optional[timedelta] = None, at: Optional[time] = None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.at = at
+
+    def is_due(self, last_run: Optional[datetime], now: datetime) -> bool:
+        if self.interval is not None:
+            return last_run is None or now - last_run >= self.interval
+        scheduled = datetime.combine(now.date(), self.at, tzinfo=timezone.utc)
+        if now < scheduled:
+            scheduled -= timedelta(days=1)
+        return last_run is None or last_run < scheduled
+
+@firestore.transactional
+def _acquire_in_transaction(transaction, lease_ref, holder: str, now: datetime) -> Optional[Dict]:
+    """Take or renew the lease, returns the lease data if this holder has it"""
+    snapshot = lease_ref.get(transaction=transaction)
+    lease = snapshot.to_dict() if snapshot.exists else {}
+    expires_at = lease.get("expires_at")
+    if lease.get("holder") not in (None, holder) and expires_at is not None and expires_at > now:
+        return None
+
+    lease.update({"holder": holder, "expires_at": now + timedelta(seconds=LEASE_SECONDS)})
+    transaction.set(lease_ref, lease)
+    return lease
+
+class Scheduler:
+    """Runs registered jobs on whichever instance holds the named lease"""
+
+    def __init__(self, db, name: str = "maintenance"):
+        self.db = db
+        self.lease_ref = db.collection(LEASE_COLLECTION).document(name)
+        self.holder = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.jobs: List[Job] = []
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    def every(self, name: str, interval: timedelta, func: Callable):
+        self.jobs.append(Job(name, func, interval=interval))
+
+    def daily(self, name: str, at: time, func: Callable):
+        self.jobs.append(Job(name, func, at=at))
+
+    def _acquire(self) -> Optional[Dict]:
+        return _acquire_in_transaction(self.db.transaction(), self.lease_ref, self.holder, datetime.now(timezone.utc))
+
+    def _record_run(self, name: str, when: datetime):
+        self.lease_ref.update({f"last_runs.{name}": when})
+
+    def _release(self):
+        lease = self.lease_ref.get()
+        if lease.exists and lease.to_dict().get("holder") == self.holder:
+            self.lease_ref.update({"expires_at": datetime.now(timezone.utc)})
+
+    async def _tick(self):
+        lease = await asyncio.to_thread(self._acquire)
+        if (lease is not None) != self.is_leader:
+            logger.info("Scheduler leadership %s", "acquired" if lease is not None else "lost", extra={"holder": self.holder})
+        self.is_leader = lease is not None
+        if lease is None:
+            return
+
+        last_runs = lease.get("last_runs", {})
+        for job in self.jobs:
+            now = datetime.now(timezone.utc)
+            if not job.is_due(last_runs.get(job.name), now):
+                continue
+            try:
+                result = await self._run_job(job)
+                logger.info("Scheduled job %s finished", job.name, extra={"result": result})
+            except Exception:
+                logger.exception("Scheduled job %s failed", job.name)
+            await asyncio.to_thread(self._record_run, job.name, now)
+
+    async def _run_job(self, job: Job):
+        """Run a job off the event loop, renewing the lease while it runs"""
+        # Jobs use the synchronous Firestore client
+        job_task = asyncio.ensure_future(asyncio.to_thread(job.func, self.db))
+        while True:
+            done, _ = await asyncio.wait({job_task}, timeout=TICK_SECONDS)
+            if done:
+                return job_task.result()
+            await asyncio.to_thread(self._acquire)
+
+    async def run(self):
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Scheduler tick failed")
+            await asyncio.sleep(TICK_SECONDS)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop running jobs and hand the lease over immediately"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.is_leader:
+            await asyncio.to_thread(self._release)
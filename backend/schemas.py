@@ -1,12 +1,31 @@
 from pydantic import BaseModel, Field, EmailStr
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional, List, Dict, Any
 from pydantic import validator
 
+def parse_utc_datetime(value):
+    """Parse an ISO 8601 value into an aware UTC datetime
+
+    Values with an offset are converted to UTC, naive values are taken to be
+    UTC already.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        try:
+            # fromisoformat only accepts "Z" from Python 3.11
+            value = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid datetime format: {value}. Error: {e}")
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
 # User authentication schemas
 class UserBase(BaseModel):
     email: EmailStr
     name: Optional[str] = None
+    timezone: Optional[str] = None  # IANA name, used for statistics
 
 class UserCreate(UserBase):
     password: str
@@ -20,6 +39,7 @@ class TokenData(BaseModel):
     token_type: str
     user_id: str
     expires_at: int
+    refresh_token: Optional[str] = None
 
 class User(UserBase):
     id: str
@@ -40,6 +60,8 @@ class TaskCreate(TaskBase):
 class Task(TaskBase):
     id: str
     created_at: datetime
+    entry_count: int = 0
+    total_duration: float = 0
 
     class Config:
         from_attributes = True
@@ -60,29 +82,10 @@ class TimeEntryBase(BaseModel):
         }
 
 class TimeEntryCreate(TimeEntryBase):
-    # Allow string dates and convert to datetime objects (without timezone info)
+    # Allow string dates and convert them to UTC instants
     @validator('start_time', 'end_time', pre=True)
     def parse_datetime(cls, value):
-        if value is None:
-            return None
-        if isinstance(value, datetime):
-            # Remove timezone if present
-            if value.tzinfo is not None:
-                return value.replace(tzinfo=None)
-            return value
-        try:
-            # Handle various ISO formats by cleaning the string first
-            # Remove potential microseconds and timezone info
-            cleaned = value.split('.')[0]  # Remove microseconds if present
-            if '+' in cleaned:
-                cleaned = cleaned.split('+')[0]  # Remove timezone info if present
-            if 'Z' in cleaned:
-                cleaned = cleaned.split('Z')[0]  # Remove UTC indicator if present
-            
-            dt = datetime.fromisoformat(cleaned)
-            return dt
-        except (TypeError, ValueError) as e:
-            raise ValueError(f"Invalid datetime format: {value}. Error: {e}")
+        return parse_utc_datetime(value)
 
 class TimeEntryUpdate(BaseModel):
     end_time: Optional[datetime] = None
@@ -95,44 +98,32 @@ class TimeEntryUpdate(BaseModel):
             datetime: lambda v: v.isoformat()
         }
     
-    # Allow string dates and convert to datetime objects (without timezone info)
+    # Allow string dates and convert them to UTC instants
     @validator('end_time', pre=True)
     def parse_datetime(cls, value):
-        if value is None:
-            return None
-        if isinstance(value, datetime):
-            # Remove timezone if present
-            if value.tzinfo is not None:
-                return value.replace(tzinfo=None)
-            return value
-        try:
-            # Handle various ISO formats by cleaning the string first
-            # Remove potential microseconds and timezone info
-            cleaned = value.split('.')[0]  # Remove microseconds if present
-            if '+' in cleaned:
-                cleaned = cleaned.split('+')[0]  # Remove timezone info if present
-            if 'Z' in cleaned:
-                cleaned = cleaned.split('Z')[0]  # Remove UTC indicator if present
-            
-            dt = datetime.fromisoformat(cleaned)
-            return dt
-        except (TypeError, ValueError) as e:
-            raise ValueError(f"Invalid datetime format: {value}. Error: {e}")
+        return parse_utc_datetime(value)
 
 class TimeEntry(TimeEntryBase):
     id: str
     created_at: datetime
     task: Optional[Task] = None
 
+class ActiveTimer(BaseModel):
+    entry_id: str
+    task_id: str
+    start_time: datetime
+
 # Stats schemas
 class DailyStats(BaseModel):
     date: str
+    timezone: str
     total_duration: float
     tasks: List[Dict[str, Any]]
 
 class WeeklyStats(BaseModel):
     week_start: str
     week_end: str
+    timezone: str
     total_duration: float
     daily_breakdown: List[Dict[str, Any]]
     task_breakdown: List[Dict[str, Any]] 
\ No newline at end of file
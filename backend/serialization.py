@@ -0,0 +1,63 @@
+"""
+MessagePack responses for clients that ask for them
+List and sync endpoints answer `Accept: application/msgpack` with a MessagePack
+body instead of JSON. Datetimes are packed as MessagePack timestamps rather than
+ISO strings, so clients decode them without parsing text. JSON stays the
+default for every other Accept header.
+"""
+
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from typing import Any, Optional
+
+import msgpack
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+import compression
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+def wants_msgpack(accept: Optional[str]) -> bool:
+    """Whether the client asked for MessagePack at least as much as JSON"""
+    if not accept:
+        return False
+    weights = compression.parse_qvalues(accept)
+    msgpack_q = max(weights.get(media_type, 0.0) for media_type in MSGPACK_TYPES)
+    json_q = weights.get("application/json", weights.get("application/*", weights.get("*/*", 0.0)))
+    return msgpack_q > 0 and msgpack_q >= json_q
+
+def _default(obj: Any):
+    """Pack values msgpack has no type for"""
+    if isinstance(obj, datetime):
+        # Firestore reads naive datetimes as UTC, so do the same
+        if obj.tzinfo is None:
+            obj = obj.replace(tzinfo=timezone.utc)
+        return msgpack.Timestamp.from_datetime(obj)
+    if isinstance(obj, date):
+        return obj.isoformat()
+    return jsonable_encoder(obj)
+
+def packb(content: Any) -> bytes:
+    return msgpack.packb(content, default=_default, datetime=True, use_bin_type=True)
+
+def unpackb(data: bytes) -> Any:
+    """Decode a MessagePack body, timestamps become UTC datetimes"""
+    return msgpack.unpackb(data, raw=False, timestamp=3)
+
+@lru_cache(maxsize=None)
+def _adapter(model) -> TypeAdapter:
+    return TypeAdapter(model)
+
+def dump(model, content: Any) -> Any:
+    """Validate and filter content through a response model, like FastAPI does
+    for JSON, keeping datetimes as objects"""
+    adapter = _adapter(model)
+    return adapter.dump_python(adapter.validate_python(content))
+
+class MsgPackResponse(Response):
+    media_type = "application/msgpack"
+
+    def render(self, content: Any) -> bytes:
+        return packb(content)
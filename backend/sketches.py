@@ -0,0 +1,83 @@
+"""
+Mergeable quantile sketch for session durations
+A DDSketch-style log-bucketed histogram: every value lands in bucket
+ceil(log_gamma(value)), so any quantile is returned within RELATIVE_ACCURACY of
+the true value. Sketches merge by adding bucket counts, which lets Firestore
+maintain them with Increment transforms and lets queries merge days cheaply.
+"""
+
+import math
+from typing import Dict, Optional
+
+# Quantiles are accurate to within 2% of the true value
+RELATIVE_ACCURACY = 0.02
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+# Durations are in minutes like on the entries, anything shorter than a second
+# is counted in the zero bucket
+MIN_VALUE = 1 / 60
+
+ZERO_BUCKET = "zero"
+
+def bucket_key(value: float) -> str:
+    """Firestore map key of the bucket holding a value"""
+    if value < MIN_VALUE:
+        return ZERO_BUCKET
+    return f"b{math.ceil(math.log(value) / _LOG_GAMMA)}"
+
+def _bucket_value(key: str) -> float:
+    """Representative value of a bucket, the midpoint in relative terms"""
+    if key == ZERO_BUCKET:
+        return 0.0
+    index = int(key[1:])
+    return 2 * _GAMMA ** index / (_GAMMA + 1)
+
+class DurationSketch:
+    """Bucket counts of a DDSketch"""
+
+    def __init__(self, buckets: Optional[Dict[str, float]] = None):
+        self.buckets: Dict[str, float] = {}
+        if buckets:
+            self.merge_buckets(buckets)
+
+    def add(self, value: float, count: int = 1):
+        key = bucket_key(value)
+        self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge_buckets(self, buckets: Dict[str, float]):
+        """Add another sketch's bucket counts to this one"""
+        for key, count in buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    @property
+    def count(self) -> float:
+        return sum(count for count in self.buckets.values() if count > 0)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Approximate q-quantile, None for an empty sketch"""
+        ordered = sorted(
+            ((_bucket_value(key), count) for key, count in self.buckets.items() if count > 0),
+            key=lambda item: item[0]
+        )
+        total = sum(count for _, count in ordered)
+        if not total:
+            return None
+
+        rank = q * (total - 1)
+        seen = 0
+        for value, count in ordered:
+            seen += count
+            if seen > rank:
+                return value
+        return ordered[-1][0]
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        """Count and the p50/p90/p99 session lengths"""
+        return {
+            "count": int(self.count),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "relative_accuracy": RELATIVE_ACCURACY
+        }
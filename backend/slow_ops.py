@@ -0,0 +1,73 @@
+"""
+Slow Firestore operation log
+The instrumented database client reports every operation here, and the ones
+over the latency or document-count threshold are kept in a ring buffer served
+by GET /admin/slow-ops
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from logging_config import request_id_var
+
+# Operations slower than this many milliseconds are recorded
+SLOW_OP_MS = float(os.environ.get("CHRONA_SLOW_OP_MS", "200"))
+# Operations reading at least this many documents are recorded
+SLOW_OP_DOCS = int(os.environ.get("CHRONA_SLOW_OP_DOCS", "500"))
+# Number of slow operations kept
+SLOW_OP_BUFFER_SIZE = int(os.environ.get("CHRONA_SLOW_OP_BUFFER", "200"))
+
+_records = deque(maxlen=SLOW_OP_BUFFER_SIZE)
+_lock = threading.Lock()
+
+def collection_path(path: str) -> str:
+    """Replace document IDs in a Firestore path with {id}"""
+    segments = path.split("/")
+    return "/".join(segment if i % 2 == 0 else "{id}" for i, segment in enumerate(segments))
+
+def fingerprint(shape: Dict[str, Any]) -> str:
+    """Normalized text of a query shape, with all values left out"""
+    parts = [shape["collection"]]
+    if shape.get("filters"):
+        parts.append("where " + " and ".join(f"{field} {op} ?" for field, op in shape["filters"]))
+    if shape.get("order"):
+        parts.append("order by " + ", ".join(f"{field} {direction}" for field, direction in shape["order"]))
+    if shape.get("select"):
+        parts.append("select " + ", ".join(shape["select"]))
+    if shape.get("limit"):
+        parts.append("limit ?")
+    if shape.get("offset"):
+        parts.append("offset ?")
+    return " ".join(parts)
+
+def record(operation: str, shape: Dict[str, Any], elapsed: float, docs: int):
+    """Keep the operation if it crossed a threshold"""
+    elapsed_ms = elapsed * 1000
+    if elapsed_ms < SLOW_OP_MS and docs < SLOW_OP_DOCS:
+        return
+
+    text = fingerprint(shape)
+    entry = {
+        "at": time.time(),
+        "operation": operation,
+        "fingerprint": text,
+        "fingerprint_id": hashlib.sha1(text.encode()).hexdigest()[:12],
+        "elapsed_ms": round(elapsed_ms, 2),
+        "docs": docs,
+        "request_id": request_id_var.get()
+    }
+    with _lock:
+        _records.append(entry)
+
+def recent(fingerprint_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Slow operations, newest first"""
+    with _lock:
+        entries = list(_records)
+    if fingerprint_id:
+        entries = [entry for entry in entries if entry["fingerprint_id"] == fingerprint_id]
+    entries.reverse()
+    return entries
@@ -0,0 +1,142 @@
+"""
+Delta sync of a user's tasks and time entries for GET /sync
+Every write to a task or time entry sets updated_at to the commit time, and
+every delete leaves a tombstone in the tombstones collection in the same write.
+A client passes the cursor of its last sync and gets the documents written and
+deleted since then, in updated_at order, plus a new cursor. Tombstones expire
+after CHRONA_TOMBSTONE_TTL_DAYS; cursors older than that need a full sync.
+Entries moved to the archive by compaction are not reported as deleted.
+"""
+
+import base64
+import binascii
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+import layout
+import models
+
+TOMBSTONE_COLLECTION = 'tombstones'
+
+# How long deletions can be synced, a tombstones TTL policy on expires_at
+# should match
+TOMBSTONE_TTL = timedelta(days=float(os.environ.get("CHRONA_TOMBSTONE_TTL_DAYS", "30")))
+
+MAX_LIMIT = 1000
+
+# An empty sync moves the cursor up to this long before the time it read at,
+# which covers clock skew against Firestore commit times
+CURSOR_MARGIN = timedelta(seconds=5)
+
+# Change sources in the order they sort within one commit time
+SOURCES = ("deleted", "task", "time_entry")
+
+class CursorExpired(Exception):
+    """Raised for cursors older than the tombstone retention"""
+
+# (updated_at, source, document ID) of the last change a client has seen
+Cursor = Tuple[datetime, str, str]
+
+def encode_cursor(cursor: Cursor) -> str:
+    updated_at, source, doc_id = cursor
+    raw = f"{updated_at.isoformat()}|{source}|{doc_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(token: str) -> Cursor:
+    """Parse a cursor from a previous sync, ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        updated_at, source, doc_id = raw.split("|", 2)
+        updated_at = datetime.fromisoformat(updated_at)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid sync cursor")
+    if source not in SOURCES or updated_at.tzinfo is None:
+        raise ValueError("Invalid sync cursor")
+    return updated_at, source, doc_id
+
+def stage_tombstone(writer, db, kind: str, doc_id: str, user_id: Optional[str]):
+    """Record a deleted task or time entry on a write batch or transaction"""
+    if not user_id:
+        return
+    writer.set(db.collection(TOMBSTONE_COLLECTION).document(), {
+        "user_id": user_id,
+        "type": kind,
+        "id": doc_id,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+        "expires_at": datetime.now(timezone.utc) + TOMBSTONE_TTL
+    })
+
+def _source_collection(db, source: str, user_id: str):
+    if source == "task":
+        collection = layout.tasks_collection(db, user_id)
+    elif source == "time_entry":
+        collection = layout.entries_collection(db, user_id)
+    else:
+        return db.collection(TOMBSTONE_COLLECTION), db.collection(TOMBSTONE_COLLECTION).where('user_id', '==', user_id)
+    if layout.PER_USER:
+        return collection, collection
+    return collection, collection.where('user_id', '==', user_id)
+
+def _source_changes(db, source: str, user_id: str, since: Optional[Cursor], limit: int) -> List[Dict[str, Any]]:
+    """Up to limit changes from one source after the cursor, in cursor order"""
+    collection, query = _source_collection(db, source, user_id)
+    query = query.order_by('updated_at').order_by(FieldPath.document_id())
+    if since is not None:
+        updated_at, cursor_source, doc_id = since
+        if source == cursor_source and doc_id:
+            query = query.start_after({'updated_at': updated_at, FieldPath.document_id(): collection.document(doc_id)})
+        elif SOURCES.index(source) < SOURCES.index(cursor_source):
+            query = query.where('updated_at', '>', updated_at)
+        else:
+            query = query.where('updated_at', '>=', updated_at)
+
+    changes = []
+    for doc in query.limit(limit).stream():
+        data = doc.to_dict()
+        if source == "deleted":
+            change = {"type": data["type"], "id": data["id"], "deleted": True, "data": None}
+        elif source == "task":
+            change = {"type": "task", "id": doc.id, "deleted": False, "data": models.Task.from_dict(data, doc.id)}
+        else:
+            change = {"type": "time_entry", "id": doc.id, "deleted": False, "data": models.TimeEntry.from_dict(data, doc.id)}
+        change["updated_at"] = data["updated_at"]
+        change["_cursor"] = (data["updated_at"], source, doc.id)
+        changes.append(change)
+    return changes
+
+def get_changes(db, user_id: str, since: Optional[Cursor] = None, limit: int = 500) -> Dict[str, Any]:
+    """Changes to a user's tasks and time entries after a cursor, oldest first.
+    Without a cursor every live document is returned."""
+    if since is not None and since[0] < datetime.now(timezone.utc) - TOMBSTONE_TTL:
+        raise CursorExpired("Sync cursor is older than the tombstone retention, sync again without one")
+
+    read_time = datetime.now(timezone.utc)
+    # Deletions before the first sync don't matter to the client
+    sources = SOURCES if since is not None else SOURCES[1:]
+    changes = []
+    for source in sources:
+        changes.extend(_source_changes(db, source, user_id, since, limit + 1))
+    changes.sort(key=lambda change: change["_cursor"])
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if changes:
+        cursor = changes[-1]["_cursor"]
+    else:
+        # Nothing changed, so move the cursor up to the read time. Otherwise an
+        # idle client keeps sending the same cursor until it expires. No document
+        # ID means every change at that time is still to come.
+        cursor = (read_time - CURSOR_MARGIN, SOURCES[0], "")
+        if since is not None and since[0] >= cursor[0]:
+            cursor = since
+    for change in changes:
+        del change["_cursor"]
+    return {
+        "changes": changes,
+        "cursor": encode_cursor(cursor) if cursor is not None else None,
+        "has_more": has_more
+    }
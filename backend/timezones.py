@@ -0,0 +1,122 @@
+"""
+Time zone helpers for statistics
+Local day boundaries are precomputed per time zone and year as arrays of UTC
+epoch seconds, so bucketing entries into local days is a single searchsorted
+"""
+
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import numpy as np
+
+DEFAULT_TIMEZONE = "UTC"
+
+@lru_cache(maxsize=512)
+def get_zone(name: Optional[str]) -> ZoneInfo:
+    """Resolve an IANA time zone name, raises ValueError if unknown"""
+    try:
+        return ZoneInfo(name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone: {name}")
+
+def local_today(tz_name: Optional[str]) -> date:
+    """Today's date in a time zone"""
+    return datetime.now(get_zone(tz_name)).date()
+
+@lru_cache(maxsize=256)
+def _year_boundaries(tz_name: str, year: int) -> np.ndarray:
+    """UTC epoch seconds of every local midnight from Jan 1 of year to Jan 1 of year + 1"""
+    zone = get_zone(tz_name)
+    first = date(year, 1, 1)
+    days = (date(year + 1, 1, 1) - first).days
+    boundaries = np.empty(days + 1, dtype=np.float64)
+    for i in range(days + 1):
+        local_midnight = datetime.combine(first + timedelta(days=i), time.min, tzinfo=zone)
+        boundaries[i] = local_midnight.timestamp()
+    boundaries.flags.writeable = False
+    return boundaries
+
+def day_boundaries(tz_name: Optional[str], start: date, days: int) -> np.ndarray:
+    """UTC epoch seconds of the days + 1 local midnights starting at start
+
+    Day i of the range covers [boundaries[i], boundaries[i + 1]).
+    """
+    tz_name = tz_name or DEFAULT_TIMEZONE
+    end = start + timedelta(days=days)
+    parts = []
+    for year in range(start.year, end.year + 1):
+        table = _year_boundaries(tz_name, year)
+        year_start = date(year, 1, 1)
+        first = (max(start, year_start) - year_start).days
+        last = (min(end, date(year + 1, 1, 1)) - year_start).days
+        # Each year table ends with the next Jan 1, only keep it for the last year
+        stop = last + 1 if year == end.year else last
+        parts.append(table[first:stop])
+    return np.concatenate(parts)
+
+@lru_cache(maxsize=64)
+def _year_hours(tz_name: str, year: int):
+    """Local hour bins for a year
+
+    Returns (bounds, labels, day_offsets): bounds holds the UTC epoch start of
+    every local hour plus the next Jan 1, labels the weekday * 24 + hour of each
+    bin, and day_offsets the bin index of each local midnight. Days with a DST
+    change simply have 23 or 25 bins.
+    """
+    zone = get_zone(tz_name)
+    days = _year_boundaries(tz_name, year)
+    starts = []
+    day_offsets = [0]
+    for i in range(len(days) - 1):
+        day_start, day_end = days[i], days[i + 1]
+        count = int(np.ceil((day_end - day_start) / 3600))
+        starts.append(day_start + 3600 * np.arange(count, dtype=np.float64))
+        day_offsets.append(day_offsets[-1] + count)
+
+    starts = np.concatenate(starts)
+    labels = np.empty(len(starts), dtype=np.int64)
+    for i, start in enumerate(starts):
+        local = datetime.fromtimestamp(start, tz=zone)
+        labels[i] = local.weekday() * 24 + local.hour
+
+    bounds = np.append(starts, days[-1])
+    day_offsets = np.array(day_offsets, dtype=np.int64)
+    for array in (bounds, labels, day_offsets):
+        array.flags.writeable = False
+    return bounds, labels, day_offsets
+
+def hour_boundaries(tz_name: Optional[str], start: date, days: int):
+    """Local hour bins covering days days from start
+
+    Returns (bounds, labels) where bin i covers [bounds[i], bounds[i + 1]) and
+    labels[i] is its weekday * 24 + hour.
+    """
+    tz_name = tz_name or DEFAULT_TIMEZONE
+    end = start + timedelta(days=days)
+    bound_parts = []
+    label_parts = []
+    for year in range(start.year, end.year + 1):
+        bounds, labels, day_offsets = _year_hours(tz_name, year)
+        year_start = date(year, 1, 1)
+        first = day_offsets[(max(start, year_start) - year_start).days]
+        last = day_offsets[(min(end, date(year + 1, 1, 1)) - year_start).days]
+        bound_parts.append(bounds[first:last])
+        label_parts.append(labels[first:last])
+    # Close the last bin at the end of the range
+    bound_parts.append(day_boundaries(tz_name, end, 0))
+    return np.concatenate(bound_parts), np.concatenate(label_parts)
+
+def to_utc_datetime(epoch_seconds: float) -> datetime:
+    """Convert a boundary back to an aware UTC datetime for Firestore queries"""
+    return datetime.fromtimestamp(float(epoch_seconds), tz=timezone.utc)
+
+def bucket_durations(boundaries: np.ndarray, starts: np.ndarray, durations: np.ndarray) -> np.ndarray:
+    """Sum durations per local day, by the day each entry starts in"""
+    days = len(boundaries) - 1
+    if len(starts) == 0:
+        return np.zeros(days)
+    index = np.searchsorted(boundaries, starts, side="right") - 1
+    in_range = (index >= 0) & (index < days)
+    return np.bincount(index[in_range], weights=durations[in_range], minlength=days)[:days]
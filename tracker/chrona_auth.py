@@ -1,6 +1,7 @@
 import sys
 import os
 import requests
+from chrona_client import session
 import json
 import logging
 from datetime import datetime, timedelta
@@ -27,6 +28,7 @@ class AuthManager:
         self.token_expiry = self.settings.value("auth/token_expiry", 0)
         self.user_name = self.settings.value("auth/user_name", "")
         self.user_email = self.settings.value("auth/user_email", "")
+        self.refresh_token = self.settings.value("auth/refresh_token", "")
     
     def is_authenticated(self):
         """Check if the user is authenticated and token is valid"""
@@ -38,9 +40,9 @@ class AuthManager:
             expiry = int(self.token_expiry)
             now = int(datetime.now().timestamp())
             if now >= expiry:
-                # Token expired
+                # Token expired, try to renew it with the refresh token
                 logger.info("Auth token expired")
-                return False
+                return self.refresh_access_token()
         except (ValueError, TypeError):
             # Invalid expiry value
             return False
@@ -56,13 +58,44 @@ class AuthManager:
             "Authorization": f"Bearer {self.token}"
         }
     
-    def save_auth_data(self, token, user_id, expires_at, user_name="", user_email=""):
+    def refresh_access_token(self):
+        """Get a new access token using the stored refresh token"""
+        if not self.refresh_token:
+            return False
+        
+        try:
+            response = session.post(
+                f"{API_URL}/token/refresh",
+                json={'refresh_token': self.refresh_token},
+                timeout=10
+            )
+            
+            if response.status_code != 200:
+                logger.error(f"Token refresh failed: {response.status_code}")
+                return False
+            
+            token_data = response.json()
+            self.save_auth_data(
+                token_data["access_token"],
+                token_data["user_id"],
+                token_data["expires_at"],
+                self.user_name,
+                self.user_email,
+                token_data.get("refresh_token", self.refresh_token)
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Token refresh error: {e}")
+            return False
+    
+    def save_auth_data(self, token, user_id, expires_at, user_name="", user_email="", refresh_token=""):
         """Save authentication data to settings"""
         self.token = token
         self.user_id = user_id
         self.token_expiry = expires_at
         self.user_name = user_name
         self.user_email = user_email
+        self.refresh_token = refresh_token
         
         # Save to settings
         self.settings.setValue("auth/user_id", user_id)
@@ -70,6 +103,7 @@ class AuthManager:
         self.settings.setValue("auth/token_expiry", expires_at)
         self.settings.setValue("auth/user_name", user_name)
         self.settings.setValue("auth/user_email", user_email)
+        self.settings.setValue("auth/refresh_token", refresh_token)
         
         logger.info(f"Saved auth data for user {user_id}")
     
@@ -80,6 +114,7 @@ class AuthManager:
         self.token_expiry = 0
         self.user_name = ""
         self.user_email = ""
+        self.refresh_token = ""
         
         # Clear from settings
         self.settings.remove("auth/user_id")
@@ -87,6 +122,7 @@ class AuthManager:
         self.settings.remove("auth/token_expiry")
         self.settings.remove("auth/user_name")
         self.settings.remove("auth/user_email")
+        self.settings.remove("auth/refresh_token")
         
         logger.info("Cleared auth data")
     
@@ -100,7 +136,7 @@ class AuthManager:
             }
             
             # Make login request
-            response = requests.post(
+            response = session.post(
                 f"{API_URL}/token",
                 data=data,
                 headers={
@@ -125,7 +161,7 @@ class AuthManager:
             token_data = response.json()
             
             # Make request to get user details
-            user_response = requests.get(
+            user_response = session.get(
                 f"{API_URL}/users/me",
                 headers={
                     'Authorization': f"Bearer {token_data['access_token']}"
@@ -145,7 +181,8 @@ class AuthManager:
                 token_data["user_id"],
                 token_data["expires_at"],
                 user_data.get("name", ""),
-                user_data.get("email", "")
+                user_data.get("email", ""),
+                token_data.get("refresh_token", "")
             )
             
             return True, "Login successful"
@@ -165,7 +202,7 @@ class AuthManager:
             }
             
             # Make registration request
-            response = requests.post(
+            response = session.post(
                 f"{API_URL}/register",
                 json=data,
                 headers={
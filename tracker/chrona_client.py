@@ -0,0 +1,78 @@
+"""
+HTTP session shared by the Chrona trackers
+Sends Accept-Encoding with every response encoding the installed urllib3 can
+decode: gzip and deflate always, br when brotli is installed and zstd when
+zstandard is installed (urllib3 2). The API compresses larger responses in the
+best of these, and requests decodes them transparently. One session also reuses
+connections across calls.
+
+List and sync endpoints can answer in MessagePack, which is smaller than JSON
+and cheaper to decode, with timestamps as datetimes instead of ISO strings.
+get_list() asks for it when msgpack is installed and decode() reads either.
+
+While a timer runs the trackers post heartbeats through Heartbeat, so the API
+can close entries whose tracker went away at the time it was last heard from.
+"""
+
+import threading
+import time
+
+import requests
+from urllib3.util.request import ACCEPT_ENCODING
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TYPE = "application/msgpack"
+
+# Prefer MessagePack when it can be decoded, JSON stays acceptable
+LIST_ACCEPT = f"{MSGPACK_TYPE}, application/json;q=0.9" if msgpack is not None else "application/json"
+
+def create_session():
+    """requests session advertising the decodable response encodings"""
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    return session
+
+session = create_session()
+
+def get_list(url, **kwargs):
+    """GET a list or sync endpoint, preferring MessagePack"""
+    headers = {"Accept": LIST_ACCEPT, **kwargs.pop("headers", {})}
+    return session.get(url, headers=headers, **kwargs)
+
+def decode(response):
+    """Body of a JSON or MessagePack response, MessagePack timestamps become UTC datetimes"""
+    content_type = response.headers.get("Content-Type", "")
+    if msgpack is not None and content_type.startswith((MSGPACK_TYPE, "application/x-msgpack")):
+        return msgpack.unpackb(response.content, raw=False, timestamp=3)
+    return response.json()
+
+# Seconds between heartbeats for a running entry, keep well below the API's
+# CHRONA_HEARTBEAT_TIMEOUT_MINUTES
+HEARTBEAT_SECONDS = 60
+
+class Heartbeat:
+    """Posts /timer/heartbeat for the running entry at most every HEARTBEAT_SECONDS"""
+
+    def __init__(self):
+        self.entry_id = None
+        self.last_sent = 0.0
+
+    def tick(self, api_url, entry_id, headers=None):
+        """Call from the timer loop, sends in the background when a heartbeat is due"""
+        now = time.monotonic()
+        if not entry_id or (entry_id == self.entry_id and now - self.last_sent < HEARTBEAT_SECONDS):
+            return
+        self.entry_id, self.last_sent = entry_id, now
+        threading.Thread(target=self._send, args=(api_url, entry_id, headers), daemon=True).start()
+
+    @staticmethod
+    def _send(api_url, entry_id, headers):
+        try:
+            session.post(f"{api_url}/timer/heartbeat", json={"entry_id": entry_id}, headers=headers or {}, timeout=10)
+        except requests.RequestException:
+            # Missed heartbeats only matter once the API's timeout passes
+            pass
@@ -6,6 +6,7 @@ import logging
 import queue
 import threading
 import requests
+from chrona_client import session, get_list, decode, Heartbeat
 from datetime import datetime, timedelta
 import traceback
 import keyboard
@@ -605,6 +606,7 @@ class ChronaApp:
         self.current_task_name = None
         self.start_time = None
         self.entry_id = None
+        self.heartbeat = Heartbeat()
         self.config = {}
         self.command_queue = queue.Queue()
         self.icon = None  # System tray icon
@@ -795,7 +797,7 @@ class ChronaApp:
         def _test_api():
             try:
                 logger.info(f"Testing API connection to {API_URL}...")
-                response = requests.get(f"{API_URL}/")
+                response = session.get(f"{API_URL}/")
                 
                 if response.status_code == 200:
                     logger.info("API connection successful")
@@ -818,10 +820,10 @@ class ChronaApp:
         def _fetch_tasks():
             try:
                 logger.info(f"Fetching tasks from {API_URL}/tasks/")
-                response = requests.get(f"{API_URL}/tasks/")
+                response = get_list(f"{API_URL}/tasks/")
                 
                 if response.status_code == 200:
-                    tasks = response.json()
+                    tasks = decode(response)
                     logger.info(f"Fetched {len(tasks)} tasks")
                     self.tasks = tasks
                     self.signals.task_refresh_complete.emit(tasks)
@@ -841,8 +843,8 @@ class ChronaApp:
     def create_time_entry(self, task_id):
         """Create a new time entry in the API"""
         try:
-            # Format the datetime as ISO 8601 string without timezone
-            start_time = datetime.now().replace(microsecond=0).isoformat()
+            # Format the datetime as ISO 8601 string with the local UTC offset
+            start_time = datetime.now().astimezone().replace(microsecond=0).isoformat()
             
             data = {
                 'task_id': task_id,
@@ -857,7 +859,7 @@ class ChronaApp:
             # Headers for JSON content
             headers = {'Content-Type': 'application/json'}
             
-            response = requests.post(
+            response = session.post(
                 f"{API_URL}/time-entries/", 
                 json=data, 
                 headers=headers,
@@ -889,8 +891,8 @@ class ChronaApp:
     def update_time_entry(self, entry_id):
         """Update a time entry in the API"""
         try:
-            # Format end_time as ISO 8601 string
-            end_time = datetime.now().replace(microsecond=0).isoformat()
+            # Format end_time as ISO 8601 string with the local UTC offset
+            end_time = datetime.now().astimezone().replace(microsecond=0).isoformat()
             
             # Calculate duration in minutes
             duration_minutes = self.calculate_duration() / 60
@@ -906,7 +908,7 @@ class ChronaApp:
             # Headers for JSON content
             headers = {'Content-Type': 'application/json'}
             
-            response = requests.put(
+            response = session.put(
                 f"{API_URL}/time-entries/{entry_id}", 
                 json=data, 
                 headers=headers,
@@ -1199,6 +1201,9 @@ class ChronaApp:
             # Update mini timer if visible
             self.signals.update_timer.emit(formatted)
             
+            # Let the API know the entry is still running
+            self.heartbeat.tick(API_URL, self.entry_id)
+            
             # Schedule next update
             QTimer.singleShot(1000, self.update_timer)
     
@@ -6,6 +6,7 @@ import json
 import os
 import time
 import requests
+from chrona_client import session, get_list, decode, Heartbeat
 from datetime import datetime
 import sys
 import ctypes
@@ -206,6 +207,7 @@ class TimeTrackerApp:
         self.start_time = None
         self.tasks = []
         self.entry_id = None
+        self.heartbeat = Heartbeat()
         self.timer_thread = None
         self.stop_thread = False
         self.icon = None  # System tray icon
@@ -316,6 +318,9 @@ class TimeTrackerApp:
                 # Update system tray tooltip with current time
                 if self.icon and hasattr(self, 'current_task_name'):
                     self.icon.title = f"Time Tracker - {self.current_task_name}: {formatted}"
+                
+                # Let the API know the entry is still running
+                self.heartbeat.tick(self.api_url, self.entry_id)
         except Exception as e:
             logger.error(f"Error updating timer: {e}")
         
@@ -327,7 +332,7 @@ class TimeTrackerApp:
         """Test the API connection and log details"""
         try:
             logger.info(f"Testing API connection to {self.api_url}...")
-            response = requests.get(f"{self.api_url}/")
+            response = session.get(f"{self.api_url}/")
             logger.info(f"API status code: {response.status_code}")
             if response.status_code == 200:
                 logger.info("API connection successful!")
@@ -477,11 +482,11 @@ class TimeTrackerApp:
     def fetch_tasks(self):
         try:
             logger.info(f"Fetching tasks from {self.api_url}/tasks/")
-            response = requests.get(f"{self.api_url}/tasks/")
+            response = get_list(f"{self.api_url}/tasks/")
             logger.info(f"Tasks API status code: {response.status_code}")
             
             if response.status_code == 200:
-                self.tasks = response.json()
+                self.tasks = decode(response)
                 logger.info(f"Fetched {len(self.tasks)} tasks")
                 return self.tasks
             else:
@@ -494,9 +499,9 @@ class TimeTrackerApp:
     
     def create_time_entry(self, task_id):
         try:
-            # Format the datetime as ISO 8601 string without timezone information
+            # Format the datetime as ISO 8601 string with the local UTC offset
             # The API expects this format with precision up to seconds only
-            start_time = datetime.now().replace(microsecond=0).isoformat()
+            start_time = datetime.now().astimezone().replace(microsecond=0).isoformat()
             
             data = {
                 'task_id': task_id,  # Now a string ID for Firebase
@@ -519,7 +524,7 @@ class TimeTrackerApp:
             # Add headers to indicate JSON content
             headers = {'Content-Type': 'application/json'}
             
-            response = requests.post(
+            response = session.post(
                 f"{self.api_url}/time-entries/", 
                 json=data, 
                 headers=headers,
@@ -568,9 +573,9 @@ class TimeTrackerApp:
     
     def update_time_entry(self, entry_id):
         try:
-            # Format end_time as ISO 8601 string without timezone information
+            # Format end_time as ISO 8601 string with the local UTC offset
             # The API expects this format with precision up to seconds only
-            end_time = datetime.now().replace(microsecond=0).isoformat()
+            end_time = datetime.now().astimezone().replace(microsecond=0).isoformat()
             
             # Calculate duration in minutes
             duration_minutes = self.calculate_duration() / 60
@@ -587,7 +592,7 @@ class TimeTrackerApp:
             # Add headers to indicate JSON content
             headers = {'Content-Type': 'application/json'}
             
-            response = requests.put(
+            response = session.put(
                 f"{self.api_url}/time-entries/{entry_id}", 
                 json=data, 
                 headers=headers,
@@ -1030,21 +1035,21 @@ class TimeTrackerApp:
         try:
             # Test API root endpoint
             try:
-                root_response = requests.get(f"{self.api_url}/", timeout=5)
+                root_response = session.get(f"{self.api_url}/", timeout=5)
                 logger.debug(f"API root endpoint: Status {root_response.status_code}, Response: {root_response.text[:200]}")
             except requests.RequestException as e:
                 logger.debug(f"API root endpoint error: {e}")
             
             # Test tasks endpoint
             try:
-                tasks_response = requests.get(f"{self.api_url}/tasks/", timeout=5)
+                tasks_response = session.get(f"{self.api_url}/tasks/", timeout=5)
                 logger.debug(f"Tasks endpoint: Status {tasks_response.status_code}, Response: {tasks_response.text[:200]}")
             except requests.RequestException as e:
                 logger.debug(f"Tasks endpoint error: {e}")
             
             # Test time-entries endpoint
             try:
-                entries_response = requests.get(f"{self.api_url}/time-entries/", timeout=5)
+                entries_response = session.get(f"{self.api_url}/time-entries/", timeout=5)
                 logger.debug(f"Time-entries endpoint: Status {entries_response.status_code}, Response: {entries_response.text[:200]}")
             except requests.RequestException as e:
                 logger.debug(f"Time-entries endpoint error: {e}")
@@ -1057,12 +1062,12 @@ class TimeTrackerApp:
                 logger.debug("Attempting to create a test time entry...")
                 test_data = {
                     'task_id': next((task['id'] for task in self.tasks if len(self.tasks) > 0), None),
-                    'start_time': datetime.now().isoformat(),
+                    'start_time': datetime.now().astimezone().isoformat(),
                     'test': True  # Flag to indicate this is a test entry
                 }
                 if test_data['task_id']:
                     logger.debug(f"Test data: {test_data}")
-                    test_response = requests.post(f"{self.api_url}/time-entries/", json=test_data, timeout=5)
+                    test_response = session.post(f"{self.api_url}/time-entries/", json=test_data, timeout=5)
                     logger.debug(f"Test time entry creation: Status {test_response.status_code}")
                     logger.debug(f"Response: {test_response.text[:500]}")
                 else:
@@ -1264,7 +1269,7 @@ class TimeTrackerApp:
         # Test root endpoint
         try:
             append_text("Testing root endpoint...", "header")
-            response = requests.get(f"{self.api_url}/", timeout=5)
+            response = session.get(f"{self.api_url}/", timeout=5)
             results['root'] = f"Status: {response.status_code}, Response: {response.text[:100]}"
             append_text(f"✓ Root endpoint: {response.status_code}\n", "success")
         except Exception as e:
@@ -1274,7 +1279,7 @@ class TimeTrackerApp:
         # Test tasks endpoint
         try:
             append_text("Testing tasks endpoint...", "header")
-            response = requests.get(f"{self.api_url}/tasks/", timeout=5)
+            response = session.get(f"{self.api_url}/tasks/", timeout=5)
             results['tasks'] = f"Status: {response.status_code}, Tasks: {len(response.json())}"
             append_text(f"✓ Tasks endpoint: {response.status_code}, Found {len(response.json())} tasks\n", "success")
         except Exception as e:
@@ -1284,7 +1289,7 @@ class TimeTrackerApp:
         # Test time entries GET endpoint
         try:
             append_text("Testing time-entries GET endpoint...", "header")
-            response = requests.get(f"{self.api_url}/time-entries/", timeout=5)
+            response = session.get(f"{self.api_url}/time-entries/", timeout=5)
             results['time_entries_get'] = f"Status: {response.status_code}, Entries: {len(response.json()) if response.status_code == 200 else 'N/A'}"
             append_text(f"✓ Time entries GET: {response.status_code}\n", "success")
         except Exception as e:
@@ -1297,8 +1302,8 @@ class TimeTrackerApp:
                 test_task_id = self.tasks[0]['id']
                 append_text(f"Testing time-entries POST endpoint with task ID {test_task_id}...", "header")
                 
-                # Format the datetime as ISO 8601 string without timezone information
-                start_time = datetime.now().isoformat(timespec='seconds')
+                # Format the datetime as ISO 8601 string with the local UTC offset
+                start_time = datetime.now().astimezone().isoformat(timespec='seconds')
                 
                 test_data = {
                     'task_id': test_task_id,
@@ -1313,7 +1318,7 @@ class TimeTrackerApp:
                 # Add headers to indicate JSON content
                 headers = {'Content-Type': 'application/json'}
                 
-                response = requests.post(
+                response = session.post(
                     f"{self.api_url}/time-entries/", 
                     json=test_data, 
                     headers=headers,
@@ -1330,8 +1335,8 @@ class TimeTrackerApp:
                     if entry_id:
                         append_text(f"Testing time-entries PUT endpoint with entry ID {entry_id}...", "header")
                         
-                        # Format end_time as ISO 8601 string without timezone information
-                        end_time = datetime.now().isoformat(timespec='seconds')
+                        # Format end_time as ISO 8601 string with the local UTC offset
+                        end_time = datetime.now().astimezone().isoformat(timespec='seconds')
                         
                         update_data = {
                             'end_time': end_time,
@@ -1339,7 +1344,7 @@ class TimeTrackerApp:
                             'notes': 'Test entry'
                         }
                         
-                        update_response = requests.put(
+                        update_response = session.put(
                             f"{self.api_url}/time-entries/{entry_id}", 
                             json=update_data, 
                             headers=headers,
@@ -3,6 +3,7 @@ import json
 import time
 import logging
 import requests
+from chrona_client import session, get_list, decode, Heartbeat
 import traceback
 from datetime import datetime
 from threading import Thread
@@ -398,6 +399,7 @@ class TimeTrackerApp(App):
         self.current_task_name = None
         self.start_time = None
         self.entry_id = None
+        self.heartbeat = Heartbeat()
         self.mini_timer = None
         self.task_screen = None
         self.command_queue = Queue()
@@ -500,11 +502,11 @@ class TimeTrackerApp(App):
             # Run in a separate thread to not block UI
             def _fetch_tasks():
                 try:
-                    response = requests.get(f"{self.api_url}/tasks/")
+                    response = get_list(f"{self.api_url}/tasks/")
                     logger.info(f"Tasks API status code: {response.status_code}")
                     
                     if response.status_code == 200:
-                        self.tasks = response.json()
+                        self.tasks = decode(response)
                         logger.info(f"Fetched {len(self.tasks)} tasks")
                         
                         # Update UI in main thread
@@ -672,6 +674,10 @@ class TimeTrackerApp(App):
     
     def update_timer(self, dt):
         """Update the timer display"""
+        if self.is_tracking:
+            # The entry stays open while paused, keep it alive
+            self.heartbeat.tick(self.api_url, self.entry_id)
+        
         if self.is_tracking and self.start_time and not self.is_paused:
             duration = self.calculate_duration()
             formatted = self.format_duration(duration)
@@ -728,8 +734,8 @@ class TimeTrackerApp(App):
     def create_time_entry(self, task_id):
         """Create a new time entry in the API"""
         try:
-            # Format the datetime as ISO 8601 string
-            start_time = datetime.now().replace(microsecond=0).isoformat()
+            # Format the datetime as ISO 8601 string with the local UTC offset
+            start_time = datetime.now().astimezone().replace(microsecond=0).isoformat()
             
             data = {
                 'task_id': task_id,
@@ -745,7 +751,7 @@ class TimeTrackerApp(App):
             # Add headers
             headers = {'Content-Type': 'application/json'}
             
-            response = requests.post(
+            response = session.post(
                 f"{self.api_url}/time-entries/", 
                 json=data, 
                 headers=headers,
@@ -770,8 +776,8 @@ class TimeTrackerApp(App):
     def update_time_entry(self, entry_id):
         """Update a time entry in the API"""
         try:
-            # Format end_time as ISO 8601 string
-            end_time = datetime.now().replace(microsecond=0).isoformat()
+            # Format end_time as ISO 8601 string with the local UTC offset
+            end_time = datetime.now().astimezone().replace(microsecond=0).isoformat()
             
             # Calculate duration in minutes
             duration_minutes = self.calculate_duration() / 60
@@ -788,7 +794,7 @@ class TimeTrackerApp(App):
             # Add headers
             headers = {'Content-Type': 'application/json'}
             
-            response = requests.put(
+            response = session.put(
                 f"{self.api_url}/time-entries/{entry_id}", 
                 json=data, 
                 headers=headers,
@@ -815,7 +821,7 @@ class TimeTrackerApp(App):
         def _test_api():
             try:
                 logger.info(f"Testing API connection to {self.api_url}...")
-                response = requests.get(f"{self.api_url}/")
+                response = session.get(f"{self.api_url}/")
                 
                 if response.status_code == 200:
                     logger.info("API connection successful!")